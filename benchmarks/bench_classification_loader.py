@@ -0,0 +1,91 @@
+"""
+Throughput of the classification DataLoader built by PytorchApiClient.build_dataset.
+
+Synthetic JPEG images are written to a temporary folder and registered in a synthetic
+database, then batches are drawn from the loader for several worker counts, with and
+without the pre-decoded TensorCache, and the throughput is reported in images/sec.
+
+    python benchmarks/bench_classification_loader.py --images 5000 --workers 0 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+from peewee import chunked
+
+from dao import db, DatasetEntity, DatasetEntryEntity, LabelEntity
+from core.pytorch_api_client import PytorchApiClient
+
+
+def populate(folder, n_images, n_labels, width, height):
+    rnd = np.random.RandomState(0)
+    dataset_id = DatasetEntity.create(name="bench", description="", folder=folder, date="2020-01-01").id
+    LabelEntity.insert_many([("Label{}".format(i), "#ffffff", dataset_id) for i in range(n_labels)],
+                            fields=["name", "color", "dataset"]).execute()
+    labels = [row.id for row in LabelEntity.select(LabelEntity.id)]
+    rows = []
+    for i in range(n_images):
+        path = os.path.join(folder, "img_{:08d}.jpg".format(i))
+        # smooth gradients plus noise, closer to the size of a photo than pure noise
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = np.clip(base + rnd.randint(0, 64, (height, width, 3)), 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).save(path, quality=90)
+        rows.append((path, os.path.getsize(path), dataset_id, labels[i % n_labels], width, height, 3))
+    with db.atomic():
+        for batch in chunked(rows, 5000):
+            DatasetEntryEntity.insert_many(
+                batch, fields=["file_path", "file_size", "dataset", "label", "width", "height", "channels"]).execute()
+    return dataset_id
+
+
+def measure(loader, max_batches):
+    iterator = iter(loader)
+    # the first batch includes the worker start up
+    next(iterator)
+    images, start = 0, time.perf_counter()
+    for index, (batch, _) in enumerate(iterator):
+        images += len(batch)
+        if index + 1 >= max_batches:
+            break
+    return images / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=5000)
+    parser.add_argument("--labels", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 4, 8])
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="cvstudio_bench_")
+    db.init(os.path.join(folder, "studio.db"), pragmas=dict(db._pragmas))
+    with db.connection_context():
+        db.create_tables([DatasetEntity, DatasetEntryEntity, LabelEntity])
+        print("writing {:,} images of {}x{} ...".format(args.images, args.width, args.height))
+        dataset_id = populate(folder, args.images, args.labels, args.width, args.height)
+
+    client = PytorchApiClient()
+    cache_folder = os.path.join(folder, "cache")
+    start = time.perf_counter()
+    client.build_dataset(dataset_id, workers=0, cache_folder=cache_folder)
+    print("cache built in {:.2f}s".format(time.perf_counter() - start))
+
+    print("{:<10}{:>10}{:>20}".format("source", "workers", "images/sec"))
+    for workers in args.workers:
+        for source, cache in (("decode", None), ("cache", cache_folder)):
+            loader = client.build_dataset(dataset_id, batch_size=args.batch_size, workers=workers, cache_folder=cache)
+            print("{:<10}{:>10}{:>20,.0f}".format(source, workers, measure(loader, args.batches)))
+
+
+if __name__ == "__main__":
+    main()
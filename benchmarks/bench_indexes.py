@@ -0,0 +1,126 @@
+"""
+Before/after benchmark for the secondary indexes created by schema migration 1.
+
+A synthetic database is populated and every index the baseline models did not create
+is dropped, which emulates a studio.db created before the migration. The hot DAO queries
+are timed, the migrations are applied and the same queries are timed again.
+
+    python benchmarks/bench_indexes.py --annotations 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import chunked
+
+from dao import db, AnnotaDao, LabelDao, DatasetEntity, DatasetEntryEntity, LabelEntity, AnnotationEntity
+from dao.migrations import run_migrations, set_version
+
+# indexes created by the baseline models, the foreign key ones come from peewee's ForeignKeyField
+BASELINE_INDEXES = {
+    "annotationentity_entry_id",
+    "annotationentity_label_id",
+    "labelentity_dataset_id",
+    "datasetentryentity_dataset_id",
+    "datasetentryentity_file_path_dataset_id"
+}
+
+
+def populate(n_annotations, annotations_per_entry, n_labels, n_datasets):
+    n_entries = max(n_annotations // annotations_per_entry, 1)
+    with db.atomic():
+        datasets = []
+        for i in range(n_datasets):
+            datasets.append(DatasetEntity.create(name="ds{}".format(i), description="", folder="", date="2020-01-01").id)
+        label_rows = [("Label{}".format(i), "#ffffff", datasets[i % n_datasets]) for i in range(n_labels * n_datasets)]
+        LabelEntity.insert_many(label_rows, fields=["name", "color", "dataset"]).execute()
+        labels = [row.id for row in LabelEntity.select(LabelEntity.id)]
+        entry_rows = (("/data/img_{:08d}.jpg".format(i), 1024, datasets[i % n_datasets], random.choice(labels))
+                      for i in range(n_entries))
+        for batch in chunked(entry_rows, 5000):
+            DatasetEntryEntity.insert_many(batch, fields=["file_path", "file_size", "dataset", "label"]).execute()
+        annotation_rows = ((i % n_entries + 1, random.choice(labels), "10,10,200,200", "box")
+                           for i in range(n_annotations))
+        for batch in chunked(annotation_rows, 5000):
+            AnnotationEntity.insert_many(batch, fields=["entry", "label", "points", "kind"]).execute()
+    return datasets, labels, n_entries
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run_queries(datasets, labels, n_entries, repeat):
+    labels_dao = LabelDao()
+    annot_dao = AnnotaDao()
+    rnd = random.Random(0)
+    results = dict()
+    results["AnnotaDao.fetch_all"] = timed(lambda: annot_dao.fetch_all(rnd.randint(1, n_entries)), repeat)
+    results["LabelDao.find_by_name"] = timed(
+        lambda: labels_dao.find_by_name(rnd.choice(datasets), "Label{}".format(rnd.randint(0, len(labels) - 1))),
+        repeat)
+
+    def untag_label():
+        with db.atomic() as txn:
+            DatasetEntryEntity.update(label=None).where(DatasetEntryEntity.label == rnd.choice(labels)).execute()
+            txn.rollback()
+
+    def delete_entry():
+        with db.atomic() as txn:
+            DatasetEntryEntity.delete_by_id(rnd.randint(1, n_entries))
+            txn.rollback()
+
+    with db.connection_context():
+        results["untag entries by label"] = timed(untag_label, max(repeat // 10, 1))
+        results["cascade delete entry"] = timed(delete_entry, max(repeat // 10, 1))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--annotations", type=int, default=1000000)
+    parser.add_argument("--per-entry", type=int, default=10)
+    parser.add_argument("--labels", type=int, default=50)
+    parser.add_argument("--datasets", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp(prefix="cvstudio_bench_")
+    db.init(os.path.join(folder, "studio.db"), pragmas=dict(db._pragmas))
+    with db.connection_context():
+        db.create_tables([DatasetEntity, DatasetEntryEntity, LabelEntity, AnnotationEntity])
+        print("populating {:,} annotations ...".format(args.annotations))
+        datasets, labels, n_entries = populate(args.annotations, args.per_entry, args.labels, args.datasets)
+        # emulate a database created before the indexes existed, keeping the baseline ones
+        index_names = [row[0] for row in db.execute_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()]
+        for index_name in index_names:
+            if index_name not in BASELINE_INDEXES:
+                db.execute_sql('DROP INDEX "{}"'.format(index_name))
+        set_version(db, 0)
+        db.execute_sql("ANALYZE")
+
+    before = run_queries(datasets, labels, n_entries, args.repeat)
+    with db.connection_context():
+        start = time.perf_counter()
+        # only the migration that creates the indexes, the later ones change the tables too
+        run_migrations(db, target_version=1)
+        migration_time = time.perf_counter() - start
+    after = run_queries(datasets, labels, n_entries, args.repeat)
+
+    print("migration applied in {:.2f}s".format(migration_time))
+    print("{:<28}{:>14}{:>14}{:>10}".format("query", "before (ms)", "after (ms)", "speedup"))
+    for name in before:
+        print("{:<28}{:>14.3f}{:>14.3f}{:>9.1f}x".format(name, before[name], after[name], before[name] / after[name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Latency of a single interactive prediction with PyTorch eager and with ONNX Runtime.
+
+A hub model is loaded through a ModelRegistry for each backend, the ONNX one exported to
+the user data folder on its first use, then one preprocessed image is run through it
+repeatedly as the inference server does for a lone request. The load time and the
+forward pass latency percentiles are reported for every thread count, torch gets the
+same number of intra-op threads as the onnxruntime session.
+
+    python benchmarks/bench_onnx_latency.py --repo pytorch/vision --model deeplabv3_resnet50 --threads 1 2 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+
+from core import inference
+from core.framework import Framework
+from core.model_registry import ModelRegistry
+
+BACKENDS = (("eager", Framework.PyTorch), ("onnxruntime", Framework.ONNX))
+
+
+def load_image(path, width, height):
+    if path:
+        return cv2.cvtColor(cv2.imread(path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    # smooth gradients plus noise, closer to a photo than pure noise
+    base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    return np.clip(base + np.random.RandomState(0).randint(0, 64, (height, width, 3)), 0, 255).astype(np.uint8)
+
+
+def time_backend(repo, model_name, framework, threads, image, runs, warmup):
+    torch.set_num_threads(threads)
+    registry = ModelRegistry()
+    registry.onnx_threads = threads
+    start = time.perf_counter()
+    model = registry.get(repo, model_name, "cpu", framework)
+    load = time.perf_counter() - start
+    # the kind is cached per model, the other backend finds the same one
+    segmentation = inference.is_segmentation_model(model, repo, model_name, "cpu")
+    tensor = inference.hub_preprocess(image, segmentation)
+    latencies = []
+    for run in range(warmup + runs):
+        start = time.perf_counter()
+        inference.run_hub_model(model, [tensor], "cpu", segmentation)
+        if run >= warmup:
+            latencies.append((time.perf_counter() - start) * 1000)
+    return load, np.percentile(latencies, [50, 95]).tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", default="pytorch/vision")
+    parser.add_argument("--model", default="deeplabv3_resnet50")
+    parser.add_argument("--image", help="image predicted, a synthetic one by default")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, os.cpu_count() or 4])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    args = parser.parse_args()
+
+    image = load_image(args.image, args.width, args.height)
+    print("{} CPUs, {} : {}, image {}x{}".format(os.cpu_count(), args.repo, args.model, image.shape[1], image.shape[0]))
+    print("{:<14}{:>8}{:>10}{:>10}{:>10}".format("backend", "threads", "load s", "p50 ms", "p95 ms"))
+    for threads in args.threads:
+        for name, framework in BACKENDS:
+            load, (p50, p95) = time_backend(args.repo, args.model, framework, threads, image, args.runs, args.warmup)
+            print("{:<14}{:>8}{:>10.2f}{:>10.1f}{:>10.1f}".format(name, threads, load, p50, p95))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Cost of the worker pools of the file per image exporters and of the Pascal VOC reader.
+
+Synthetic annotation groups are exported with JsonWriter and PascalVOCWriter, and the
+Pascal VOC files read back with PascalVOCReader, in the calling thread, in a thread pool
+and in a spawned process pool, for several dataset sizes. A process spawned from the
+application imports cvstudio.py again, --app-imports makes the spawned processes of the
+benchmark import PyQt5 and torch the same way to include that cost.
+
+    python benchmarks/bench_parallel_io.py --images 200 1000 5000 20000 --app-imports
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if os.environ.get("CVSTUDIO_BENCH_APP_IMPORTS"):
+    # executed again by every spawned process, like the imports of cvstudio.py
+    import PyQt5.QtWidgets
+    import torch
+
+import numpy as np
+
+from formats import JsonWriter, PascalVOCWriter
+from formats.parallel import map_batches
+from formats.pascal_voc_reader import _read_batch
+
+MODES = ("calling thread", "threads", "spawn")
+
+
+def annotation_groups(n_images, per_image):
+    for i in range(n_images):
+        rows = [{
+            "entry_id": i + 1,
+            "image_width": 640,
+            "image_height": 480,
+            "image_channels": 3,
+            "annot_kind": "box",
+            "annot_geometry": np.array([[10, 10], [200, 300]]),
+            "annot_points": "10,10,200,300",
+            "label_name": "Label{}".format(j),
+            "label_color": "#ffffff"
+        } for j in range(per_image)]
+        yield "/data/img_{:08d}.jpg".format(i), rows
+
+
+def time_writer(writer_class, n_images, per_image, mode):
+    writer = writer_class(tempfile.mkdtemp(prefix="cvstudio_bench_"))
+    writer.threads = mode == "threads"
+    start = time.perf_counter()
+    writer.export(annotation_groups(n_images, per_image), workers=0 if mode == MODES[0] else None)
+    return time.perf_counter() - start, writer.output_folder
+
+
+def time_reader(files, mode):
+    start = time.perf_counter()
+    for _ in map_batches(_read_batch, files, 64, 0 if mode == MODES[0] else None, threads=mode == "threads"):
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, nargs="+", default=[200, 1000, 5000, 20000])
+    parser.add_argument("--per-image", type=int, default=5)
+    parser.add_argument("--app-imports", action="store_true",
+                        help="make the spawned processes import PyQt5 and torch like the application does")
+    args = parser.parse_args()
+    if args.app_imports:
+        os.environ["CVSTUDIO_BENCH_APP_IMPORTS"] = "1"
+
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:<18}{:>8}".format("task", "images") + "".join("{:>16}".format(mode) for mode in MODES))
+    for n_images in args.images:
+        voc_folder = None
+        for writer_class in (JsonWriter, PascalVOCWriter):
+            times = []
+            for mode in MODES:
+                elapsed, folder = time_writer(writer_class, n_images, args.per_image, mode)
+                times.append(elapsed)
+                if writer_class is PascalVOCWriter:
+                    voc_folder = folder
+            print("{:<18}{:>8}".format(writer_class.__name__, n_images) + "".join("{:>15.2f}s".format(t) for t in times))
+        files = [os.path.join(voc_folder, name) for name in os.listdir(voc_folder)]
+        times = [time_reader(files, mode) for mode in MODES]
+        print("{:<18}{:>8}".format("PascalVOCReader", n_images) + "".join("{:>15.2f}s".format(t) for t in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
 from .app_constants import LOADING_GIF
-from .misc import COCO_INSTANCE_CATEGORY_NAMES
\ No newline at end of file
+from .misc import COCO_INSTANCE_CATEGORY_NAMES, VOC_SEGMENTATION_CATEGORY_NAMES
\ No newline at end of file
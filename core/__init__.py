@@ -1,2 +1,6 @@
 from .hub_factory import *
 from .api_factory import *
+from .model_registry import ModelRegistry
+from .inference_server import InferenceClient, InferenceError
+from .auto_label_job import AutoLabelJob, AutoLabelResult
+from .onnx_backend import OnnxModel
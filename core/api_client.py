@@ -7,5 +7,5 @@ class ApiClient(metaclass=ABCMeta):
         raise NotImplementedError
 
     @abstractmethod
-    def build_dataset(self, dataset_id: int):
+    def build_dataset(self, dataset_id: int, **kwargs):
         raise NotImplementedError
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import typing
+from collections import deque
+
+import cv2
+import numpy as np
+from torch.utils.data import Dataset, DataLoader
+
+from constants import VOC_SEGMENTATION_CATEGORY_NAMES
+from vo import AnnotaVO, LabelVO
+from .inference_server import InferenceClient
+
+
+class AutoLabelDataset(Dataset):
+    """
+    Decodes the images in the DataLoader workers, items are (entry id, RGB image or None
+    when the file can not be read)
+    """
+
+    def __init__(self, entries: typing.List[typing.Tuple[int, str]]):
+        self.entry_ids = np.array([entry_id for entry_id, _ in entries], dtype=np.int64)
+        self.paths = np.array([path for _, path in entries], dtype=np.str_)
+
+    def __len__(self):
+        return len(self.entry_ids)
+
+    def __getitem__(self, idx):
+        entry_id = int(self.entry_ids[idx])
+        image = cv2.imread(str(self.paths[idx]), cv2.IMREAD_COLOR)
+        if image is None:
+            return entry_id, None
+        return entry_id, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def collate_images(samples):
+    """
+    Returns (entry ids, images, ids of the unreadable files), the images keep their size,
+    the inference server preprocesses and batches them for the kind of the model
+    """
+    failed = [entry_id for entry_id, image in samples if image is None]
+    samples = [sample for sample in samples if sample[1] is not None]
+    return [entry_id for entry_id, _ in samples], [image for _, image in samples], failed
+
+
+class AutoLabelResult:
+    def __init__(self):
+        self.entries = 0
+        self.processed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.annotations = 0
+        self.labeled = 0
+        self.resumed_after = 0
+        self.completed = False
+        self.elapsed = 0.0
+
+    @property
+    def images_per_second(self):
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+
+class AutoLabelJob:
+    """
+    Runs a hub model over a whole dataset, or over some of its entries, and stores the
+    predictions: polygons for segmentation models, the entry label for classification
+    models. Classes are mapped to the dataset labels by name, missing labels are created.
+
+    The images are decoded by the DataLoader workers and sent in batches to the inference
+    server, which runs the model, so the models are only loaded in the server process and
+    the job shares its batching with the interactive predictions. The next batch is
+    submitted before the results of the previous one are stored. Results are written every commit_every batches with bulk inserts, together with a
+    checkpoint of the last entry id written, so a cancelled or interrupted job resumes after
+    it when it is started again with the same dataset, model and entries. Entries that
+    already have annotations are skipped unless overwrite is set. The checkpoint is removed
+    once the job completes.
+    progress_callback receives [processed, total, annotations, images/s].
+    """
+
+    def __init__(self, dataset_id: int, repo: str, model_name: str, dataset_dao, label_dao, annot_dao,
+                 entry_ids: typing.List[int] = None, batch_size: int = 8, workers: int = 4, overwrite: bool = False,
+                 tolerance: float = 2.0, min_area: float = 100, commit_every: int = 16,
+                 checkpoint_folder: str = "checkpoints", colors: typing.List[str] = None,
+                 client: InferenceClient = None):
+        self.dataset_id = dataset_id
+        self.repo = repo
+        self.model_name = model_name
+        self.entry_ids = None if entry_ids is None else sorted(set(entry_ids))
+        self.batch_size = batch_size
+        self.workers = workers
+        self.overwrite = overwrite
+        self.tolerance = tolerance
+        self.min_area = min_area
+        self.commit_every = commit_every
+        self.checkpoint_folder = checkpoint_folder
+        self._ds_dao = dataset_dao
+        self._label_dao = label_dao
+        self._annot_dao = annot_dao
+        self._colors = colors
+        self._client = client or InferenceClient.default()
+        self._labels = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def checkpoint_file(self):
+        key = hashlib.sha1(json.dumps([self.dataset_id, self.repo, self.model_name, self.entry_ids]).encode("utf-8"))
+        return os.path.join(self.checkpoint_folder, "auto_label_{}_{}.json".format(self.dataset_id, key.hexdigest()[:12]))
+
+    def _read_checkpoint(self):
+        try:
+            with open(self.checkpoint_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_checkpoint(self, last_entry_id, result):
+        os.makedirs(self.checkpoint_folder, exist_ok=True)
+        state = {
+            "dataset_id": self.dataset_id,
+            "repo": self.repo,
+            "model_name": self.model_name,
+            "last_entry_id": last_entry_id,
+            "annotations": result.annotations,
+            "labeled": result.labeled
+        }
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        # atomic, the checkpoint is never seen half written
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _label_id(self, name):
+        if self._labels is None:
+            self._labels = {vo.name: vo.id for vo in self._label_dao.fetch_all(self.dataset_id)}
+        name = name.title()
+        if name not in self._labels:
+            vo = LabelVO()
+            vo.name = name
+            vo.dataset = self.dataset_id
+            vo.color = random.choice(self._colors) if self._colors else "#{:06x}".format(random.randint(0, 0xFFFFFF))
+            self._labels[name] = self._label_dao.save_many([vo])[0].id
+        return self._labels[name]
+
+    def _segmentation_annotations(self, entry_id, polygons):
+        entry_annotations = []
+        for class_idx, polygon in polygons:
+            name = VOC_SEGMENTATION_CATEGORY_NAMES[class_idx] \
+                if class_idx < len(VOC_SEGMENTATION_CATEGORY_NAMES) else "class {}".format(class_idx)
+            vo = AnnotaVO()
+            vo.entry = entry_id
+            vo.label = self._label_id(name)
+            vo.geometry = polygon
+            vo.kind = "polygon"
+            entry_annotations.append(vo)
+        return entry_annotations
+
+    def _loader(self, entries):
+        loader_args = dict(batch_size=self.batch_size, shuffle=False, num_workers=self.workers,
+                           collate_fn=collate_images)
+        if self.workers > 0:
+            # spawn: forking a process that runs Qt and database threads is not safe
+            loader_args.update(multiprocessing_context="spawn", prefetch_factor=4)
+        return DataLoader(AutoLabelDataset(entries), **loader_args)
+
+    def run(self, progress_callback: typing.Callable[[list], None] = None) -> AutoLabelResult:
+        start = time.perf_counter()
+        result = AutoLabelResult()
+        checkpoint = self._read_checkpoint()
+        result.resumed_after = last_entry_id = checkpoint.get("last_entry_id", 0)
+        result.annotations = checkpoint.get("annotations", 0)
+        result.labeled = checkpoint.get("labeled", 0)
+        entries = self._ds_dao.fetch_entry_paths(self.dataset_id, self.entry_ids, after_id=last_entry_id)
+        if not self.overwrite:
+            annotated = self._annot_dao.fetch_annotated_entry_ids(entry_id for entry_id, _ in entries)
+            entries = [entry for entry in entries if entry[0] not in annotated]
+            result.skipped = len(annotated)
+        result.entries = len(entries)
+        pending_annotations, pending_labels, batches = {}, [], 0
+        submitted = deque()
+
+        def commit():
+            nonlocal pending_annotations, pending_labels
+            if pending_annotations:
+                result.annotations += self._annot_dao.save_many(pending_annotations)
+            if pending_labels:
+                self._ds_dao.set_entry_labels(pending_labels)
+                result.labeled += len(pending_labels)
+            pending_annotations, pending_labels = {}, []
+            self._write_checkpoint(last_entry_id, result)
+
+        def store(entry_ids, futures, failed):
+            nonlocal last_entry_id, batches
+            for entry_id, future in zip(entry_ids, futures):
+                kind, prediction = future.result()
+                if kind == "polygons":
+                    entry_annotations = self._segmentation_annotations(entry_id, prediction)
+                    if entry_annotations:
+                        pending_annotations[entry_id] = entry_annotations
+                else:
+                    pending_labels.append((entry_id, self._label_id(prediction[1])))
+            result.failed += len(failed)
+            result.processed += len(entry_ids) + len(failed)
+            # the loader keeps the id order, everything up to the last id of the batch is done
+            last_entry_id = max(entry_ids + failed)
+            batches += 1
+            if batches % self.commit_every == 0:
+                commit()
+            result.elapsed = time.perf_counter() - start
+            if progress_callback:
+                progress_callback([result.processed, result.entries, result.annotations, result.images_per_second])
+
+        try:
+            for entry_ids, images, failed in self._loader(entries):
+                if self._cancelled.is_set():
+                    break
+                futures = self._client.submit_batch("auto_label", images, repo=self.repo, model_name=self.model_name,
+                                                    tolerance=self.tolerance, min_area=self.min_area)
+                submitted.append((entry_ids, futures, failed))
+                if len(submitted) > 1:
+                    store(*submitted.popleft())
+            while submitted and not self._cancelled.is_set():
+                store(*submitted.popleft())
+        finally:
+            # the batches not stored yet are dropped, a resumed job runs them again
+            for _, futures, _ in submitted:
+                for future in futures:
+                    future.cancel()
+        commit()
+        result.completed = not self._cancelled.is_set()
+        if result.completed:
+            os.remove(self.checkpoint_file)
+        result.elapsed = time.perf_counter() - start
+        return result
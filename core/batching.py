@@ -0,0 +1,150 @@
+import threading
+import time
+import typing
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Pending:
+    __slots__ = ("item", "future", "submitted")
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class BatchMetrics:
+    """
+    Counters of the batches run for one key, latencies are kept for the last window requests
+    """
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.batches = 0
+        self.cancelled = 0
+        self.batch_sizes = Counter()
+        self.queue_ms = deque(maxlen=window)
+        self.total_ms = deque(maxlen=window)
+
+    def to_dict(self) -> dict:
+        def percentiles(values):
+            if not values:
+                return {"p50": None, "p95": None, "max": None}
+            p50, p95 = np.percentile(values, [50, 95]).tolist()
+            return {"p50": p50, "p95": p95, "max": max(values)}
+
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "cancelled": self.cancelled,
+            "mean_batch_size": (self.requests - self.cancelled) / self.batches if self.batches else 0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "queue_ms": percentiles(self.queue_ms),
+            "latency_ms": percentiles(self.total_ms)
+        }
+
+
+class BatchScheduler:
+    """
+    Coalesces the requests submitted for the same key, typically a model, into batches.
+
+    A batch is run as soon as max_batch_size requests are waiting for its key or the
+    oldest one has waited max_wait_ms, so a lone request is only delayed by max_wait_ms
+    while concurrent ones share a forward pass. run_batch(key, items) is called from the
+    scheduler thread and must return one result per item, or raise to fail the whole
+    batch. Batches run one at a time, the keys waiting take turns so a long stream of
+    requests for one key, like an auto label job, does not hold back the others. Cancelled
+    requests are dropped before their batch starts.
+    """
+
+    def __init__(self, run_batch: typing.Callable[[typing.Hashable, list], list], max_batch_size: int = 8,
+                 max_wait_ms: float = 10):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queues = OrderedDict()
+        self._metrics = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: typing.Hashable, item) -> Future:
+        pending = _Pending(item)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the batch scheduler is closed")
+            self._queues.setdefault(key, deque()).append(pending)
+            self._metrics.setdefault(key, BatchMetrics()).requests += 1
+            self._cond.notify()
+        return pending.future
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return {str(key): metrics.to_dict() for key, metrics in self._metrics.items()}
+
+    def close(self, timeout=None):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        """
+        Waits for a batch that is full or old enough, returns (key, pending requests) or None once closed
+        """
+        with self._cond:
+            while True:
+                now = time.perf_counter()
+                wait = None
+                for key, queue in self._queues.items():
+                    if len(queue) >= self.max_batch_size or self._closed or \
+                            (now - queue[0].submitted) * 1000 >= self.max_wait_ms:
+                        batch = [queue.popleft() for _ in range(min(self.max_batch_size, len(queue)))]
+                        if not queue:
+                            del self._queues[key]
+                        else:
+                            self._queues.move_to_end(key)
+                        return key, batch
+                    remaining = self.max_wait_ms / 1000 - (now - queue[0].submitted)
+                    wait = remaining if wait is None else min(wait, remaining)
+                if self._closed:
+                    return None
+                self._cond.wait(wait)
+
+    def _run(self):
+        while True:
+            next_batch = self._next_batch()
+            if next_batch is None:
+                return
+            key, batch = next_batch
+            # set_running_or_notify_cancel is False for the requests cancelled while waiting
+            running = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+            started = time.perf_counter()
+            with self._cond:
+                metrics = self._metrics[key]
+                metrics.cancelled += len(batch) - len(running)
+            batch = running
+            if not batch:
+                continue
+            try:
+                results = self.run_batch(key, [pending.item for pending in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError("run_batch returned {} results for {} items".format(len(results), len(batch)))
+            except Exception as ex:
+                for pending in batch:
+                    pending.future.set_exception(ex)
+                results = None
+            finished = time.perf_counter()
+            with self._cond:
+                metrics.batches += 1
+                metrics.batch_sizes[len(batch)] += 1
+                for pending in batch:
+                    metrics.queue_ms.append((started - pending.submitted) * 1000)
+                    metrics.total_ms.append((finished - pending.submitted) * 1000)
+            if results is not None:
+                for pending, result in zip(batch, results):
+                    pending.future.set_result(result)
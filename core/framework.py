@@ -4,3 +4,4 @@ from enum import Enum, auto
 class Framework:
     PyTorch = auto()
     TensorFlow = auto()
+    ONNX = auto()
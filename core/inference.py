@@ -0,0 +1,262 @@
+"""
+Model predictions on decoded RGB images (H, W, 3) uint8, returning plain lists so the
+results can cross a process boundary. Models are taken from the ModelRegistry of the
+calling process.
+"""
+import functools
+import json
+import typing
+from collections import OrderedDict
+
+import cv2
+import imutils
+import numpy as np
+import torch
+from torchvision import transforms
+
+from formats import geometry
+from .model_registry import ModelRegistry, default_device
+
+DEXTR_PAD = 50
+DEXTR_THRESHOLD = 0.8
+DEXTR_SIZE = 512
+SEGMENTATION_SIZE = 480
+CLASSIFICATION_RESIZE = 256
+CLASSIFICATION_SIZE = 224
+
+# (repo, model name) -> whether the hub model was found to be a segmentation model
+_segmentation_models = {}
+
+
+@functools.lru_cache(maxsize=1)
+def imagenet_classes():
+    with open("./data/imagenet_class_index.json") as f:
+        return json.load(f)
+
+
+def as_rgb(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return np.repeat(image[..., None], 3, axis=2)
+    return image[..., :3]
+
+
+def mask_contours(mask: np.ndarray) -> list:
+    """
+    Outer and inner contours of a binary mask as lists of [x, y] points
+    """
+    contour_list = cv2.findContours(mask.astype(np.uint8) * 255, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    contour_list = imutils.grab_contours(contour_list)
+    return [contour.reshape(-1, 2).tolist() for contour in contour_list]
+
+
+def is_segmentation_model(model, repo: str, model_name: str, device: str) -> bool:
+    """
+    Whether a hub model is a segmentation model, found once per model: an ONNX session
+    knows it from its export, a PyTorch model is run on a blank input, the segmentation
+    models return an OrderedDict
+    """
+    key = (repo, model_name)
+    if key not in _segmentation_models:
+        segmentation = getattr(model, "segmentation", None)
+        if segmentation is None:
+            with torch.no_grad():
+                output = model(torch.zeros((1, 3, CLASSIFICATION_SIZE, CLASSIFICATION_SIZE)).to(device))
+            segmentation = isinstance(output, OrderedDict)
+        _segmentation_models[key] = segmentation
+    return _segmentation_models[key]
+
+
+def hub_preprocess(image: np.ndarray, segmentation: bool = True):
+    """
+    (3, H, W) float tensor of an RGB image, normalized. Segmentation inputs are resized to
+    a shorter side of 480 and keep their aspect ratio, classification inputs are resized
+    to 256 and center cropped to 224 x 224 like the models were trained, so they all have
+    the same size and batch together
+    """
+    if segmentation:
+        resize = [transforms.Resize(SEGMENTATION_SIZE)]
+    else:
+        resize = [transforms.Resize(CLASSIFICATION_RESIZE), transforms.CenterCrop(CLASSIFICATION_SIZE)]
+    preprocess = transforms.Compose(resize + [
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+    ])
+    return preprocess(torch.from_numpy(np.ascontiguousarray(as_rgb(image))).permute(2, 0, 1).float().div_(255))
+
+
+def pad_batch(tensors):
+    """
+    Pads the (3, H, W) tensors at the bottom right to the largest size among them and
+    stacks them, returns the batch and the unpadded (H, W) sizes
+    """
+    sizes = [tuple(tensor.shape[1:]) for tensor in tensors]
+    height, width = max(size[0] for size in sizes), max(size[1] for size in sizes)
+    # zero is the mean color once normalized
+    batch = torch.zeros((len(tensors), 3, height, width))
+    for index, tensor in enumerate(tensors):
+        batch[index, :, :tensor.shape[1], :tensor.shape[2]] = tensor
+    return batch, sizes
+
+
+def run_hub_model(model, tensors, device: str, segmentation: bool) -> list:
+    """
+    Runs a hub model on the (3, H, W) tensors made by hub_preprocess in a single forward
+    pass, returns per tensor the (classes, H, W) logits cropped to its size for segmentation
+    models, the class scores otherwise. Segmentation inputs are padded into one batch, the
+    classification inputs all have the same size and are stacked as they are
+    """
+    if segmentation:
+        batch, sizes = pad_batch(tensors)
+        with torch.no_grad():
+            logits = model(batch.to(device))["out"]
+        return [logits[index, :, :height, :width] for index, (height, width) in enumerate(sizes)]
+    with torch.no_grad():
+        return list(model(torch.stack(tensors).to(device)))
+
+
+def label_map(logits, image_size) -> np.ndarray:
+    """
+    (H, W) map of the classes predicted by the (classes, H, W) logits of one image, resized
+    to the original image size
+    """
+    predictions = logits.argmax(0).byte().cpu().numpy()
+    height, width = image_size
+    return cv2.resize(predictions, (width, height), interpolation=cv2.INTER_NEAREST)
+
+
+def segment(logits, image_size):
+    """
+    {class index: [contours]} of the classes predicted by the (classes, H, W) logits of one
+    image, background excluded
+    """
+    predictions = label_map(logits, image_size)
+    return {class_idx: mask_contours(predictions == class_idx)
+            for class_idx in np.unique(predictions).tolist() if class_idx != 0}
+
+
+def mask_polygons(predictions: np.ndarray, tolerance: float = 2.0, min_area: float = 100) -> list:
+    """
+    (class index, (N, 2) polygon) of the outer contours of every class of a label map,
+    background excluded. The areas of all the contours are computed at once to drop the
+    small ones, the others are simplified with a tolerance in pixels.
+    """
+    classes = np.flatnonzero(np.bincount(predictions.ravel()))
+    contours, contour_classes = [], []
+    for class_idx in classes[classes != 0].tolist():
+        found = cv2.findContours((predictions == class_idx).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                 cv2.CHAIN_APPROX_SIMPLE)[-2]
+        contours.extend(contour for contour in found if len(contour) >= 3)
+        contour_classes.extend([class_idx] * (len(contours) - len(contour_classes)))
+    if not contours:
+        return []
+    points, starts = geometry.concatenate([contour.reshape(-1, 2) for contour in contours])
+    areas = geometry.polygon_areas(points, starts)
+    polygons = []
+    for index in np.flatnonzero(areas >= min_area).tolist():
+        polygon = cv2.approxPolyDP(contours[index], tolerance, True).reshape(-1, 2)
+        if len(polygon) >= 3:
+            polygons.append((contour_classes[index], polygon))
+    return polygons
+
+
+def classify(logits):
+    """
+    [wordnet id, class name] of the imagenet class with the highest score
+    """
+    class_id = logits.data.squeeze().argmax(0).item()
+    return imagenet_classes()[str(class_id)]
+
+
+def _hub_outputs(images, repo, model_name, device):
+    # (segmentation, outputs of run_hub_model) of a batch of images
+    device = device or default_device()
+    model = ModelRegistry.instance().get(repo, model_name, device)
+    segmentation = is_segmentation_model(model, repo, model_name, device)
+    return segmentation, run_hub_model(model, [hub_preprocess(image, segmentation) for image in images], device,
+                                       segmentation)
+
+
+def predict_hub_model_batch(images: typing.List[np.ndarray], repo: str, model_name: str, device: str = None) -> list:
+    """
+    Runs a hub model on a batch of images with a single forward pass, returns per image
+    ("mask", {class index: [contours]}) for segmentation models and ("label", [wordnet id, name])
+    for classification models
+    """
+    segmentation, outputs = _hub_outputs(images, repo, model_name, device)
+    if segmentation:
+        return [("mask", segment(logits, image.shape[:2])) for image, logits in zip(images, outputs)]
+    return [("label", classify(scores)) for scores in outputs]
+
+
+def predict_hub_model(image: np.ndarray, repo: str, model_name: str, device: str = None):
+    return predict_hub_model_batch([image], repo, model_name, device)[0]
+
+
+def auto_label_hub_model_batch(items: typing.List[typing.Tuple[np.ndarray, dict]], repo: str, model_name: str,
+                               device: str = None) -> list:
+    """
+    Predictions of the auto label jobs, items are (image, params) with the tolerance and
+    min_area of the polygons of the job. Returns per image ("polygons", [(class index,
+    [[x, y], ...])]) for segmentation models and ("label", [wordnet id, name]) for
+    classification models
+    """
+    segmentation, outputs = _hub_outputs([image for image, _ in items], repo, model_name, device)
+    if not segmentation:
+        return [("label", classify(scores)) for scores in outputs]
+    results = []
+    for (image, params), logits in zip(items, outputs):
+        polygons = mask_polygons(label_map(logits, image.shape[:2]), params["tolerance"], params["min_area"])
+        results.append(("polygons", [(class_idx, polygon.tolist()) for class_idx, polygon in polygons]))
+    return results
+
+
+def _dextr_input(image, points):
+    """
+    Crops the image around its extreme points and stacks it with their heat map, returns
+    the (4, 512, 512) input and the crop box
+    """
+    from contrib.dextr import helpers
+    pad = DEXTR_PAD
+    extreme_points_ori = np.asarray(points).astype(np.int64)
+    #  Crop image to the bounding box from the extreme points and resize
+    bbox = helpers.get_bbox(image, points=extreme_points_ori, pad=pad, zero_pad=True)
+    crop_image = helpers.crop_from_bbox(image, bbox, zero_pad=True)
+    resize_image = helpers.fixed_resize(crop_image, (DEXTR_SIZE, DEXTR_SIZE)).astype(np.float32)
+    #  Generate extreme point heat map normalized to image values
+    extreme_points = extreme_points_ori - [np.min(extreme_points_ori[:, 0]), np.min(extreme_points_ori[:, 1])] + [pad, pad]
+    extreme_points = (DEXTR_SIZE * extreme_points * [1 / crop_image.shape[1], 1 / crop_image.shape[0]]).astype(np.int64)
+    extreme_heatmap = helpers.make_gt(resize_image, extreme_points, sigma=10)
+    extreme_heatmap = helpers.cstm_normalize(extreme_heatmap, 255)
+    #  Concatenate inputs
+    input_dextr = np.concatenate((resize_image, extreme_heatmap[:, :, np.newaxis]), axis=2)
+    return input_dextr.transpose((2, 0, 1)), bbox
+
+
+def predict_dextr_batch(items: typing.List[typing.Tuple[np.ndarray, list]], device: str = None) -> list:
+    """
+    Contours of the objects delimited by their extreme points, items are (image, points)
+    and every image may differ, the crops all have the same size and share one forward pass
+    """
+    from torch.nn.functional import upsample
+    from contrib.dextr import helpers
+    device = device or default_device()
+    model = ModelRegistry.instance().get(ModelRegistry.DEXTR_REPO, ModelRegistry.DEXTR_MODEL, device)
+    images = [as_rgb(image) for image, _ in items]
+    inputs, boxes = zip(*[_dextr_input(image, points) for image, (_, points) in zip(images, items)])
+    with torch.no_grad():
+        # Run a forward pass
+        outputs = model.forward(torch.from_numpy(np.stack(inputs)).to(device))
+        outputs = upsample(outputs, size=(DEXTR_SIZE, DEXTR_SIZE), mode='bilinear', align_corners=True)
+        outputs = outputs.to(torch.device('cpu')).numpy()
+    results = []
+    for image, bbox, output in zip(images, boxes, outputs):
+        pred = np.squeeze(1 / (1 + np.exp(-output[0])))
+        result = helpers.crop2fullmask(pred, bbox, im_size=image.shape[:2], zero_pad=True, relax=DEXTR_PAD)
+        results.append(mask_contours(result > DEXTR_THRESHOLD))
+    return results
+
+
+def predict_dextr(image: np.ndarray, points, device: str = None) -> list:
+    """
+    Contours of the object delimited by its extreme points
+    """
+    return predict_dextr_batch([(image, points)], device)[0]
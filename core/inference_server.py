@@ -0,0 +1,282 @@
+import atexit
+import functools
+import itertools
+import multiprocessing
+import threading
+import typing
+from concurrent.futures import Future, InvalidStateError
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class InferenceError(RuntimeError):
+    pass
+
+
+def _batch_key(kind, params):
+    # requests share a batch when they run the same model
+    if kind in ("hub", "auto_label"):
+        return kind, params["repo"], params["model_name"]
+    if kind == "dextr":
+        return "dextr",
+    raise ValueError("unknown inference request kind {}".format(kind))
+
+
+def _run_batch(key, items):
+    # imported here, only the server process loads torch and the models
+    from . import inference
+    if key[0] == "hub":
+        return inference.predict_hub_model_batch([image for image, _ in items], key[1], key[2])
+    if key[0] == "auto_label":
+        return inference.auto_label_hub_model_batch(items, key[1], key[2])
+    contours = inference.predict_dextr_batch([(image, params["points"]) for image, params in items])
+    return [("contours", item_contours) for item_contours in contours]
+
+
+def _serve(connection, memory_budget, preload, max_batch_size, max_wait_ms, framework, onnx_threads):
+    """
+    Server process main: receives the requests and hands them to a BatchScheduler, whose
+    thread runs the batches and sends the results back
+    """
+    from .batching import BatchScheduler
+    from .framework import Framework
+    from .model_registry import ModelRegistry
+    registry = ModelRegistry.instance()
+    registry.memory_budget = memory_budget
+    # the Framework values do not survive pickling, the server receives the attribute name
+    registry.framework = getattr(Framework, framework)
+    registry.onnx_threads = onnx_threads
+    registry.preload(preload)
+    scheduler = BatchScheduler(_run_batch, max_batch_size, max_wait_ms)
+    requests = {}
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            try:
+                connection.send(message)
+            except (BrokenPipeError, OSError):
+                pass
+
+    def finish(request_id, shm, future):
+        requests.pop(request_id, None)
+        if future.cancelled():
+            send((request_id, None, "cancelled"))
+        elif future.exception() is not None:
+            ex = future.exception()
+            send((request_id, None, "{}: {}".format(type(ex).__name__, ex)))
+        else:
+            send((request_id, future.result(), None))
+        try:
+            shm.close()
+        except BufferError:
+            # the batch still references the image, the mapping is released with it
+            pass
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "infer":
+            _, request_id, kind, shm_name, shape, dtype, params = message
+            try:
+                shm = shared_memory.SharedMemory(name=shm_name)
+                # the image is read straight from the client's buffer
+                image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                future = scheduler.submit(_batch_key(kind, params), (image, params))
+            except Exception as ex:
+                send((request_id, None, "{}: {}".format(type(ex).__name__, ex)))
+                continue
+            requests[request_id] = future
+            future.add_done_callback(functools.partial(finish, request_id, shm))
+        elif message[0] == "cancel":
+            # requests already running complete, the client drops their result
+            future = requests.get(message[1])
+            if future is not None:
+                future.cancel()
+        elif message[0] == "metrics":
+            send((message[1], scheduler.metrics(), None))
+        else:
+            break
+    scheduler.close()
+
+
+class InferenceClient:
+    """
+    Runs the model inference in a separate process so PyTorch does not compete with the
+    GUI for the GIL and memory, and a crash in a model does not take the application down.
+
+    Requests and results travel over a multiprocessing pipe, the images are copied once into
+    shared memory blocks that the server reads in place. submit returns a Future resolved
+    with ("mask", {class index: contours}), ("label", [wordnet id, name]),
+    ("polygons", [(class index, polygon)]) or ("contours", contours); cancelling the Future removes a request that has not started
+    yet from the server queue. The server is started on the first request and started
+    again if it dies, the requests in flight then fail with InferenceError. Concurrent
+    requests for the same model are coalesced by the server into batches of up to
+    max_batch_size, waiting at most max_wait_ms for a batch to fill (see core/batching.py).
+    framework is the name of the Framework attribute the models run with, PyTorch or ONNX,
+    onnx_threads the intra-op threads of the ONNX sessions of the server.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, memory_budget: int = 4 << 30, preload: typing.List[typing.Tuple[str, str]] = None,
+                 max_batch_size: int = 8, max_wait_ms: float = 10, framework: str = "PyTorch",
+                 onnx_threads: int = 0):
+        self.memory_budget = memory_budget
+        self.preload = list(preload or [])
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.framework = framework
+        self.onnx_threads = onnx_threads
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._requests = {}
+        self._process = None
+        self._connection = None
+
+    @classmethod
+    def default(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.close)
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls, timeout=None):
+        """
+        Stops the server process of the default client, if it was ever started
+        """
+        with cls._instance_lock:
+            instance = cls._instance
+        if instance:
+            instance.close(timeout)
+
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            # spawn: forking a process that runs Qt and database threads is not safe
+            context = multiprocessing.get_context("spawn")
+            self._connection, server_connection = context.Pipe(duplex=True)
+            args = (server_connection, self.memory_budget, self.preload, self.max_batch_size, self.max_wait_ms,
+                    self.framework, self.onnx_threads)
+            self._process = context.Process(target=_serve, name="cvstudio-inference", args=args, daemon=True)
+            self._process.start()
+            server_connection.close()
+            connection = self._connection
+        threading.Thread(target=self._receive, args=(connection,), name="inference-client", daemon=True).start()
+
+    def _send(self, connection, message):
+        with self._send_lock:
+            connection.send(message)
+
+    def _receive(self, connection):
+        while True:
+            try:
+                request_id, result, error = connection.recv()
+            except (EOFError, OSError):
+                break
+            self._complete(request_id, result, error)
+        # the server exited, fail what is still waiting for it
+        with self._lock:
+            lost = [request_id for request_id, (_, _, owner) in self._requests.items() if owner is connection]
+        for request_id in lost:
+            self._complete(request_id, None, "the inference server exited")
+
+    def _complete(self, request_id, result, error):
+        with self._lock:
+            request = self._requests.pop(request_id, None)
+        if request is None:
+            return
+        future, shm, _ = request
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+        try:
+            if error:
+                future.set_exception(InferenceError(error))
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            # cancelled meanwhile
+            pass
+
+    def submit(self, kind: str, image: np.ndarray, **params) -> Future:
+        """
+        kind is "hub" (params repo and model_name), "auto_label" (params repo, model_name,
+        tolerance and min_area) or "dextr" (params points), image is RGB
+        """
+        self.start()
+        image = np.ascontiguousarray(image)
+        shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            connection = self._connection
+            self._requests[request_id] = (future, shm, connection)
+
+        def cancelled(done: Future):
+            if done.cancelled():
+                try:
+                    self._send(connection, ("cancel", request_id))
+                except (BrokenPipeError, OSError):
+                    self._complete(request_id, None, "the inference server exited")
+
+        future.add_done_callback(cancelled)
+        try:
+            self._send(connection, ("infer", request_id, kind, shm.name, image.shape, image.dtype.str, params))
+        except (BrokenPipeError, OSError):
+            self._complete(request_id, None, "the inference server exited")
+        return future
+
+    def predict_hub_model(self, image: np.ndarray, repo: str, model_name: str) -> Future:
+        return self.submit("hub", image, repo=repo, model_name=model_name)
+
+    def predict_dextr(self, image: np.ndarray, points) -> Future:
+        return self.submit("dextr", image, points=np.asarray(points).tolist())
+
+    def submit_batch(self, kind: str, images: typing.List[np.ndarray], **params) -> typing.List[Future]:
+        """
+        Submits several images with the same params at once, one Future per image. The server
+        runs them in batches of up to max_batch_size, the interactive requests received
+        meanwhile get their own batches in between
+        """
+        return [self.submit(kind, image, **params) for image in images]
+
+    def metrics(self) -> Future:
+        """
+        Future of the batching metrics of the server per model: request and batch counts,
+        batch size histogram and queue and total latency percentiles in milliseconds
+        """
+        self.start()
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            connection = self._connection
+            self._requests[request_id] = (future, None, connection)
+        try:
+            self._send(connection, ("metrics", request_id))
+        except (BrokenPipeError, OSError):
+            self._complete(request_id, None, "the inference server exited")
+        return future
+
+    def close(self, timeout=None):
+        with self._lock:
+            process, connection = self._process, self._connection
+            self._process = None
+        if process is None:
+            return
+        try:
+            self._send(connection, ("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+        connection.close()
@@ -0,0 +1,165 @@
+import os
+import threading
+import typing
+from collections import OrderedDict
+
+import torch
+
+from .framework import Framework
+
+
+def default_device() -> str:
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+def load_hub_model(repo: str, name: str, device: str):
+    model = torch.hub.load(repo, name, pretrained=True)
+    return model.eval().to(device)
+
+
+def load_dextr_model(repo: str, name: str, device: str):
+    from contrib.dextr import deeplab_resnet as resnet
+    model = resnet.resnet101(1, nInputChannels=4, classifier='psp')
+    model_path = os.path.abspath("./models/{}.pth".format(name))
+    state_dict = torch.load(model_path, map_location=lambda storage, loc: storage)
+    # remove `module.` from multi-gpu training
+    state_dict = OrderedDict((k[7:] if k.startswith("module.") else k, v) for k, v in state_dict.items())
+    model.load_state_dict(state_dict)
+    return model.eval().to(device)
+
+
+def model_size(model) -> int:
+    """
+    Bytes held by the parameters and buffers of a module, the nbytes attribute of other models
+    """
+    if not isinstance(model, torch.nn.Module):
+        return getattr(model, "nbytes", 0)
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelRegistry:
+    """
+    Process wide cache of loaded models in eval mode, keyed by (repo, name, device, framework).
+
+    Loading a hub model or the DEXTR weights takes seconds, a model stays resident after
+    its first use so the next request only costs a forward pass. The least recently used
+    models are evicted once their parameters exceed memory_budget bytes, the last used
+    model is always kept. Concurrent requests for a model being loaded wait for that load
+    instead of starting another one. Models are loaded with torch.hub.load unless a loader
+    is registered for their repo, DEXTR is registered under the "dextr" repo. With the
+    ONNX framework the same loaders provide the model to export once, it then runs in
+    onnxruntime (see core/onnx_backend.py) with onnx_threads intra-op threads, 0 letting
+    onnxruntime use every physical core.
+    """
+    DEXTR_REPO = "dextr"
+    DEXTR_MODEL = "dextr_pascal-sbd"
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, memory_budget: int = 4 << 30, framework=Framework.PyTorch):
+        self.memory_budget = memory_budget
+        self.framework = framework
+        self.onnx_threads = 0
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._loading = {}
+        self._loaders = {self.DEXTR_REPO: load_dextr_model}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls) -> "ModelRegistry":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = ModelRegistry()
+            return cls._instance
+
+    def register_loader(self, repo: str, loader: typing.Callable[[str, str, str], typing.Any]):
+        """
+        loader(repo, name, device) must return the model ready for inference
+        """
+        self._loaders[repo] = loader
+
+    @property
+    def memory_used(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def keys(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def get(self, repo: str, name: str, device: str = None, framework=None):
+        key = (repo, name, device or default_device(), framework or self.framework)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+        if not owner:
+            event.wait()
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            # the load failed in the other thread, try again from this one
+            return self.get(*key)
+        try:
+            model = self._load(*key)
+            with self._lock:
+                self._models[key] = model
+                self._sizes[key] = model_size(model)
+                self._evict()
+            return model
+        finally:
+            with self._lock:
+                del self._loading[key]
+            event.set()
+
+    def _load(self, repo, name, device, framework):
+        loader = self._loaders.get(repo, load_hub_model)
+        if framework == Framework.ONNX:
+            from .onnx_backend import load_onnx_model
+            if repo == self.DEXTR_REPO:
+                return load_onnx_model(repo, name, loader, input_shape=(1, 4, 512, 512), dynamic_size=False,
+                                       threads=self.onnx_threads)
+            return load_onnx_model(repo, name, loader, threads=self.onnx_threads)
+        return loader(repo, name, device)
+
+    def _evict(self):
+        while len(self._models) > 1 and sum(self._sizes.values()) > self.memory_budget:
+            key, _ = self._models.popitem(last=False)
+            del self._sizes[key]
+
+    def evict(self, repo: str, name: str, device: str = None, framework=None):
+        key = (repo, name, device or default_device(), framework or self.framework)
+        with self._lock:
+            self._models.pop(key, None)
+            self._sizes.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._sizes.clear()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def preload(self, models: typing.Iterable[typing.Tuple[str, str]], device: str = None) -> threading.Thread:
+        """
+        Loads the (repo, name) models from a daemon thread, failures are reported and skipped
+        """
+        models = list(models)
+
+        def do_work():
+            for repo, name in models:
+                try:
+                    self.get(repo, name, device)
+                except Exception as ex:
+                    print("failed to preload {}/{}: {}".format(repo, name, ex))
+
+        thread = threading.Thread(target=do_work, name="model-preload", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,137 @@
+"""
+ONNX Runtime execution of the hub and DEXTR models.
+
+A model is exported from PyTorch the first time it is requested and cached under
+<user data folder>/onnx with a small json file describing its outputs and the versions
+that produced it. Later loads only open an onnxruntime session on the cached file, the
+model is exported again once torch, torchvision or the opset change. OnnxModel mimics
+the call interface of the PyTorch module it replaces, torch tensors in and out, so
+core/inference runs unchanged on either backend.
+"""
+import json
+import os
+import re
+import typing
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+# 0 lets onnxruntime pick, which is one thread per physical core. ModelRegistry.onnx_threads
+# overrides it, the inference server sets it from --inference-threads
+INTRA_OP_THREADS = 0
+OPSET_VERSION = 17
+
+
+def user_data_folder() -> str:
+    return os.environ.get("CVSTUDIO_HOME", os.path.join(os.path.expanduser("~"), ".cvstudio"))
+
+
+def onnx_folder() -> str:
+    return os.path.join(user_data_folder(), "onnx")
+
+
+def export_versions() -> dict:
+    """
+    Versions recorded with an export, a cached model made with other ones is exported again
+    """
+    versions = {"torch_version": torch.__version__, "opset": OPSET_VERSION}
+    try:
+        import torchvision
+        versions["torchvision_version"] = torchvision.__version__
+    except ImportError:
+        pass
+    return versions
+
+
+def model_path(repo: str, name: str) -> str:
+    file_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", "{}__{}".format(repo, name))
+    return os.path.join(onnx_folder(), file_name + ".onnx")
+
+
+class _SegmentationOutput(torch.nn.Module):
+    # the aux head of the torchvision segmentation models is only used for training
+    def __init__(self, model):
+        super(_SegmentationOutput, self).__init__()
+        self.model = model
+
+    def forward(self, inputs):
+        return self.model(inputs)["out"]
+
+
+def export_model(model, path: str, input_shape: typing.Tuple[int, ...], dynamic_size: bool = True) -> dict:
+    """
+    Exports a PyTorch model with a dynamic batch size, and dynamic height and width when
+    dynamic_size is set, writes its description next to it and returns the description
+    """
+    model = model.eval().to("cpu")
+    dummy = torch.randn(*input_shape)
+    with torch.no_grad():
+        sample = model(dummy)
+    meta = {"segmentation": isinstance(sample, dict), "input_shape": list(input_shape)}
+    meta.update(export_versions())
+    if meta["segmentation"]:
+        model = _SegmentationOutput(model)
+    axes = {0: "batch", 2: "height", 3: "width"} if dynamic_size else {0: "batch"}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # unique temporary names, the server and the GUI process may export the same model at once
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    torch.onnx.export(model, dummy, tmp_path, input_names=["input"], output_names=["out"],
+                      dynamic_axes={"input": axes, "out": axes if meta["segmentation"] else {0: "batch"}},
+                      opset_version=OPSET_VERSION, do_constant_folding=True)
+    with open(tmp_path + ".json", "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path + ".json", path + ".json")
+    os.replace(tmp_path, path)
+    return meta
+
+
+class OnnxModel:
+    """
+    onnxruntime session on the CPU with all the graph optimizations enabled, sequential
+    execution and threads intra-op threads, 0 letting onnxruntime pick
+    """
+
+    def __init__(self, path: str, meta: dict, threads: int = INTRA_OP_THREADS):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads
+        # a single graph runs at a time, parallel operators would only add threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.segmentation = meta["segmentation"]
+        self.nbytes = os.path.getsize(path)
+
+    def __call__(self, inputs: torch.Tensor):
+        inputs = np.ascontiguousarray(inputs.detach().cpu().numpy(), dtype=np.float32)
+        output = torch.from_numpy(self.session.run(None, {"input": inputs})[0])
+        return OrderedDict(out=output) if self.segmentation else output
+
+    forward = __call__
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def load_onnx_model(repo: str, name: str, torch_loader: typing.Callable[[str, str, str], typing.Any],
+                    input_shape: typing.Tuple[int, ...] = (1, 3, 480, 480), dynamic_size: bool = True,
+                    threads: int = INTRA_OP_THREADS) -> OnnxModel:
+    """
+    Opens the cached export of a model, exporting the model loaded by torch_loader first if
+    there is none or it was made by other versions of torch, torchvision or the opset
+    """
+    path = model_path(repo, name)
+    try:
+        with open(path + ".json") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    stale = meta is None or any(meta.get(key) != value for key, value in export_versions().items())
+    if stale or not os.path.isfile(path):
+        meta = export_model(torch_loader(repo, name, "cpu"), path, input_shape, dynamic_size)
+    return OnnxModel(path, meta, threads)
@@ -1,29 +1,91 @@
-import inspect
+import os
+import typing
+
+import numpy as np
 import torch
 from PIL import Image
 from dao import DatasetDao
-from .api_client import  ApiClient
+from .api_client import ApiClient
 from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms, utils
+from torchvision import transforms
 # Ignore warnings
 import warnings
 warnings.filterwarnings("ignore")
 
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def classification_transform(image_size: int = 224, train: bool = True):
+    """
+    Default pipeline for PIL images: random crop and flip for training, resize and center crop otherwise
+    """
+    if train:
+        steps = [transforms.RandomResizedCrop(image_size), transforms.RandomHorizontalFlip()]
+    else:
+        steps = [transforms.Resize(int(image_size / 0.875)), transforms.CenterCrop(image_size)]
+    return transforms.Compose(steps + [transforms.ToTensor(), transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)])
+
+
+def cached_classification_transform(train: bool = True):
+    """
+    Default pipeline for the uint8 (C, H, W) tensors of PytorchMemmapDataset, already at their final size
+    """
+    steps = [transforms.RandomHorizontalFlip()] if train else []
+    return transforms.Compose(steps + [transforms.ConvertImageDtype(torch.float32),
+                                       transforms.Normalize(IMAGENET_MEAN, IMAGENET_STD)])
+
+
 class PytorchCVDataset(Dataset):
-    def __init__(self, dataset_id):
-        self.ds_dao = DatasetDao()
-        self.entries = self.ds_dao.fetch_entries_for_classification(dataset_id)
+    """
+    Labeled images of a dataset for classification, items are (image, class index).
+
+    The entries are read with a single query and kept as compact arrays: the utf-8 encoded
+    paths in one buffer with their offsets and the class indices as int64. Unlike a list of
+    dicts they hold no per item Python objects, so the DataLoader workers do not slowly copy
+    the pages they share with the parent by touching reference counts. Class indices follow
+    the sorted label names, the mapping does not depend on insertion order.
+    decode_size lets JPEG files be decoded at a reduced scale that is still at least that large.
+    """
+
+    def __init__(self, dataset_id, transform=None, target_transform=None, decode_size: int = None):
+        rows = DatasetDao().fetch_entries_for_classification(dataset_id)
+        self.classes = sorted({label for _, label in rows})
+        self.class_to_idx = {name: index for index, name in enumerate(self.classes)}
+        encoded = [path.encode("utf-8") for path, _ in rows]
+        self._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in encoded], out=self._offsets[1:])
+        self._paths = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self.targets = np.array([self.class_to_idx[label] for _, label in rows], dtype=np.int64)
+        self.transform = transform
+        self.target_transform = target_transform
+        self.decode_size = decode_size
 
     def __len__(self):
-        return len(self.entries)
+        return len(self.targets)
+
+    def path(self, idx) -> str:
+        return self._paths[self._offsets[idx]:self._offsets[idx + 1]].tobytes().decode("utf-8")
+
+    @property
+    def paths(self) -> typing.List[str]:
+        return [self.path(idx) for idx in range(len(self))]
 
     def __getitem__(self, idx):
         if torch.is_tensor(idx):
-            idx=idx.tolist()
-        image_path = self.entries[idx]["file_path"]
-        image_label=self.entries[idx]["label"]
-        image_array=Image.open(image_path)
-        return image_array, image_label
+            idx = idx.tolist()
+        with Image.open(self.path(idx)) as image:
+            if self.decode_size:
+                # JPEG only, picks the smallest DCT scale that keeps the requested size
+                image.draft("RGB", (self.decode_size, self.decode_size))
+            image = image.convert("RGB")
+        target = int(self.targets[idx])
+        if self.transform:
+            image = self.transform(image)
+        if self.target_transform:
+            target = self.target_transform(target)
+        return image, target
+
 
 class PytorchApiClient(ApiClient):
     def __init__(self):
@@ -38,10 +100,34 @@ class PytorchApiClient(ApiClient):
         #model_name = {mname: mclass.__doc__ for mname,mclass in models}
         return model_names
 
-    def build_dataset(self, dataset_id: int)-> DataLoader:
-        dataset = PytorchCVDataset(dataset_id)
-        return  DataLoader(dataset,batch_size=256,shuffle=True, num_workers=4)
-
-
-
+    def build_dataset(self, dataset_id: int, batch_size: int = 64, shuffle: bool = True, train: bool = True,
+                      image_size: int = 224, transform=None, workers: int = None, pin_memory: bool = None,
+                      persistent_workers: bool = True, prefetch_factor: int = 2, cache_folder: str = None,
+                      drop_last: bool = False, progress_callback=None) -> DataLoader:
+        """
+        Builds the DataLoader of a classification dataset.
 
+        workers defaults to the number of CPUs up to 8 and pin_memory to whether CUDA is
+        available. persistent_workers and prefetch_factor only apply with workers > 0.
+        With cache_folder the images are decoded once into a TensorCache of
+        image_size x image_size at the first call and read from it afterwards, the transform
+        then receives uint8 (C, H, W) tensors instead of PIL images.
+        """
+        dataset = PytorchCVDataset(dataset_id, decode_size=int(image_size / 0.875))
+        if cache_folder:
+            from .tensor_cache import TensorCache
+            from .pytorch_memmap_dataset import PytorchMemmapDataset
+            TensorCache.open_or_build(cache_folder, dataset.paths, dataset.targets, (image_size, image_size),
+                                      classes=dataset.classes, progress_callback=progress_callback)
+            dataset = PytorchMemmapDataset(cache_folder, transform=transform or cached_classification_transform(train))
+        else:
+            dataset.transform = transform or classification_transform(image_size, train)
+        if workers is None:
+            workers = min(os.cpu_count() or 1, 8)
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        loader_args = dict(batch_size=batch_size, shuffle=shuffle, num_workers=workers, pin_memory=pin_memory,
+                           drop_last=drop_last)
+        if workers > 0:
+            loader_args.update(persistent_workers=persistent_workers, prefetch_factor=prefetch_factor)
+        return DataLoader(dataset, **loader_args)
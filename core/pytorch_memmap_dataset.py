@@ -0,0 +1,47 @@
+import torch
+from torch.utils.data import Dataset
+
+from .tensor_cache import TensorCache
+
+
+class PytorchMemmapDataset(Dataset):
+    """
+    Reads the images of a TensorCache. Items are (image, label) where image is a uint8
+    tensor (C, H, W) viewing the mapped file directly, the pixels are only copied when the
+    DataLoader collates the batch. The cache is opened lazily in every process, so the
+    workers share the page cache instead of receiving a pickled copy of the array.
+    Images that failed to decode are skipped unless include_invalid is set.
+    """
+
+    def __init__(self, folder: str, transform=None, target_transform=None, include_invalid: bool = False):
+        super(PytorchMemmapDataset, self).__init__()
+        self.folder = folder
+        self.transform = transform
+        self.target_transform = target_transform
+        cache = TensorCache(folder)
+        self.classes = cache.classes
+        self.indices = None if include_invalid else cache.valid.nonzero()[0]
+        self._length = len(cache) if self.indices is None else len(self.indices)
+        self._cache = None
+
+    def __len__(self):
+        return self._length
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_cache"] = None
+        return state
+
+    def __getitem__(self, index):
+        if self._cache is None:
+            # copy on write: writable arrays for torch.from_numpy while the pages stay shared
+            self._cache = TensorCache(self.folder, mode="c")
+        if self.indices is not None:
+            index = self.indices[index]
+        image = torch.from_numpy(self._cache.images[index]).permute(2, 0, 1)
+        target = int(self._cache.labels[index])
+        if self.transform:
+            image = self.transform(image)
+        if self.target_transform:
+            target = self.target_transform(target)
+        return image, target
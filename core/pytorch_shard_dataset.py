@@ -0,0 +1,105 @@
+import io
+import json
+import os
+import random
+import tarfile
+
+from PIL import Image
+from torch.utils.data import IterableDataset, get_worker_info
+
+
+class PytorchShardDataset(IterableDataset):
+    """
+    Streams the tar shards written by formats.WebDatasetWriter.
+
+    Every shard is read front to back, so the storage only sees large sequential reads.
+    The shards are split between the DataLoader workers and their order is shuffled per
+    epoch, samples are then shuffled through a buffer of shuffle_buffer encoded samples
+    and only decoded when they leave it. Items are (image, target) where the target is the
+    class index of .cls samples, written for classification datasets (task is
+    "classification"), or the annotations dict of .json samples.
+    Call set_epoch before each epoch to get a new order.
+    """
+    IMAGE_EXTENSIONS = ("jpg", "png", "bmp", "gif", "tif", "tiff", "webp")
+
+    def __init__(self, folder: str, transform=None, target_transform=None, shuffle_buffer: int = 1000,
+                 shuffle_shards: bool = True, seed: int = 0):
+        super(PytorchShardDataset, self).__init__()
+        with open(os.path.join(folder, "index.json")) as f:
+            self.index = json.load(f)
+        self.shards = [os.path.join(folder, shard["name"]) for shard in self.index["shards"]]
+        self.classes = self.index["classes"]
+        # shards written before the task was recorded only hold detection samples
+        self.task = self.index.get("task", "detection")
+        self.transform = transform
+        self.target_transform = target_transform
+        self.shuffle_buffer = shuffle_buffer
+        self.shuffle_shards = shuffle_shards
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return self.index["samples"]
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _worker_shards(self):
+        shards = list(self.shards)
+        # every worker computes the same permutation and takes its own slice of it
+        if self.shuffle_shards:
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        worker = get_worker_info()
+        if worker is None:
+            return shards, random.Random(self.seed + self.epoch)
+        return shards[worker.id::worker.num_workers], random.Random((self.seed + self.epoch) * 1000 + worker.id)
+
+    @staticmethod
+    def _samples(shard):
+        key, sample = None, None
+        # "r|" reads the archive as a stream, without seeking back for the members
+        with tarfile.open(shard, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                member_key, _, extension = os.path.basename(member.name).partition(".")
+                if member_key != key:
+                    if sample:
+                        yield sample
+                    key, sample = member_key, {"__key__": member_key}
+                sample[extension] = tar.extractfile(member).read()
+        if sample:
+            yield sample
+
+    def _decode(self, sample):
+        data = next(sample[extension] for extension in self.IMAGE_EXTENSIONS if extension in sample)
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        if "cls" in sample:
+            target = int(sample["cls"])
+        elif "json" in sample:
+            target = json.loads(sample["json"])
+        else:
+            target = None
+        if self.transform:
+            image = self.transform(image)
+        if self.target_transform:
+            target = self.target_transform(target)
+        return image, target
+
+    def __iter__(self):
+        shards, rng = self._worker_shards()
+        buffer = []
+        for shard in shards:
+            for sample in self._samples(shard):
+                if self.shuffle_buffer <= 1:
+                    yield self._decode(sample)
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                index = rng.randrange(len(buffer))
+                buffer[index], sample = sample, buffer[index]
+                yield self._decode(sample)
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._decode(sample)
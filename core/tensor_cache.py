@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from util import ImageUtilities, MiscUtilities
+
+
+class TensorCache:
+    """
+    Images of a dataset decoded and resized once into a uint8 memory mapped array of
+    shape (N, height, width, channels), RGB, with the class indices in a parallel array.
+
+    Training epochs then read the pixels straight from the page cache instead of
+    decoding every file again. Images that can not be decoded are left black and flagged
+    in the valid array. The cache records a fingerprint of the paths, labels and size it
+    was built from, open_or_build only rebuilds it when they change.
+    """
+    IMAGES_FILE = "images.u8"
+    LABELS_FILE = "labels.npy"
+    VALID_FILE = "valid.npy"
+    META_FILE = "cache.json"
+
+    def __init__(self, folder: str, mode: str = "r"):
+        """
+        Opens an existing cache, mode is the np.memmap mode of the images array
+        """
+        self.folder = folder
+        with open(os.path.join(folder, self.META_FILE)) as f:
+            self.meta = json.load(f)
+        self.shape = (self.meta["count"], self.meta["height"], self.meta["width"], self.meta["channels"])
+        self.images = np.memmap(os.path.join(folder, self.IMAGES_FILE), dtype=np.uint8, mode=mode, shape=self.shape)
+        self.labels = np.load(os.path.join(folder, self.LABELS_FILE), mmap_mode="r")
+        self.valid = np.load(os.path.join(folder, self.VALID_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def classes(self):
+        return self.meta["classes"]
+
+    @staticmethod
+    def fingerprint(paths, labels, size, channels):
+        digest = hashlib.sha1("{}x{}x{}".format(size[0], size[1], channels).encode("utf-8"))
+        for path in paths:
+            digest.update(path.encode("utf-8"))
+            digest.update(b"\0")
+        digest.update(np.asarray(labels, dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _decode(path, size, channels):
+        height, width = size
+        image, _, _ = ImageUtilities.imread_reduced(path, max(height, width))
+        if image is None:
+            return None
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        if channels == 1:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)[..., None]
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    @classmethod
+    def build(cls, folder: str, paths: typing.Sequence[str], labels: typing.Sequence[int],
+              size: typing.Tuple[int, int] = (224, 224), channels: int = 3, classes: typing.List[str] = None,
+              workers: int = 8, chunk_size: int = 256, progress_callback=None) -> "TensorCache":
+        """
+        Decodes the images into a new cache, size is (height, width). The files are written
+        under temporary names and renamed at the end, an interrupted build leaves no cache.
+        progress_callback receives the number of images decoded so far.
+        """
+        os.makedirs(folder, exist_ok=True)
+        count = len(paths)
+        height, width = size
+        images_tmp = os.path.join(folder, cls.IMAGES_FILE + ".tmp")
+        images = np.memmap(images_tmp, dtype=np.uint8, mode="w+", shape=(max(count, 1), height, width, channels))
+        valid = np.zeros(count, dtype=bool)
+
+        def decode_chunk(indices):
+            for index in indices:
+                try:
+                    image = cls._decode(paths[index], size, channels)
+                except Exception:
+                    image = None
+                if image is not None:
+                    # decoded straight into the mapped file, no intermediate batch buffer
+                    images[index] = image
+                    valid[index] = True
+            return len(indices)
+
+        processed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # cv2 releases the GIL while decoding and resizing
+            for done in executor.map(decode_chunk, MiscUtilities.chunk(range(count), chunk_size)):
+                processed += done
+                if progress_callback:
+                    progress_callback(processed)
+        images.flush()
+        del images
+        np.save(os.path.join(folder, cls.LABELS_FILE), np.asarray(labels, dtype=np.int64))
+        np.save(os.path.join(folder, cls.VALID_FILE), valid)
+        os.replace(images_tmp, os.path.join(folder, cls.IMAGES_FILE))
+        meta = {
+            "count": count,
+            "height": height,
+            "width": width,
+            "channels": channels,
+            "classes": classes or [],
+            "fingerprint": cls.fingerprint(paths, labels, size, channels)
+        }
+        # the metadata is written last, its presence marks a complete cache
+        with open(os.path.join(folder, cls.META_FILE), "w") as f:
+            json.dump(meta, f)
+        return cls(folder)
+
+    @classmethod
+    def open_or_build(cls, folder: str, paths: typing.Sequence[str], labels: typing.Sequence[int],
+                      size: typing.Tuple[int, int] = (224, 224), channels: int = 3, **kwargs) -> "TensorCache":
+        meta_file = os.path.join(folder, cls.META_FILE)
+        if os.path.isfile(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            if meta.get("fingerprint") == cls.fingerprint(paths, labels, size, channels):
+                return cls(folder)
+            # stale, removed first so a failed rebuild never leaves the old metadata next to new arrays
+            os.remove(meta_file)
+        return cls.build(folder, paths, labels, size, channels, **kwargs)
@@ -1,3 +1,4 @@
+import argparse
 import os
 import sys
 
@@ -5,6 +6,8 @@ from PyQt5 import QtCore
 from PyQt5.QtGui import QPalette, QColor
 from PyQt5.QtWidgets import QApplication
 
+from core import InferenceClient
+from dao import AnnotaDao,AnnotaWriter,DatasetDao
 from dao.models import create_tables
 from util import GUIUtilities
 from view.windows import MainWindow
@@ -94,10 +97,62 @@ def gray_theme(app: QApplication):
     app.setStyleSheet("QToolTip { color: #ffffff; background-color: #2a82da; border: 1px solid white; }")
 
 
+def backfill_metadata(dataset_id=None):
+    updated = DatasetDao().backfill_metadata(
+        dataset_id, progress_callback=lambda count: print("{} entries updated".format(count)))
+    print("done, {} entries updated".format(updated))
+
+
+def compact_annotations():
+    compacted = AnnotaDao().compact_points()
+    print("done, the text coordinates of {} annotations were dropped".format(compacted))
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CvStudio")
+    parser.add_argument("--backfill-metadata", action="store_true",
+                        help="store the size, dimensions and hash of the entries added by older versions, then exit")
+    parser.add_argument("--compact-annotations", action="store_true",
+                        help="drop the text coordinates of the annotations stored packed, then exit. "
+                             "Older versions of CvStudio no longer see these annotations")
+    parser.add_argument("--dataset", type=int, default=None, help="restrict maintenance commands to one dataset")
+    parser.add_argument("--model-memory", type=int, default=4096,
+                        help="memory budget in MB of the models kept loaded between predictions")
+    parser.add_argument("--preload-model", nargs=2, action="append", default=[], metavar=("REPO", "MODEL"),
+                        help="load a model in the background at startup, e.g. --preload-model dextr dextr_pascal-sbd")
+    parser.add_argument("--max-batch-size", type=int, default=8,
+                        help="largest batch of concurrent predictions the inference server runs at once")
+    parser.add_argument("--inference-backend", choices=["pytorch", "onnx"], default="pytorch",
+                        help="run the models with PyTorch or with ONNX Runtime, exported once to the user data folder")
+    parser.add_argument("--inference-threads", type=int, default=os.cpu_count() or 2,
+                        help="CPU threads of the ONNX sessions of the inference server")
+    parser.add_argument("--max-batch-wait", type=float, default=10,
+                        help="milliseconds a prediction may wait for other requests to share its batch")
+    args, qt_args = parser.parse_known_args()
     try:
         create_tables()
-        app = QApplication(sys.argv)
+        if args.backfill_metadata:
+            backfill_metadata(args.dataset)
+            sys.exit(0)
+        if args.compact_annotations:
+            compact_annotations()
+            sys.exit(0)
+        app = QApplication(sys.argv[:1] + qt_args)
+        framework_name = {"pytorch": "PyTorch", "onnx": "ONNX"}[args.inference_backend]
+        # the models are loaded and run by the inference server process
+        inference_client = InferenceClient.default()
+        inference_client.memory_budget = args.model_memory << 20
+        inference_client.preload = args.preload_model
+        inference_client.max_batch_size = args.max_batch_size
+        inference_client.max_wait_ms = args.max_batch_wait
+        inference_client.framework = framework_name
+        # the auto-label jobs also predict through the server, it is the only process running models
+        inference_client.onnx_threads = args.inference_threads
+        if args.preload_model:
+            inference_client.start()
+        app.aboutToQuit.connect(InferenceClient.shutdown)
+        # commit the queued annotation changes before the process exits
+        app.aboutToQuit.connect(AnnotaWriter.shutdown)
         app_theme = "cvstudio"
         app.setProperty("theme", app_theme)
         if app_theme == "light":
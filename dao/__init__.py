@@ -2,3 +2,4 @@ from .models import *
 from .dataset_dao import DatasetDao
 from .label_dao import LabelDao
 from .annota_dao import AnnotaDao
+from .annota_writer import AnnotaWriter
@@ -1,23 +1,92 @@
+import logging
 import typing
 
+import numpy as np
 from peewee import *
 
 from dao import db, AnnotationEntity, LabelEntity, DatasetEntryEntity
 from vo import AnnotaVO, LabelVO
 
+logger = logging.getLogger(__name__)
+
 
 class AnnotaDao:
+    # first byte of a packed geometry blob, followed by the little endian x,y values
+    GEOMETRY_INT32 = 0
+    GEOMETRY_FLOAT32 = 1
+    GEOMETRY_DTYPES = {
+        GEOMETRY_INT32: np.dtype("<i4"),
+        GEOMETRY_FLOAT32: np.dtype("<f4")
+    }
+
     def __init__(self):
         pass
 
+    @classmethod
+    def encode_geometry(cls, geometry) -> typing.Optional[bytes]:
+        """
+        Packs the coordinates as int32 when they are all integers, float32 otherwise
+        """
+        if geometry is None:
+            return None
+        values = np.asarray(geometry).ravel()
+        if values.dtype.kind in "iu" or np.array_equal(values, np.floor(values)):
+            if values.size == 0 or np.abs(values).max() <= np.iinfo(np.int32).max:
+                return bytes((cls.GEOMETRY_INT32,)) + values.astype("<i4").tobytes()
+        return bytes((cls.GEOMETRY_FLOAT32,)) + values.astype("<f4").tobytes()
+
+    @classmethod
+    def decode_geometry(cls, blob: bytes) -> typing.Optional[np.ndarray]:
+        """
+        Returns a read only (N, 2) view over the packed coordinates
+        """
+        if blob is None:
+            return None
+        dtype = cls.GEOMETRY_DTYPES[blob[0]]
+        return np.frombuffer(blob, dtype=dtype, offset=1).reshape(-1, 2)
+
+    @classmethod
+    def _row_geometry(cls, blob, points, annot_id=None):
+        # the packed column is preferred, rows written before it existed only have the text
+        if blob is not None:
+            return cls.decode_geometry(blob)
+        if points:
+            try:
+                return AnnotaVO.parse_points(points)
+            except ValueError:
+                # left unpacked by migration 2, the row is skipped instead of failing the export
+                logger.warning("annotation %s has malformed points, it is skipped", annot_id)
+        return None
+
+    @classmethod
+    def _stored_geometry(cls, vo: AnnotaVO):
+        # the text coordinates are kept next to the packed ones so older builds and external
+        # tools still read them, compact_points drops them on request
+        return cls.encode_geometry(vo.geometry), vo.points
+
+    @db.connection_context()
+    def compact_points(self) -> int:
+        """
+        Opt-in compaction: clears the text coordinates of the annotations that also have packed
+        ones. Builds older than the packed encoding see the compacted annotations as empty.
+        Returns the number of annotations compacted.
+        """
+        with db.atomic():
+            return (AnnotationEntity
+                    .update(points=None)
+                    .where(AnnotationEntity.geometry.is_null(False) & AnnotationEntity.points.is_null(False))
+                    .execute())
+
     @db.connection_context()
     def save(self, entity_id, entry: typing.Any):
         if isinstance(entry, AnnotaVO):
             vo = entry
+            geometry, points = self._stored_geometry(vo)
             return AnnotationEntity.create(
                 entry=vo.entry,
                 label=vo.label,
-                points=vo.points,
+                geometry=geometry,
+                points=points,
                 kind=vo.kind
             )
         elif isinstance(entry, list):
@@ -29,7 +98,7 @@ class AnnotaDao:
                 rows = [
                     (vo.entry,
                      vo.label,
-                     vo.points,
+                     *self._stored_geometry(vo),
                      vo.kind)
                     for vo in entry]
                 # AnnotationEntity \
@@ -37,9 +106,60 @@ class AnnotaDao:
                 #     .execute()
                 for batch in chunked(rows,100):
                     AnnotationEntity \
-                        .insert_many(batch, fields=["entry", "label", "points", "kind"]) \
+                        .insert_many(batch, fields=["entry", "label", "geometry", "points", "kind"]) \
                         .execute()
 
+    @db.connection_context()
+    def save_many(self, annotations: typing.Dict[int, typing.List[AnnotaVO]], replace: bool = True) -> int:
+        """
+        Saves the annotations of several entries in a single transaction, annotations maps an
+        entry id to its new annotations. The existing annotations of those entries are deleted
+        first when replace is set, the new ones are added to them otherwise.
+        Returns the number of rows inserted.
+        """
+        rows = [
+            (entry_id, vo.label, *self._stored_geometry(vo), vo.kind)
+            for entry_id, entry_annotations in annotations.items()
+            for vo in entry_annotations]
+        with db.atomic():
+            if replace:
+                for batch in chunked(list(annotations.keys()), 500):
+                    AnnotationEntity.delete().where(AnnotationEntity.entry.in_(batch)).execute()
+            for batch in chunked(rows, 200):
+                AnnotationEntity \
+                    .insert_many(batch, fields=["entry", "label", "geometry", "points", "kind"]) \
+                    .execute()
+        return len(rows)
+
+    @db.connection_context()
+    def save_changes(self, entity_id, inserted: typing.List[AnnotaVO], updated: typing.List[AnnotaVO],
+                     deleted: typing.List[int]):
+        """
+        Applies only the changes made to the annotations of an entry and
+        returns the ids assigned to the inserted annotations
+        """
+        with db.atomic():
+            if deleted:
+                for batch in chunked(deleted, 100):
+                    (AnnotationEntity
+                     .delete()
+                     .where((AnnotationEntity.entry == entity_id) & (AnnotationEntity.id.in_(batch)))
+                     .execute())
+            for vo in updated:
+                geometry, points = self._stored_geometry(vo)
+                (AnnotationEntity
+                 .update(label=vo.label, geometry=geometry, points=points, kind=vo.kind)
+                 .where((AnnotationEntity.entry == entity_id) & (AnnotationEntity.id == vo.id))
+                 .execute())
+            new_ids = []
+            for vo in inserted:
+                geometry, points = self._stored_geometry(vo)
+                new_ids.append(AnnotationEntity
+                               .insert(entry=entity_id, label=vo.label, geometry=geometry, points=points,
+                                       kind=vo.kind)
+                               .execute())
+        return new_ids
+
     @db.connection_context()
     def delete(self, entity_id: int):
         query = (AnnotationEntity
@@ -57,6 +177,7 @@ class AnnotaDao:
                 anns.entry.alias("annot_entry"),
                 anns.kind.alias("annot_kind"),
                 anns.points.alias("annot_points"),
+                anns.geometry.alias("annot_geometry"),
                 lbl.id.alias("label_id"),
                 lbl.name.alias("label_name"),
                 lbl.color.alias("label_color")
@@ -71,7 +192,10 @@ class AnnotaDao:
             ann_vo.id = row["annot_id"]
             ann_vo.entry = row["annot_entry"]
             ann_vo.kind = row["annot_kind"]
-            ann_vo.points = row["annot_points"]
+            if row["annot_geometry"] is not None:
+                ann_vo.geometry = self.decode_geometry(row["annot_geometry"])
+            else:
+                ann_vo.points = row["annot_points"]
             ann_vo.label = None
             if row["label_id"]:
                 label = LabelVO()
@@ -97,51 +221,84 @@ class AnnotaDao:
         return result[0]["name"] if len(result) > 0 else None
 
     @db.connection_context()
-    def fetch_all_by_dataset(self, dataset_id: int = None):
-        ann = AnnotationEntity.alias("a")
-        ds_entry = DatasetEntryEntity.alias("i")
-        lbl = LabelEntity.alias("l")
-
-        query = (
-            ann.select(
-                ds_entry.file_path.alias("image"),
-                ann.kind.alias("annot_kind"),
-                ann.points.alias("annot_points"),
-                lbl.name.alias("label_name"),
-                lbl.color.alias("label_color")
-            )
-                .join(ds_entry, on=(ann.entry == ds_entry.id))
-                .join(lbl, on=(ann.label == lbl.id), join_type=JOIN.LEFT_OUTER)
-                .where(ds_entry.dataset == dataset_id)
-        )
-        cursor = query.dicts().execute()
-        result = []
-        for row in cursor:
-            result.append(row)
+    def count_annotated_entries(self, dataset_id: int):
+        return (AnnotationEntity
+                .select(fn.COUNT(AnnotationEntity.entry.distinct()))
+                .join(DatasetEntryEntity, on=(AnnotationEntity.entry == DatasetEntryEntity.id))
+                .where(DatasetEntryEntity.dataset == dataset_id)
+                .scalar())
 
+    @db.connection_context()
+    def fetch_annotated_entry_ids(self, entry_ids: typing.Iterable[int]) -> typing.Set[int]:
+        """
+        Ids among entry_ids of the entries that have at least one annotation
+        """
+        result = set()
+        for batch in chunked(list(entry_ids), 500):
+            query = (AnnotationEntity
+                     .select(AnnotationEntity.entry)
+                     .where(AnnotationEntity.entry.in_(batch))
+                     .distinct())
+            result.update(row[0] for row in query.tuples())
         return result
 
+    def _decode_dataset_row(self, row):
+        geometry = self._row_geometry(row["annot_geometry"], row["annot_points"], row["annot_id"])
+        row["annot_geometry"] = geometry
+        if geometry is not None and row["annot_points"] is None:
+            row["annot_points"] = ",".join(map(str, geometry.ravel().tolist()))
+        return row
+
     @db.connection_context()
-    def fetch_all_by_dataset(self, dataset_id: int = None):
+    def _fetch_dataset_chunk(self, dataset_id: int, after: typing.Tuple[int, int], limit: int):
         a = AnnotationEntity.alias("a")
         i = DatasetEntryEntity.alias("i")
         l = LabelEntity.alias("l")
-
+        last_entry, last_id = after
         query = (
             a.select(
+                i.id.alias("entry_id"),
                 i.file_path.alias("image"),
+                i.width.alias("image_width"),
+                i.height.alias("image_height"),
+                i.channels.alias("image_channels"),
+                a.id.alias("annot_id"),
                 a.kind.alias("annot_kind"),
                 a.points.alias("annot_points"),
+                a.geometry.alias("annot_geometry"),
                 l.name.alias("label_name"),
                 l.color.alias("label_color")
             )
                 .join(i, on=(a.entry == i.id))
                 .join(l, on=(a.label == l.id), join_type=JOIN.LEFT_OUTER)
-                .where(i.dataset == dataset_id)
+                .where((i.dataset == dataset_id) &
+                       ((a.entry > last_entry) | ((a.entry == last_entry) & (a.id > last_id))))
+                .order_by(a.entry, a.id)
+                .limit(limit)
         )
-        cursor = query.dicts().execute()
-        result = []
-        for row in cursor:
-            result.append(row)
+        return [self._decode_dataset_row(row) for row in query.dicts().execute()]
 
-        return result
+    def iter_by_dataset(self, dataset_id: int, chunk_size: int = 5000) -> typing.Iterator[typing.Tuple[str, list]]:
+        """
+        Streams the annotations of a dataset as (image path, annotation rows) groups ordered
+        by entry. Rows are read with keyset pagination in chunks of chunk_size, so memory
+        stays bounded by the chunk size and the largest group regardless of the dataset size.
+        """
+        after = (0, 0)
+        entry_id, image, group = None, None, []
+        while True:
+            rows = self._fetch_dataset_chunk(dataset_id, after, chunk_size)
+            for row in rows:
+                if row["entry_id"] != entry_id:
+                    if group:
+                        yield image, group
+                    entry_id, image, group = row["entry_id"], row["image"], []
+                group.append(row)
+            if len(rows) < chunk_size:
+                break
+            after = (rows[-1]["entry_id"], rows[-1]["annot_id"])
+        if group:
+            yield image, group
+
+    def fetch_all_by_dataset(self, dataset_id: int = None):
+        return [row for _, rows in self.iter_by_dataset(dataset_id) for row in rows]
@@ -0,0 +1,233 @@
+import atexit
+import logging
+import threading
+import typing
+from collections import OrderedDict
+
+from dao import db
+from .annota_dao import AnnotaDao
+from vo import AnnotaVO
+
+logger = logging.getLogger(__name__)
+
+
+class _EntryChanges:
+    """
+    Pending changes of one dataset entry, successive saves are merged in place
+    """
+
+    def __init__(self, entry_id):
+        self.entry_id = entry_id
+        self.inserted = OrderedDict()
+        self.updated = OrderedDict()
+        self.deleted = set()
+        self.dropped = set()
+        self.callbacks = []
+
+    def merge(self, inserted, updated, deleted, dropped, callback):
+        for key, vo in inserted.items():
+            self.inserted[key] = vo
+        for key in dropped:
+            # a new annotation removed before it was ever written
+            if self.inserted.pop(key, None) is None:
+                self.dropped.add(key)
+        for vo in updated:
+            self.updated[vo.id] = vo
+        for annotation_id in deleted:
+            self.updated.pop(annotation_id, None)
+            self.deleted.add(annotation_id)
+        if callback:
+            self.callbacks.append(callback)
+
+
+class AnnotaWriter:
+    """
+    Write-behind queue for the annotation changes made in the image viewer.
+
+    A single writer thread owns all the annotation writes, so saves return immediately
+    while SQLite writes stay serialized. Saves for an entry that is still waiting in the
+    queue are merged into a single change set, and the writer commits several entries
+    per transaction. New annotations are identified by a client key until their id is
+    known, the callbacks receive the entry id, a dict key -> id of the inserted
+    annotations and the error if the write failed.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, dao: AnnotaDao = None, max_pending=256, batch_size=32, max_written_keys=10000):
+        self._dao = dao if dao else AnnotaDao()
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._max_written_keys = max_written_keys
+        self._pending = OrderedDict()
+        self._in_flight = set()
+        self._written_keys = OrderedDict()
+        self._listeners = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="AnnotaWriter", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def default(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                atexit.register(cls._instance.close)
+            return cls._instance
+
+    @classmethod
+    def shutdown(cls, timeout=None):
+        """
+        Flushes and stops the default writer, if it was ever started
+        """
+        with cls._instance_lock:
+            instance = cls._instance
+        if instance:
+            instance.close(timeout)
+
+    @property
+    def pending(self):
+        """
+        Number of entries with changes not committed yet
+        """
+        with self._cond:
+            return len(self._pending) + len(self._in_flight)
+
+    def add_listener(self, callback: typing.Callable[[int], None]):
+        """
+        Registers a callable invoked from the writer thread with the pending count every time it changes
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def submit(self, entry_id: int, inserted: typing.Dict[typing.Any, AnnotaVO], updated: typing.List[AnnotaVO],
+               deleted: typing.List[int], dropped: typing.List[typing.Any] = (), callback=None):
+        """
+        Queues the changes of an entry. Blocks only while the queue is full and the
+        entry is not already queued.
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the annotation writer is closed")
+            while entry_id not in self._pending and len(self._pending) >= self._max_pending:
+                self._cond.wait()
+            changes = self._pending.get(entry_id)
+            if changes is None:
+                changes = self._pending[entry_id] = _EntryChanges(entry_id)
+            changes.merge(inserted, updated, deleted, dropped, callback)
+            self._cond.notify_all()
+        self._notify_listeners()
+
+    def wait(self, entry_id: int = None, timeout=None):
+        """
+        Blocks until the changes of the entry (or all of them when entry_id is None) are committed
+        """
+        def is_done():
+            if entry_id is None:
+                return not self._pending and not self._in_flight
+            return entry_id not in self._pending and entry_id not in self._in_flight
+
+        with self._cond:
+            return self._cond.wait_for(is_done, timeout)
+
+    def flush(self, timeout=None):
+        return self.wait(None, timeout)
+
+    def close(self, timeout=None):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _notify_listeners(self):
+        pending = self.pending
+        for listener in list(self._listeners):
+            try:
+                listener(pending)
+            except Exception:
+                logger.exception("pending writes listener failed")
+
+    def _take_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending or self._closed)
+            batch = []
+            while self._pending and len(batch) < self._batch_size:
+                _, changes = self._pending.popitem(last=False)
+                self._in_flight.add(changes.entry_id)
+                batch.append(changes)
+            self._cond.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                # closed and drained
+                return
+            try:
+                with db.connection_context():
+                    try:
+                        with db.atomic():
+                            results = [(changes, self._write(changes), None) for changes in batch]
+                    except Exception:
+                        # retry one entry per transaction so a bad entry does not drop the others
+                        results = [self._write_isolated(changes) for changes in batch]
+            except Exception as ex:
+                results = [(changes, {}, ex) for changes in batch]
+            for changes, new_ids, error in results:
+                if error is None:
+                    self._remember_keys(new_ids)
+                else:
+                    logger.error("saving the annotations of entry %s failed: %s", changes.entry_id, error)
+            with self._cond:
+                for changes in batch:
+                    self._in_flight.discard(changes.entry_id)
+                self._cond.notify_all()
+            for changes, new_ids, error in results:
+                for callback in changes.callbacks:
+                    try:
+                        callback(changes.entry_id, new_ids, error)
+                    except Exception:
+                        logger.exception("annotation write callback failed")
+            self._notify_listeners()
+
+    def _write_isolated(self, changes):
+        try:
+            with db.atomic():
+                return changes, self._write(changes), None
+        except Exception as ex:
+            return changes, {}, ex
+
+    def _write(self, changes: _EntryChanges):
+        inserted, updated = [], list(changes.updated.values())
+        deleted = set(changes.deleted)
+        keys, ids = [], dict()
+        for key, vo in changes.inserted.items():
+            annotation_id = self._written_keys.get(key)
+            if annotation_id is None:
+                keys.append(key)
+                inserted.append(vo)
+            else:
+                # written by an earlier batch before the caller learned its id
+                vo.id = annotation_id
+                updated.append(vo)
+                ids[key] = annotation_id
+        for key in changes.dropped:
+            annotation_id = self._written_keys.get(key)
+            if annotation_id is not None:
+                deleted.add(annotation_id)
+        updated = [vo for vo in updated if vo.id not in deleted]
+        new_ids = self._dao.save_changes(changes.entry_id, inserted, updated, list(deleted))
+        ids.update(zip(keys, new_ids))
+        return ids
+
+    def _remember_keys(self, new_ids):
+        self._written_keys.update(new_ids)
+        while len(self._written_keys) > self._max_written_keys:
+            self._written_keys.popitem(last=False)
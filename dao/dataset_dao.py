@@ -1,10 +1,11 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from peewee import *
 
 from datetime import datetime
 from dao import db,DatasetEntity,DatasetEntryEntity,LabelEntity
-from util import MiscUtilities
+from util import MiscUtilities,FileUtilities,ImageUtilities
 from vo import DatasetVO,DatasetEntryVO,LabelVO
 
 
@@ -51,8 +52,9 @@ class DatasetDao:
             DatasetEntryEntity
                 .select()
                 .where((DatasetEntryEntity.dataset == ds_id)
-                       & (DatasetEntryEntity.file_path.endswith(os.path.split(image_path)[1]))))
-        #print(query)
+                       & (DatasetEntryEntity.file_name.collate("NOCASE") == os.path.basename(image_path)))
+                .order_by(DatasetEntryEntity.id)
+                .limit(1))
         cursor = query.dicts().execute()
         result = list(cursor)
         vo = DatasetEntryVO()
@@ -63,6 +65,32 @@ class DatasetDao:
             return vo
         return None
 
+    @db.connection_context()
+    def find_by_names(self, ds_id, names):
+        """
+        Bulk version of find_by_path, returns a dict file name -> DatasetEntryVO for the
+        names found in the dataset. Names are matched ignoring the case, like find_by_path.
+        When several entries match a name the first one added wins.
+        """
+        result = {}
+        requested = {}
+        for name in {os.path.basename(name) for name in names}:
+            requested.setdefault(name.lower(), []).append(name)
+        for batch in chunked([name for group in requested.values() for name in group], 500):
+            query = DatasetEntryEntity \
+                .select() \
+                .where((DatasetEntryEntity.dataset == ds_id) & DatasetEntryEntity.file_name.collate("NOCASE").in_(batch)) \
+                .order_by(DatasetEntryEntity.id)
+            for row in query.dicts():
+                for name in requested.get(row["file_name"].lower(), []):
+                    if name in result:
+                        continue
+                    vo = DatasetEntryVO()
+                    for k, v in row.items():
+                        setattr(vo, k, v)
+                    result[name] = vo
+        return result
+
     @db.connection_context()
     def delete(self, id: int):
         results = DatasetEntity.delete_by_id(id)
@@ -76,15 +104,142 @@ class DatasetDao:
                         .update(label = label.id)
                             .where(DatasetEntryEntity.id.in_(list(chunk))).execute())
 
+    @db.atomic()
+    def set_entry_labels(self, rows):
+        """
+        rows: iterable of (entry id, label id), one update per label
+        """
+        groups = {}
+        for entry_id, label_id in rows:
+            groups.setdefault(label_id, []).append(entry_id)
+        for label_id, ids in groups.items():
+            for chunk in chunked(ids, 500):
+                DatasetEntryEntity.update(label=label_id).where(DatasetEntryEntity.id.in_(chunk)).execute()
+
+    ENTRY_FIELDS = ["file_path", "file_size", "dataset", "label", "width", "height", "channels", "mtime", "file_hash",
+                    "file_name"]
+
     @db.atomic()
     def add_entries(self, entries: [DatasetEntryVO]):
         try:
             entries = [vo.to_array() for vo in entries]
             for batch in chunked(entries, 100):
-                DatasetEntryEntity.insert_many(batch).execute()
+                DatasetEntryEntity.insert_many(batch, fields=self.ENTRY_FIELDS).execute()
         except IntegrityError as ex:
             raise Exception("one or more files have already been loaded into this dataset")
 
+    @db.atomic()
+    def insert_entries(self, rows: [dict]):
+        """
+        Inserts entries given as dicts of column values, files already in the dataset are ignored
+        """
+        for row in rows:
+            row.setdefault("file_name", os.path.basename(row["file_path"]))
+        for batch in chunked(rows, 100):
+            DatasetEntryEntity.insert_many(batch).on_conflict_ignore().execute()
+
+    @db.connection_context()
+    def fetch_existing_paths(self, ds_id, paths):
+        result = set()
+        for batch in chunked(paths, 500):
+            query = DatasetEntryEntity \
+                .select(DatasetEntryEntity.file_path) \
+                .where((DatasetEntryEntity.dataset == ds_id) & DatasetEntryEntity.file_path.in_(batch))
+            result.update(row.file_path for row in query)
+        return result
+
+    @db.connection_context()
+    def fetch_existing_hashes(self, ds_id, hashes):
+        result = set()
+        for batch in chunked(hashes, 500):
+            query = DatasetEntryEntity \
+                .select(DatasetEntryEntity.file_hash) \
+                .where((DatasetEntryEntity.dataset == ds_id) & DatasetEntryEntity.file_hash.in_(batch))
+            result.update(row.file_hash for row in query)
+        return result
+
+    @staticmethod
+    def read_file_metadata(file_path: str):
+        """
+        Size, modification time, content hash and, for images, the dimensions read from the
+        file header. The pixels are never decoded.
+        """
+        stat = os.stat(file_path)
+        metadata = {
+            "file_size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "width": None,
+            "height": None,
+            "channels": None,
+            "file_hash": FileUtilities.hash_file(file_path)
+        }
+        try:
+            metadata["height"], metadata["width"], metadata["channels"] = ImageUtilities.probe(file_path)
+        except Exception:
+            # not an image, or a format the header reader does not know
+            pass
+        return metadata
+
+    @db.connection_context()
+    def fetch_entries_missing_metadata(self, ds_id=None, after_id=0, limit=500):
+        query = DatasetEntryEntity \
+            .select(DatasetEntryEntity.id, DatasetEntryEntity.file_path) \
+            .where((DatasetEntryEntity.id > after_id) & DatasetEntryEntity.file_hash.is_null())
+        if ds_id is not None:
+            query = query.where(DatasetEntryEntity.dataset == ds_id)
+        query = query.order_by(DatasetEntryEntity.id).limit(limit)
+        return [(row.id, row.file_path) for row in query]
+
+    @db.connection_context()
+    def fetch_entry_paths(self, ds_id, entry_ids=None, after_id=0):
+        """
+        Returns the (id, file_path) tuples of the entries of a dataset in id order, restricted
+        to entry_ids when given and to the ids greater than after_id
+        """
+        query = DatasetEntryEntity \
+            .select(DatasetEntryEntity.id, DatasetEntryEntity.file_path) \
+            .where((DatasetEntryEntity.dataset == ds_id) & (DatasetEntryEntity.id > after_id))
+        if entry_ids is None:
+            return list(query.order_by(DatasetEntryEntity.id).tuples())
+        result = []
+        for chunk in chunked(sorted(set(entry_ids)), 500):
+            result.extend(query.where(DatasetEntryEntity.id.in_(chunk)).order_by(DatasetEntryEntity.id).tuples())
+        return result
+
+    @db.atomic()
+    def update_entries_metadata(self, rows):
+        """
+        rows: iterable of (entry id, metadata dict)
+        """
+        for entry_id, metadata in rows:
+            DatasetEntryEntity.update(**metadata).where(DatasetEntryEntity.id == entry_id).execute()
+
+    def backfill_metadata(self, ds_id=None, workers=8, batch_size=500, progress_callback=None):
+        """
+        Fills the metadata columns of the entries added before they existed.
+        Missing files are skipped. Returns the number of updated entries.
+        """
+        def read(entry):
+            entry_id, file_path = entry
+            try:
+                return entry_id, self.read_file_metadata(file_path)
+            except OSError:
+                return entry_id, None
+
+        updated, after_id = 0, 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                entries = self.fetch_entries_missing_metadata(ds_id, after_id, batch_size)
+                if not entries:
+                    break
+                after_id = entries[-1][0]
+                rows = [row for row in executor.map(read, entries) if row[1] is not None]
+                self.update_entries_metadata(rows)
+                updated += len(rows)
+                if progress_callback:
+                    progress_callback(updated)
+        return updated
+
     @db.connection_context()
     def delete_entry(self, id):
         return DatasetEntryEntity.delete_by_id(id)
@@ -129,18 +284,53 @@ class DatasetDao:
                 setattr(vo, k, v)
         return result
 
+    @db.connection_context()
+    def count_entries(self, ds_id):
+        return DatasetEntryEntity \
+            .select() \
+            .where(DatasetEntryEntity.dataset == ds_id) \
+            .count()
+
+    @db.connection_context()
+    def fetch_entries_page(self, ds_id, after_id=None, limit=50):
+        query = DatasetEntryEntity \
+            .select() \
+            .where(DatasetEntryEntity.dataset == ds_id)
+        if after_id is not None:
+            query = query.where(DatasetEntryEntity.id > after_id)
+        query = query.order_by(DatasetEntryEntity.id).limit(limit)
+        return self._to_entries(query.dicts().execute())
+
+    @db.connection_context()
+    def fetch_entries_page_before(self, ds_id, before_id=None, limit=50):
+        query = DatasetEntryEntity \
+            .select() \
+            .where(DatasetEntryEntity.dataset == ds_id)
+        if before_id is not None:
+            query = query.where(DatasetEntryEntity.id < before_id)
+        query = query.order_by(DatasetEntryEntity.id.desc()).limit(limit)
+        result = self._to_entries(query.dicts().execute())
+        result.reverse()
+        return result
+
+    @staticmethod
+    def _to_entries(cursor):
+        result = []
+        for row in cursor:
+            vo = DatasetEntryVO()
+            result.append(vo)
+            for k, v in row.items():
+                setattr(vo, k, v)
+        return result
+
     @db.connection_context()
     def fetch_entries_for_classification(self, ds_id):
-        en: DatasetEntryEntity=DatasetEntryEntity.alias("en")
-        lbl: LabelEntity =LabelEntity.alias("lbl")
-        query = (en.select(
-                    en.file_path,
-                    lbl.name
-                )
-                .join(
-                    lbl,
-                    JOIN.INNER,
-                    on=en.label == lbl.id)
-                .where(en.dataset == ds_id and en.label.is_null(False)))
-        cursor = query.dicts().execute()
-        return list(cursor)
+        """
+        Returns the (file_path, label name) tuples of the labeled entries of a dataset in insertion order
+        """
+        query = (DatasetEntryEntity
+                 .select(DatasetEntryEntity.file_path, LabelEntity.name)
+                 .join(LabelEntity, JOIN.INNER, on=(DatasetEntryEntity.label == LabelEntity.id))
+                 .where((DatasetEntryEntity.dataset == ds_id) & DatasetEntryEntity.label.is_null(False))
+                 .order_by(DatasetEntryEntity.id))
+        return list(query.tuples().execute())
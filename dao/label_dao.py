@@ -1,3 +1,5 @@
+from peewee import chunked
+
 from dao import db,LabelEntity,DatasetEntryEntity
 from vo import LabelVO
 
@@ -17,6 +19,26 @@ class LabelDao:
 
         return vo
 
+    @db.atomic()
+    def save_many(self, labels: [LabelVO]):
+        """
+        Creates the labels with bulk inserts and sets their ids
+        """
+        for vo in labels:
+            vo.name = vo.name.title()
+        for batch in chunked(labels, 100):
+            rows = [(vo.name, vo.color, vo.dataset) for vo in batch]
+            LabelEntity.insert_many(rows, fields=["name", "color", "dataset"]).execute()
+            # labels are only ever appended, the new ones are the last ids of their names
+            query = LabelEntity \
+                .select(LabelEntity.id, LabelEntity.name, LabelEntity.dataset) \
+                .where(LabelEntity.name.in_([vo.name for vo in batch])) \
+                .order_by(LabelEntity.id)
+            ids = {(row.name, row.dataset_id): row.id for row in query}
+            for vo in batch:
+                vo.id = ids[(vo.name, vo.dataset)]
+        return labels
+
     @db.connection_context()
     def fetch_all(self, ds_id):
         cursor = LabelEntity.select().where(LabelEntity.dataset == ds_id).dicts().execute()
@@ -0,0 +1,155 @@
+"""
+Versioned schema migrations for studio.db.
+
+The schema version is stored in ``PRAGMA user_version``. Each migration upgrades the
+database from the previous version and runs in its own transaction. Databases created
+from scratch already match the current models, so they are stamped with the latest
+version without running anything.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _v1_secondary_indexes(db):
+    # index names match the ones peewee derives from the models, so create_tables() sees them as existing
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "annotationentity_entry_id" ON "annotation" ("entry_id")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "annotationentity_label_id" ON "annotation" ("label_id")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "labelentity_dataset_id" ON "label" ("dataset_id")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "labelentity_dataset_id_name" ON "label" ("dataset_id", "name")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "datasetentryentity_dataset_id" ON "media" ("dataset_id")')
+    db.execute_sql('CREATE INDEX IF NOT EXISTS "datasetentryentity_label" ON "media" ("label")')
+
+
+def _v2_packed_geometry(db, batch_size=10000):
+    from vo import AnnotaVO
+    from .annota_dao import AnnotaDao
+    if not db.table_exists("annotation"):
+        return
+    if "geometry" not in [column.name for column in db.get_columns("annotation")]:
+        db.execute_sql('ALTER TABLE "annotation" ADD COLUMN "geometry" BLOB')
+    # pack the existing text coordinates, walking the table by id. The text is kept for older
+    # builds and external tools, AnnotaDao.compact_points drops it on request
+    last_id, failed = 0, 0
+    while True:
+        rows = db.execute_sql(
+            'SELECT "id", "points" FROM "annotation" WHERE "id" > ? AND "geometry" IS NULL ORDER BY "id" LIMIT ?',
+            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = []
+        for annot_id, points in rows:
+            try:
+                geometry = AnnotaVO.parse_points(points) if points else None
+            except ValueError:
+                # left as text, the DAO parses it again on read
+                failed += 1
+                logger.warning("annotation %s has malformed points, it was not packed: %r", annot_id, points[:80])
+                continue
+            updates.append((AnnotaDao.encode_geometry(geometry), annot_id))
+        db.connection().executemany('UPDATE "annotation" SET "geometry" = ? WHERE "id" = ?', updates)
+    if failed:
+        logger.warning("%d annotations with malformed points were not packed", failed)
+
+
+def _v3_entry_metadata(db):
+    # SQLite can not change a column type in place, so the media table is rebuilt
+    # (foreign keys are disabled by run_migrations while this runs)
+    if not db.table_exists("media"):
+        return
+    db.execute_sql('''
+        CREATE TABLE "media_new" (
+            "id" INTEGER NOT NULL PRIMARY KEY,
+            "file_path" VARCHAR(255) NOT NULL,
+            "file_size" INTEGER NOT NULL,
+            "dataset_id" INTEGER NOT NULL,
+            "label" INTEGER,
+            "width" INTEGER,
+            "height" INTEGER,
+            "channels" INTEGER,
+            "mtime" REAL,
+            "file_hash" VARCHAR(255),
+            FOREIGN KEY ("dataset_id") REFERENCES "dataset" ("id") ON DELETE CASCADE)''')
+    db.execute_sql('''
+        INSERT INTO "media_new" ("id", "file_path", "file_size", "dataset_id", "label")
+        SELECT "id", "file_path", CAST(COALESCE("file_size", 0) AS INTEGER), "dataset_id", "label" FROM "media"''')
+    db.execute_sql('DROP TABLE "media"')
+    db.execute_sql('ALTER TABLE "media_new" RENAME TO "media"')
+    db.execute_sql('CREATE UNIQUE INDEX "datasetentryentity_file_path_dataset_id" ON "media" ("file_path", "dataset_id")')
+    db.execute_sql('CREATE INDEX "datasetentryentity_dataset_id" ON "media" ("dataset_id")')
+    db.execute_sql('CREATE INDEX "datasetentryentity_label" ON "media" ("label")')
+    db.execute_sql('CREATE INDEX "datasetentryentity_file_hash" ON "media" ("file_hash")')
+
+
+def _v4_entry_file_name(db, batch_size=10000):
+    import os
+    if not db.table_exists("media"):
+        return
+    if "file_name" not in [column.name for column in db.get_columns("media")]:
+        # matched ignoring the case, the index below inherits the collation of the column
+        db.execute_sql('ALTER TABLE "media" ADD COLUMN "file_name" VARCHAR(255) COLLATE NOCASE')
+    # SQLite has no basename function, the names are filled in from python walking the table by id
+    last_id = 0
+    while True:
+        rows = db.execute_sql(
+            'SELECT "id", "file_path" FROM "media" WHERE "id" > ? AND "file_name" IS NULL ORDER BY "id" LIMIT ?',
+            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = [(os.path.basename(file_path), entry_id) for entry_id, file_path in rows]
+        db.connection().executemany('UPDATE "media" SET "file_name" = ? WHERE "id" = ?', updates)
+    db.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "datasetentryentity_dataset_id_file_name" ON "media" ("dataset_id", "file_name")')
+
+
+MIGRATIONS = [
+    (1, _v1_secondary_indexes),
+    (2, _v2_packed_geometry),
+    (3, _v3_entry_metadata),
+    (4, _v4_entry_file_name),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(db):
+    return db.execute_sql("PRAGMA user_version").fetchone()[0]
+
+
+def set_version(db, version):
+    db.execute_sql("PRAGMA user_version = {:d}".format(version))
+
+
+def run_migrations(db, is_new=False, target_version=None):
+    """
+    Upgrades the database to target_version, the latest version by default
+    """
+    if is_new:
+        set_version(db, LATEST_VERSION)
+        return LATEST_VERSION
+    current = get_version(db)
+    target_version = LATEST_VERSION if target_version is None else target_version
+    pending = [(version, migration) for version, migration in MIGRATIONS if current < version <= target_version]
+    if not pending:
+        return current
+    # table rebuilds drop and recreate referenced tables, which must not cascade.
+    # the pragma is a no-op inside a transaction, so it is switched outside of them
+    db.execute_sql("PRAGMA foreign_keys=OFF")
+    try:
+        for version, migration in pending:
+            with db.atomic():
+                # older databases may already hold orphan rows, only new violations are an error
+                violations = len(db.execute_sql("PRAGMA foreign_key_check").fetchall())
+                migration(db)
+                new_violations = len(db.execute_sql("PRAGMA foreign_key_check").fetchall()) - violations
+                if new_violations > 0:
+                    raise RuntimeError("migration {} broke {} foreign key references".format(version, new_violations))
+                set_version(db, version)
+            current = version
+    finally:
+        db.execute_sql("PRAGMA foreign_keys=ON")
+    # refresh the planner statistics so the new indexes get picked up
+    db.execute_sql("ANALYZE")
+    return current
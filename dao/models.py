@@ -25,12 +25,20 @@ class DatasetEntity(BaseModel):
 
 class DatasetEntryEntity(BaseModel):
     file_path = CharField()
-    file_size = CharField()
+    # matched ignoring the case, like the LIKE lookup it replaced
+    file_name = CharField(null=True, collation="NOCASE")
+    file_size = IntegerField()
     dataset = ForeignKeyField(DatasetEntity, on_delete="CASCADE")
-    label = IntegerField(null=True)
+    label = IntegerField(null=True, index=True)
+    width = IntegerField(null=True)
+    height = IntegerField(null=True)
+    channels = IntegerField(null=True)
+    mtime = FloatField(null=True)
+    file_hash = CharField(null=True, index=True)
     class Meta:
         indexes = (
             (("file_path", "dataset"), True),
+            (("dataset", "file_name"), False),
         )
         table_name = 'media'
 
@@ -41,6 +49,9 @@ class LabelEntity(BaseModel):
     color = CharField(null=None)
     dataset = ForeignKeyField(DatasetEntity, on_delete="CASCADE")
     class Meta:
+        indexes = (
+            (("dataset", "name"), False),
+        )
         table_name = 'label'
 
 
@@ -65,13 +76,15 @@ class AnnotationEntity(BaseModel):
     entry = ForeignKeyField(DatasetEntryEntity, on_delete="CASCADE")
     label = ForeignKeyField(LabelEntity, null=True, on_delete="CASCADE")
     points = CharField(null=True)
+    geometry = BlobField(null=True)
     kind = CharField(null=True)
     class Meta:
         table_name = "annotation"
 
 
 def create_tables():
-    with db:
+    from .migrations import run_migrations
+    with db.connection_context():
         models = [
             DatasetEntity,
             HubEntity,
@@ -80,6 +93,8 @@ def create_tables():
             LabelEntity,
             AnnotationEntity
         ]
+        # upgrade existing databases in place before creating whatever is missing
+        run_migrations(db, is_new=not db.table_exists(DatasetEntity._meta.table_name))
         #db.drop_tables(models)
         db.create_tables(models)
         # Create the foreign-key constraint:
@@ -0,0 +1,9 @@
+from .annotation_writer import AnnotationWriter
+from .coco_writer import CocoWriter
+from .json_writer import JsonWriter
+from .pascal_voc_writer import PascalVOCWriter
+from .yolo_writer import YoloWriter
+from .pascal_voc_reader import PascalVOCReader, PascalVOCDocument
+from .tfrecord_writer import TFRecordWriter
+from .webdataset_writer import WebDatasetWriter
+from .pascal_voc_importer import PascalVOCImporter, ImportResult
@@ -0,0 +1,64 @@
+import abc
+import functools
+import os
+import typing
+
+from .parallel import map_batches
+
+
+def _write_batch(writer, batch):
+    return writer.write_batch(batch)
+
+
+class AnnotationWriter(abc.ABC):
+    """
+    Base class of the annotation exporters.
+
+    An exporter receives the (image path, annotation rows) groups streamed by
+    AnnotaDao.iter_by_dataset and writes one output file per image. Images are sent
+    to a process pool in batches, with at most two batches per process in flight,
+    so memory stays bounded on large datasets. Writers are pickled into the worker
+    processes and must only hold plain attributes. Writers whose work is mostly I/O
+    set threads to use a thread pool instead, which all the file per image writers do:
+    a spawned process imports the application again (Qt, torch) before its first batch,
+    which costs more than these writers save on any dataset.
+    """
+    extension = None
+    threads = False
+
+    def __init__(self, output_folder: str):
+        self.output_folder = output_folder
+
+    def output_path(self, image_path: str):
+        file_name, _ = os.path.splitext(os.path.basename(image_path))
+        return os.path.join(self.output_folder, file_name + self.extension)
+
+    @abc.abstractmethod
+    def write_image(self, image_path: str, annotations: typing.List[dict]) -> bool:
+        """
+        Writes the annotations of one image, returns False when there was nothing to write
+        """
+        raise NotImplementedError
+
+    def write_batch(self, batch: typing.Sequence[typing.Tuple[str, list]]) -> int:
+        """
+        Writes a batch of image groups and returns the number of files written,
+        writers can override it to vectorize the work across the batch
+        """
+        return sum(1 for image_path, annotations in batch if self.write_image(image_path, annotations))
+
+    def export(self, images: typing.Iterable[typing.Tuple[str, list]], workers: int = None, batch_size: int = 64,
+               progress_callback: typing.Callable[[int], None] = None) -> int:
+        """
+        Exports every image group and returns the number of files written.
+        workers=0 writes in the calling thread, None uses one worker per CPU.
+        progress_callback receives the number of images processed so far.
+        """
+        processed, written = 0, 0
+        for size, count in map_batches(functools.partial(_write_batch, self), images, batch_size, workers,
+                                       self.threads):
+            written += count
+            processed += size
+            if progress_callback:
+                progress_callback(processed)
+        return written
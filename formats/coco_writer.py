@@ -0,0 +1,139 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+import numpy as np
+
+from . import geometry, rle
+from .image_info import row_image_size
+from .parallel import chunks
+
+
+class CocoWriter:
+    """
+    Single COCO instances file for a whole dataset.
+
+    The document is never built in memory: the image records are written to the output
+    as the (image path, annotation rows) groups of AnnotaDao.iter_by_dataset arrive, the
+    annotation records are spooled to a temporary file next to it and appended once the
+    cursor is exhausted, followed by the categories. Areas and bounding boxes are computed
+    with NumPy over batches of images. Boxes and ellipses are written as polygons, or every
+    shape as an uncompressed RLE mask when masks is set.
+    """
+    KINDS = ("box", "ellipse", "polygon")
+    _MIN_POINTS = {"box": 2, "ellipse": 2, "polygon": 3}
+
+    def __init__(self, output_file: str, masks: bool = False, batch_size: int = 256, ellipse_vertices: int = 32):
+        self.output_file = output_file
+        self.masks = masks
+        self.batch_size = batch_size
+        self.ellipse_vertices = ellipse_vertices
+
+    @staticmethod
+    def _dumps(record):
+        return json.dumps(record, separators=(",", ":"))
+
+    def _image_record(self, image_path, rows):
+        try:
+            width, height, _ = row_image_size(image_path, rows[0])
+        except OSError:
+            # the file is gone, the image is still listed so its annotations stay valid
+            width, height = None, None
+        return {
+            "id": rows[0]["entry_id"],
+            "file_name": os.path.basename(image_path),
+            "path": image_path,
+            "width": width,
+            "height": height
+        }
+
+    def _segmentations(self, kinds, geometries, boxes):
+        segmentations = [None] * len(kinds)
+        for kind, shapes in (("box", geometry.box_polygons),
+                             ("ellipse", lambda b: geometry.ellipse_polygons(b, self.ellipse_vertices))):
+            indices = np.flatnonzero(kinds == kind)
+            if len(indices):
+                for index, polygon in zip(indices, np.round(shapes(boxes[indices]), 2).tolist()):
+                    segmentations[index] = polygon
+        for index in np.flatnonzero(kinds == "polygon"):
+            segmentations[index] = geometries[index].ravel().tolist()
+        return segmentations
+
+    def _annotation_records(self, batch, images, categories, next_id):
+        rows = [row for _, group in batch for row in group
+                if row["annot_kind"] in self.KINDS and row["label_name"] not in (None, "None")
+                and row["annot_geometry"] is not None
+                and len(row["annot_geometry"]) >= self._MIN_POINTS[row["annot_kind"]]]
+        if not rows:
+            return []
+        kinds = np.array([row["annot_kind"] for row in rows])
+        geometries = [row["annot_geometry"] for row in rows]
+        points, starts = geometry.concatenate(geometries)
+        boxes = geometry.bounding_boxes(points, starts)
+        areas = geometry.polygon_areas(points, starts)
+        box_areas = boxes[:, 2] * boxes[:, 3]
+        areas = np.where(kinds == "box", box_areas, np.where(kinds == "ellipse", box_areas * np.pi / 4, areas))
+        segmentations = self._segmentations(kinds, geometries, boxes)
+        records = []
+        for i, (row, bbox, area, segmentation) in enumerate(
+                zip(rows, np.round(boxes, 2).tolist(), np.round(areas, 2).tolist(), segmentations)):
+            category_id = categories.setdefault(row["label_name"], len(categories) + 1)
+            image = images[row["entry_id"]]
+            if self.masks and image["width"] and image["height"]:
+                mask = rle.rasterize([np.asarray(segmentation).reshape(-1, 2)], image["height"], image["width"])
+                counts = rle.encode(mask)
+                segmentation = {"size": [image["height"], image["width"]], "counts": counts}
+                area = rle.area(counts)
+            else:
+                segmentation = [segmentation]
+            records.append({
+                "id": next_id + i,
+                "image_id": row["entry_id"],
+                "category_id": category_id,
+                "segmentation": segmentation,
+                "area": area,
+                "bbox": bbox,
+                "iscrowd": 0
+            })
+        return records
+
+    def export(self, images: typing.Iterable[typing.Tuple[str, list]],
+               progress_callback: typing.Callable[[int], None] = None) -> int:
+        """
+        Writes the file and returns the number of annotations exported.
+        progress_callback receives the number of images processed so far.
+        """
+        folder = os.path.dirname(os.path.abspath(self.output_file))
+        categories = dict()
+        processed, annotations = 0, 0
+        tmp_file = self.output_file + ".tmp"
+        with open(tmp_file, "w") as out, tempfile.TemporaryFile("w+", dir=folder) as spool:
+            info = {
+                "description": os.path.splitext(os.path.basename(self.output_file))[0],
+                "date_created": datetime.datetime.now().isoformat()
+            }
+            out.write('{{"info":{},"licenses":[],"images":['.format(self._dumps(info)))
+            for batch in chunks(images, self.batch_size):
+                records = {}
+                for image_path, rows in batch:
+                    record = self._image_record(image_path, rows)
+                    out.write(("," if processed or records else "") + self._dumps(record))
+                    records[record["id"]] = record
+                for record in self._annotation_records(batch, records, categories, annotations + 1):
+                    spool.write(("," if annotations else "") + self._dumps(record))
+                    annotations += 1
+                processed += len(batch)
+                if progress_callback:
+                    progress_callback(processed)
+            out.write('],"annotations":[')
+            spool.seek(0)
+            shutil.copyfileobj(spool, out)
+            out.write('],"categories":')
+            out.write(self._dumps([{"id": category_id, "name": name, "supercategory": ""}
+                                   for name, category_id in categories.items()]))
+            out.write("}")
+        os.replace(tmp_file, self.output_file)
+        return annotations
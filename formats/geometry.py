@@ -0,0 +1,63 @@
+import typing
+
+import numpy as np
+
+
+def concatenate(geometries: typing.List[np.ndarray]) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Stacks the (N, 2) geometries into a single float64 array and returns it with
+    the offset of the first point of each geometry, so ragged shapes can be
+    reduced with the ufunc reduceat methods instead of a python loop
+    """
+    counts = np.fromiter((len(g) for g in geometries), dtype=np.int64, count=len(geometries))
+    starts = np.zeros(len(geometries), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    points = np.concatenate(geometries).astype(np.float64) if geometries else np.zeros((0, 2))
+    return points, starts
+
+
+def bounding_boxes(points: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    (K, 4) array of x, y, width, height for each geometry
+    """
+    if len(starts) == 0:
+        return np.zeros((0, 4))
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+    return np.hstack((mins, maxs - mins))
+
+
+def polygon_areas(points: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Shoelace areas of the closed polygons
+    """
+    if len(starts) == 0:
+        return np.zeros(0)
+    # index of the next vertex, wrapping around at the end of each polygon
+    following = np.arange(1, len(points) + 1)
+    ends = np.append(starts[1:], len(points))
+    following[ends - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    return np.abs(np.add.reduceat(cross, starts)) / 2
+
+
+def box_polygons(boxes: np.ndarray) -> np.ndarray:
+    """
+    (K, 8) corner coordinates of the x, y, width, height boxes, clockwise from the top left
+    """
+    x, y, w, h = boxes.T
+    return np.stack((x, y, x + w, y, x + w, y + h, x, y + h), axis=1)
+
+
+def ellipse_polygons(boxes: np.ndarray, vertices: int = 32) -> np.ndarray:
+    """
+    (K, 2 * vertices) polygons approximating the ellipses inscribed in the x, y, width, height boxes
+    """
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    rx, ry = boxes[:, 2:3] / 2, boxes[:, 3:4] / 2
+    cx, cy = boxes[:, 0:1] + rx, boxes[:, 1:2] + ry
+    polygons = np.empty((len(boxes), vertices * 2))
+    polygons[:, 0::2] = cx + rx * np.cos(angles)
+    polygons[:, 1::2] = cy + ry * np.sin(angles)
+    return polygons
@@ -0,0 +1,23 @@
+from PIL import Image
+
+_DEPTHS = {"1": 1, "L": 1, "P": 1, "I": 1, "F": 1, "LA": 2, "RGB": 3, "YCbCr": 3, "LAB": 3, "HSV": 3,
+           "RGBA": 4, "CMYK": 4}
+
+
+def read_image_size(image_path: str):
+    """
+    Reads (width, height, depth) from the image header without decoding the pixels
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+        return width, height, _DEPTHS.get(image.mode, 3)
+
+
+def row_image_size(image_path: str, row: dict):
+    """
+    (width, height, depth) of an image of AnnotaDao.iter_by_dataset, from the columns
+    stored at ingest, or from the file header for the entries added before they existed
+    """
+    if row.get("image_width") and row.get("image_height"):
+        return row["image_width"], row["image_height"], row.get("image_channels") or 3
+    return read_image_size(image_path)
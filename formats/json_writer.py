@@ -0,0 +1,32 @@
+import json
+import typing
+
+from .annotation_writer import AnnotationWriter
+
+
+class JsonWriter(AnnotationWriter):
+    """
+    One JSON document per image: {"path": ..., "regions": [{"kind", "points", "label", "color"}]}
+    """
+    extension = ".json"
+    threads = True
+
+    def __init__(self, output_folder: str, indent: int = 3):
+        super(JsonWriter, self).__init__(output_folder)
+        self.indent = indent
+
+    def write_image(self, image_path: str, annotations: typing.List[dict]) -> bool:
+        document = {
+            "path": image_path,
+            "regions": [
+                {
+                    "kind": annot["annot_kind"],
+                    "points": annot["annot_points"],
+                    "label": annot["label_name"],
+                    "color": annot["label_color"]
+                }
+                for annot in annotations]
+        }
+        with open(self.output_path(image_path), "w") as f:
+            json.dump(document, f, indent=self.indent)
+        return True
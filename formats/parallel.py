@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import typing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+
+def chunks(iterable, size):
+    # formats is imported by the pool processes, keep it free of the Qt based util package
+    it = iter(iterable)
+    return iter(lambda: tuple(islice(it, size)), ())
+
+
+def _executor(workers, threads):
+    if threads:
+        return ThreadPoolExecutor(max_workers=workers)
+    # spawn: forking a process that runs Qt and database threads is not safe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def map_batches(function: typing.Callable, items: typing.Iterable, batch_size: int = 64,
+                workers: int = None, threads: bool = False) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+    """
+    Calls function(batch) for consecutive batches of the items and yields (batch length, result)
+    as the batches complete, not necessarily in order. workers=0 runs in the calling thread,
+    None uses one worker per CPU. At most two batches per worker are in flight, so the items
+    can be a lazy iterator over a large input. The function must be picklable unless threads
+    is set, in which case the batches run in a thread pool instead of processes.
+    """
+    batches = chunks(items, batch_size)
+    if workers == 0:
+        for batch in batches:
+            yield len(batch), function(batch)
+        return
+    workers = workers or os.cpu_count() or 1
+    with _executor(workers, threads) as executor:
+        in_flight = dict()
+        for batch in batches:
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future.result()
+            in_flight[executor.submit(function, batch)] = len(batch)
+        for future in list(in_flight):
+            yield in_flight.pop(future), future.result()
@@ -0,0 +1,123 @@
+import random
+import time
+import typing
+
+from vo import AnnotaVO, LabelVO
+from .parallel import chunks
+from .pascal_voc_reader import PascalVOCReader
+
+
+class ImportResult:
+    def __init__(self):
+        self.files = 0
+        self.parsed = 0
+        self.failed = 0
+        self.missing_images = 0
+        self.entries = 0
+        self.annotations = 0
+        self.new_labels = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self):
+        return self.files / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class PascalVOCImporter:
+    """
+    Imports the boxes of Pascal VOC files into a dataset.
+
+    1. the files are parsed in a thread pool by PascalVOCReader
+    2. the images are matched to the dataset entries by file name with one bulk lookup
+    3. the label names are resolved through an in-memory cache of the dataset labels,
+       the missing labels are created with a single bulk insert
+    4. the boxes are grouped per entry and saved in chunks of entries, each chunk in one
+       transaction. The boxes are added to the existing annotations of the entries, the
+       annotations drawn by hand are kept.
+
+    The DAOs are passed in so the importer can be used without the GUI database setup.
+    progress_callback receives [stage, processed, total, files per second], where stage
+    is PARSE (processed files) or SAVE (saved entries).
+    """
+    PARSE = "parse"
+    SAVE = "save"
+
+    def __init__(self, dataset_id, dataset_dao, label_dao, annot_dao, colors: typing.List[str] = None,
+                 workers: int = None, batch_size: int = 64, chunk_size: int = 500):
+        self._dataset_id = dataset_id
+        self._dataset_dao = dataset_dao
+        self._label_dao = label_dao
+        self._annot_dao = annot_dao
+        self._colors = colors
+        self._workers = workers
+        self._batch_size = batch_size
+        self._chunk_size = chunk_size
+
+    def _random_color(self):
+        if self._colors:
+            return random.choice(self._colors)
+        return "#{:06x}".format(random.randint(0, 0xFFFFFF))
+
+    def _resolve_labels(self, names, result):
+        cache = dict()
+        for vo in self._label_dao.fetch_all(self._dataset_id):
+            cache.setdefault(vo.name, vo.id)
+        new_labels = []
+        for name in sorted(set(names) - set(cache)):
+            vo = LabelVO()
+            vo.name = name
+            vo.dataset = self._dataset_id
+            vo.color = self._random_color()
+            new_labels.append(vo)
+        if new_labels:
+            for vo in self._label_dao.save_many(new_labels):
+                cache[vo.name] = vo.id
+        result.new_labels = len(new_labels)
+        return cache
+
+    def run(self, files: typing.List[str], progress_callback=None) -> ImportResult:
+        result = ImportResult()
+        result.files = len(files)
+        start = time.perf_counter()
+
+        def report(stage, processed, total):
+            if progress_callback:
+                elapsed = time.perf_counter() - start
+                progress_callback([stage, processed, total, result.parsed / elapsed if elapsed > 0 else 0.0])
+
+        boxes_by_image = dict()
+        reader = PascalVOCReader()
+        for documents in reader.read(files, self._workers, self._batch_size):
+            for document in documents:
+                if document.error is not None:
+                    result.failed += 1
+                    continue
+                result.parsed += 1
+                boxes_by_image.setdefault(document.image_name, []).extend(document.boxes)
+            report(self.PARSE, result.parsed + result.failed, result.files)
+
+        entries = self._dataset_dao.find_by_names(self._dataset_id, list(boxes_by_image.keys()))
+        result.missing_images = len(boxes_by_image) - len(entries)
+        # images without boxes are left untouched instead of having their annotations cleared
+        boxes_by_entry = [(entries[name].id, boxes) for name, boxes in boxes_by_image.items()
+                          if boxes and name in entries]
+        labels = self._resolve_labels((box[0] for _, boxes in boxes_by_entry for box in boxes), result)
+
+        saved = 0
+        for chunk in chunks(boxes_by_entry, self._chunk_size):
+            annotations = dict()
+            for entry_id, boxes in chunk:
+                entry_annotations = annotations[entry_id] = []
+                for label_name, x1, y1, x2, y2 in boxes:
+                    vo = AnnotaVO()
+                    vo.entry = entry_id
+                    vo.label = labels[label_name]
+                    vo.kind = "box"
+                    vo.geometry = [[x1, y1], [x2, y2]]
+                    entry_annotations.append(vo)
+            result.annotations += self._annot_dao.save_many(annotations, replace=False)
+            saved += len(chunk)
+            report(self.SAVE, saved, len(boxes_by_entry))
+        result.entries = len(boxes_by_entry)
+        result.elapsed = time.perf_counter() - start
+        return result
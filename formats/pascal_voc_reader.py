@@ -0,0 +1,78 @@
+import os
+import typing
+from xml.etree import ElementTree as ET
+
+from .parallel import map_batches
+
+
+class PascalVOCDocument:
+    """
+    Boxes read from one Pascal VOC file, each box is a tuple (label name, x1, y1, x2, y2)
+    """
+    __slots__ = ("xml_file", "image_name", "boxes", "error")
+
+    def __init__(self, xml_file, image_name=None, boxes=None, error=None):
+        self.xml_file = xml_file
+        self.image_name = image_name
+        self.boxes = boxes if boxes is not None else []
+        self.error = error
+
+
+def _read_batch(batch):
+    return [PascalVOCReader.read_file(xml_file) for xml_file in batch]
+
+
+class PascalVOCReader:
+    """
+    Parses Pascal VOC XML files in a thread pool.
+
+    Each file is streamed with iterparse and the objects are cleared as soon as they are
+    read, only the image name and the boxes are kept.
+    Files that can not be parsed are returned with their error instead of stopping the read.
+    """
+
+    @staticmethod
+    def _coordinate(element, tag):
+        # some tools write sub pixel coordinates
+        return int(round(float(element.findtext(tag))))
+
+    @classmethod
+    def read_file(cls, xml_file: str) -> PascalVOCDocument:
+        document = PascalVOCDocument(xml_file)
+        file_name, path = None, None
+        try:
+            for _, element in ET.iterparse(xml_file, events=("end",)):
+                if element.tag == "object":
+                    name = element.findtext("name")
+                    box = element.find("bndbox")
+                    if name and box is not None:
+                        document.boxes.append((name.strip().title(),
+                                               cls._coordinate(box, "xmin"), cls._coordinate(box, "ymin"),
+                                               cls._coordinate(box, "xmax"), cls._coordinate(box, "ymax")))
+                    element.clear()
+                elif element.tag == "filename":
+                    file_name = element.text
+                elif element.tag == "path":
+                    path = element.text
+        except (ET.ParseError, OSError, TypeError, ValueError) as ex:
+            document.error = ex
+            return document
+        # the path is what the importer always matched on, the file name is a fallback
+        # for the files written by tools that leave it out
+        image_name = path or file_name
+        if image_name:
+            # the path may come from another OS
+            document.image_name = os.path.basename(image_name.strip().replace("\\", "/"))
+        else:
+            document.error = ValueError("no image path or file name")
+        return document
+
+    def read(self, files: typing.Iterable[str], workers: int = None,
+             batch_size: int = 64) -> typing.Iterator[typing.List[PascalVOCDocument]]:
+        """
+        Yields the parsed documents in batches as they complete.
+        workers=0 parses in the calling thread, None uses one thread per CPU. Threads and not
+        processes: reading the files dominates, and spawned processes import the application again.
+        """
+        for _, documents in map_batches(_read_batch, files, batch_size, workers, threads=True):
+            yield documents
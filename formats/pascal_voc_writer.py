@@ -0,0 +1,57 @@
+import os
+import typing
+from xml.etree import ElementTree as ET
+
+from .annotation_writer import AnnotationWriter
+from .image_info import row_image_size
+
+
+class PascalVOCWriter(AnnotationWriter):
+    """
+    Pascal VOC XML files for the labeled boxes of each image, built with ElementTree.
+    Images without labeled boxes are skipped.
+    """
+    extension = ".xml"
+    threads = True
+
+    @staticmethod
+    def _sub_element(parent, tag, text=None):
+        element = ET.SubElement(parent, tag)
+        if text is not None:
+            element.text = str(text)
+        return element
+
+    def write_image(self, image_path: str, annotations: typing.List[dict]) -> bool:
+        boxes = [annot for annot in annotations
+                 if annot["annot_kind"] == "box" and annot["label_name"] not in (None, "None")
+                 and annot["annot_geometry"] is not None]
+        if len(boxes) == 0:
+            return False
+        width, height, depth = row_image_size(image_path, annotations[0])
+        sub = self._sub_element
+        root = ET.Element("annotation")
+        sub(root, "folder", os.path.split(os.path.dirname(image_path))[1])
+        sub(root, "filename", os.path.basename(image_path))
+        sub(root, "path", image_path)
+        sub(sub(root, "source"), "database", "Unknown")
+        size = sub(root, "size")
+        sub(size, "width", width)
+        sub(size, "height", height)
+        sub(size, "depth", depth)
+        sub(root, "segmented", 0)
+        for annot in boxes:
+            (x1, y1), (x2, y2) = annot["annot_geometry"][:2].astype(int).tolist()
+            obj = sub(root, "object")
+            sub(obj, "name", annot["label_name"])
+            sub(obj, "pose", "Unspecified")
+            sub(obj, "truncated", 0)
+            sub(obj, "difficult", 0)
+            bndbox = sub(obj, "bndbox")
+            sub(bndbox, "xmin", x1)
+            sub(bndbox, "ymin", y1)
+            sub(bndbox, "xmax", x2)
+            sub(bndbox, "ymax", y2)
+        if hasattr(ET, "indent"):
+            ET.indent(root)
+        ET.ElementTree(root).write(self.output_path(image_path), encoding="utf-8", xml_declaration=False)
+        return True
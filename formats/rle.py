@@ -0,0 +1,33 @@
+import typing
+
+import numpy as np
+
+
+def encode(mask: np.ndarray) -> typing.List[int]:
+    """
+    Uncompressed COCO run length encoding of a binary (height, width) mask: the lengths of
+    the alternating runs of zeros and ones in column major order, starting with zeros
+    """
+    pixels = np.asarray(mask, dtype=bool).ravel(order="F")
+    # positions where the value changes, plus both ends
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [pixels.size]))
+    counts = np.diff(bounds)
+    if pixels.size and pixels[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def rasterize(polygons: typing.List[np.ndarray], height: int, width: int) -> np.ndarray:
+    """
+    Fills the (N, 2) polygons into a uint8 mask of the image size
+    """
+    # only needed when masks are requested, the export processes do not pay for the import otherwise
+    import cv2
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.round(p).astype(np.int32).reshape(-1, 1, 2) for p in polygons], 1)
+    return mask
+
+
+def area(counts: typing.List[int]) -> int:
+    return int(sum(counts[1::2]))
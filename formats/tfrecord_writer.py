@@ -0,0 +1,226 @@
+import mmap
+import multiprocessing
+import os
+import queue
+import typing
+
+import numpy as np
+
+from . import geometry, tfrecord
+from .image_info import row_image_size
+from .parallel import chunks
+
+
+def _write_shard(writer, shard_index, batches, messages):
+    # runs in a dedicated process that owns one shard file until it receives None
+    error = None
+    try:
+        with open(writer.shard_path(shard_index), "wb") as f:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                messages.put(("progress", len(batch), writer.write_batch(f, batch)))
+    except Exception as ex:
+        error = "shard {}: {}".format(shard_index, ex)
+        # keep consuming so the producer never blocks on a full queue
+        while batches.get() is not None:
+            pass
+    messages.put(("done", shard_index, error))
+
+
+class TFRecordWriter:
+    """
+    Sharded TFRecord files of tf.train.Example records in the layout of the TensorFlow
+    Object Detection API, written without TensorFlow (see formats/tfrecord.py).
+
+    Each shard is owned by a worker process, the image groups streamed by
+    AnnotaDao.iter_by_dataset are dealt to the shards in batches through bounded queues.
+    The original encoded image bytes are memory mapped and written as they are, they
+    are never decoded or re-encoded. Boxes of every shape kind are normalized with the
+    stored image dimensions, class labels start at 1 as the label map requires.
+    Images whose file is missing or whose size is neither stored nor readable from the
+    file are skipped, export counts them in missing_images.
+    """
+    KINDS = ("box", "ellipse", "polygon")
+    FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".bmp": "bmp", ".gif": "gif"}
+
+    def __init__(self, output_folder: str, class_names: typing.List[str], shards: int = None,
+                 prefix: str = "train"):
+        self.output_folder = output_folder
+        self.class_names = list(class_names)
+        self.class_ids = {name: index + 1 for index, name in enumerate(self.class_names)}
+        self.shards = shards or os.cpu_count() or 1
+        self.prefix = prefix
+        self.missing_images = 0
+
+    def shard_path(self, shard_index: int):
+        return os.path.join(self.output_folder,
+                            "{}-{:05d}-of-{:05d}.tfrecord".format(self.prefix, shard_index, self.shards))
+
+    def _objects(self, batch):
+        """
+        Yields (image path, entry id, width, height, class names, [xmin, ymin, xmax, ymax]) per
+        image, the normalized corners are computed for the whole batch at once. Images whose
+        size can not be read are left out
+        """
+        geometries, images, sizes = [], [], []
+        for image_path, annotations in batch:
+            try:
+                width, height, _ = row_image_size(image_path, annotations[0])
+            except OSError:
+                continue
+            rows = [annot for annot in annotations
+                    if annot["annot_kind"] in self.KINDS and annot["label_name"] in self.class_ids
+                    and annot["annot_geometry"] is not None and len(annot["annot_geometry"]) >= 2]
+            images.append((image_path, annotations[0]["entry_id"], width, height, [row["label_name"] for row in rows]))
+            geometries.extend(row["annot_geometry"] for row in rows)
+            sizes.extend([(width, height)] * len(rows))
+        if geometries:
+            points, starts = geometry.concatenate(geometries)
+            boxes = geometry.bounding_boxes(points, starts)
+            sizes = np.tile(np.array(sizes, dtype=np.float64), 2)
+            corners = np.clip(np.hstack((boxes[:, :2], boxes[:, :2] + boxes[:, 2:])) / sizes, 0, 1)
+        else:
+            corners = np.zeros((0, 4))
+        first = 0
+        for image_path, entry_id, width, height, names in images:
+            image_corners = corners[first:first + len(names)]
+            first += len(names)
+            yield image_path, entry_id, width, height, names, image_corners.T.tolist()
+
+    def _features(self, image_path, entry_id, width, height, names, corners):
+        xmin, ymin, xmax, ymax = corners if len(names) else ([], [], [], [])
+        _, extension = os.path.splitext(image_path)
+        return {
+            "image/height": tfrecord.int64_feature([height]),
+            "image/width": tfrecord.int64_feature([width]),
+            "image/filename": tfrecord.bytes_feature([os.path.basename(image_path)]),
+            "image/source_id": tfrecord.bytes_feature([str(entry_id)]),
+            "image/format": tfrecord.bytes_feature([self.FORMATS.get(extension.lower(), "jpeg")]),
+            "image/object/bbox/xmin": tfrecord.float_feature(xmin),
+            "image/object/bbox/xmax": tfrecord.float_feature(xmax),
+            "image/object/bbox/ymin": tfrecord.float_feature(ymin),
+            "image/object/bbox/ymax": tfrecord.float_feature(ymax),
+            "image/object/class/text": tfrecord.bytes_feature(names),
+            "image/object/class/label": tfrecord.int64_feature([self.class_ids[name] for name in names])
+        }
+
+    def write_batch(self, f, batch: typing.Sequence[typing.Tuple[str, list]]) -> int:
+        """
+        Appends the records of a batch of image groups to an open shard, returns the number of records written
+        """
+        written = 0
+        for image_path, entry_id, width, height, names, corners in self._objects(batch):
+            features = self._features(image_path, entry_id, width, height, names, corners)
+            with open(image_path, "rb") as image, \
+                    mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ) as encoded:
+                features["image/encoded"] = tfrecord.bytes_feature([encoded])
+                tfrecord.write_record(f, tfrecord.example(features))
+            written += 1
+        return written
+
+    def _write_label_map(self):
+        with open(os.path.join(self.output_folder, "label_map.pbtxt"), "w") as f:
+            for name, class_id in self.class_ids.items():
+                f.write("item {{\n  id: {}\n  name: '{}'\n}}\n".format(class_id, name.replace("'", "\\'")))
+
+    def _valid(self, images):
+        # missing or empty files can not be embedded
+        for image_path, annotations in images:
+            if os.path.isfile(image_path) and os.path.getsize(image_path) > 0:
+                yield image_path, annotations
+            else:
+                self.missing_images += 1
+
+    def export(self, images: typing.Iterable[typing.Tuple[str, list]], workers: int = None, batch_size: int = 64,
+               progress_callback: typing.Callable[[int], None] = None) -> int:
+        """
+        Writes the shards and returns the number of records. workers=0 writes every shard
+        from the calling thread, otherwise each shard gets its own process.
+        progress_callback receives the number of images processed so far.
+        """
+        self.missing_images = 0
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._write_label_map()
+        batches = chunks(self._valid(images), batch_size)
+        processed, written = 0, 0
+        if workers == 0:
+            files = [open(self.shard_path(index), "wb") for index in range(self.shards)]
+            try:
+                for index, batch in enumerate(batches):
+                    written += self.write_batch(files[index % self.shards], batch)
+                    processed += len(batch)
+                    if progress_callback:
+                        progress_callback(processed)
+            finally:
+                for f in files:
+                    f.close()
+            # every processed image is written unless its size could not be read
+            self.missing_images += processed - written
+            return written
+
+        # spawn: forking a process that runs Qt and database threads is not safe
+        context = multiprocessing.get_context("spawn")
+        queues = [context.Queue(maxsize=2) for _ in range(self.shards)]
+        messages = context.Queue()
+        processes = [context.Process(target=_write_shard, args=(self, index, queues[index], messages), daemon=True)
+                     for index in range(self.shards)]
+        for process in processes:
+            process.start()
+        errors, done = [], 0
+
+        def handle(message):
+            nonlocal processed, written, done
+            if message[0] == "progress":
+                processed += message[1]
+                written += message[2]
+                if progress_callback:
+                    progress_callback(processed)
+            else:
+                done += 1
+                if message[2]:
+                    errors.append(message[2])
+
+        def drain():
+            while True:
+                try:
+                    handle(messages.get_nowait())
+                except queue.Empty:
+                    break
+
+        def put(index, item):
+            # a shard process killed by the OS never reads its queue again, so a plain put
+            # on the bounded queue would block forever. Returns False once the process is gone
+            while True:
+                try:
+                    queues[index].put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    drain()
+                    if not processes[index].is_alive():
+                        return False
+
+        try:
+            for index, batch in enumerate(batches):
+                shard = index % self.shards
+                if not put(shard, batch):
+                    raise RuntimeError("the writer process of shard {} exited unexpectedly with code {}".format(
+                        shard, processes[shard].exitcode))
+                drain()
+        finally:
+            for index in range(self.shards):
+                put(index, None)
+            while done < self.shards:
+                try:
+                    handle(messages.get(timeout=1))
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        errors.append("a shard writer process exited unexpectedly")
+                        break
+            for process in processes:
+                process.join()
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        self.missing_images += processed - written
+        return written
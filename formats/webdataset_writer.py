@@ -0,0 +1,175 @@
+import io
+import json
+import os
+import tarfile
+import time
+import typing
+
+from .image_info import row_image_size
+
+
+class WebDatasetWriter:
+    """
+    WebDataset style tar shards: each sample is stored as consecutive members sharing a
+    key, <key>.<image extension> with the original encoded image and <key>.json with its
+    annotations, or <key>.cls with a class index for classification samples. A shard is
+    closed once it reaches shard_size bytes, so training jobs read a few large files
+    sequentially instead of opening every image. export packs the annotated images of a
+    detection dataset, export_classification the labeled entries of a classification one.
+    index.json lists the shards with their sample counts, the class names and the task,
+    core.pytorch_shard_dataset reads it back. Images whose file is missing or whose size is
+    neither stored nor readable from the file are skipped, export counts them in missing_images.
+    """
+    KINDS = ("box", "ellipse", "polygon")
+    INDEX_FILE = "index.json"
+
+    def __init__(self, output_folder: str, class_names: typing.List[str], shard_size: int = 1 << 30,
+                 prefix: str = "shard"):
+        self.output_folder = output_folder
+        self.class_names = list(class_names)
+        self.class_ids = {name: index for index, name in enumerate(self.class_names)}
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self._shards = []
+        self._tar = None
+        self._shard_bytes = 0
+        self._shard_samples = 0
+        self._task = "detection"
+        self.missing_images = 0
+
+    @staticmethod
+    def _member_size(size):
+        # header block plus the data padded to the 512 bytes tar block size
+        return 512 + (size + 511) // 512 * 512
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            shard = self._shards[-1]
+            shard.update(samples=self._shard_samples,
+                         bytes=os.path.getsize(os.path.join(self.output_folder, shard["name"])))
+            self._tar = None
+
+    def _open_shard(self):
+        self._close_shard()
+        name = "{}-{:06d}.tar".format(self.prefix, len(self._shards))
+        self._tar = tarfile.open(os.path.join(self.output_folder, name), "w", format=tarfile.USTAR_FORMAT)
+        self._shards.append({"name": name})
+        self._shard_bytes, self._shard_samples = 0, 0
+
+    def _add_member(self, name, size, fileobj):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        info.mode = 0o444
+        self._tar.addfile(info, fileobj)
+        self._shard_bytes += self._member_size(size)
+
+    def write_sample(self, key: str, image_path: str, metadata: dict = None, class_id: int = None):
+        """
+        Appends one sample, the key must be unique and contain no dots
+        """
+        _, extension = os.path.splitext(image_path)
+        extension = extension.lower().lstrip(".") or "jpg"
+        extension = "jpg" if extension == "jpeg" else extension
+        members = []
+        if metadata is not None:
+            members.append(("json", json.dumps(metadata, separators=(",", ":")).encode("utf-8")))
+        if class_id is not None:
+            members.append(("cls", str(class_id).encode("utf-8")))
+        image_size = os.path.getsize(image_path)
+        sample_size = self._member_size(image_size) + sum(self._member_size(len(data)) for _, data in members)
+        if self._tar is None or (self._shard_samples and self._shard_bytes + sample_size > self.shard_size):
+            self._open_shard()
+        with open(image_path, "rb") as f:
+            # copied to the shard in blocks, the image is never held in memory as a whole
+            self._add_member("{}.{}".format(key, extension), image_size, f)
+        for member_extension, data in members:
+            self._add_member("{}.{}".format(key, member_extension), len(data), io.BytesIO(data))
+        self._shard_samples += 1
+
+    def _metadata(self, image_path, rows):
+        width, height, _ = row_image_size(image_path, rows[0])
+        annotations = []
+        for row in rows:
+            points = row["annot_geometry"]
+            if row["annot_kind"] not in self.KINDS or row["label_name"] not in self.class_ids or points is None:
+                continue
+            (x1, y1), (x2, y2) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+            annotations.append({
+                "label": row["label_name"],
+                "class_id": self.class_ids[row["label_name"]],
+                "kind": row["annot_kind"],
+                "bbox": [x1, y1, x2 - x1, y2 - y1],
+                "points": points.ravel().tolist()
+            })
+        return {"file_name": os.path.basename(image_path), "width": width, "height": height,
+                "annotations": annotations}
+
+    def write_index(self):
+        self._close_shard()
+        index = {
+            "format": "webdataset",
+            "task": self._task,
+            "classes": self.class_names,
+            "samples": sum(shard["samples"] for shard in self._shards),
+            "shards": self._shards
+        }
+        with open(os.path.join(self.output_folder, self.INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+
+    def export(self, images: typing.Iterable[typing.Tuple[str, list]],
+               progress_callback: typing.Callable[[int], None] = None) -> int:
+        """
+        Packs the annotated images streamed by AnnotaDao.iter_by_dataset with their
+        annotations as json and returns the number of samples written. Shards are written
+        one after the other, the output is a single sequential stream.
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._task = "detection"
+        processed, written = 0, 0
+        try:
+            for image_path, rows in images:
+                processed += 1
+                if progress_callback and processed % 100 == 0:
+                    progress_callback(processed)
+                if not os.path.isfile(image_path):
+                    continue
+                try:
+                    metadata = self._metadata(image_path, rows)
+                except OSError:
+                    continue
+                self.write_sample("{:09d}".format(rows[0]["entry_id"]), image_path, metadata)
+                written += 1
+        finally:
+            self.write_index()
+        # every image is written unless its file is missing or its size could not be read
+        self.missing_images = processed - written
+        if progress_callback:
+            progress_callback(processed)
+        return written
+
+    def export_classification(self, entries: typing.Iterable[typing.Tuple[str, str]],
+                              progress_callback: typing.Callable[[int], None] = None) -> int:
+        """
+        Packs the (image path, label name) entries returned by
+        DatasetDao.fetch_entries_for_classification with their class index as .cls and returns
+        the number of samples written. Entries whose label is not in class_names are skipped.
+        """
+        os.makedirs(self.output_folder, exist_ok=True)
+        self._task = "classification"
+        processed, written = 0, 0
+        try:
+            for image_path, label_name in entries:
+                processed += 1
+                if label_name in self.class_ids and os.path.isfile(image_path):
+                    # the position in the dataset is the key, the entries come in insertion order
+                    self.write_sample("{:09d}".format(processed), image_path, class_id=self.class_ids[label_name])
+                    written += 1
+                if progress_callback and processed % 100 == 0:
+                    progress_callback(processed)
+        finally:
+            self.write_index()
+        if progress_callback:
+            progress_callback(processed)
+        return written
@@ -0,0 +1,164 @@
+import os
+import shutil
+import typing
+
+import numpy as np
+
+from . import geometry
+from .annotation_writer import AnnotationWriter
+from .image_info import row_image_size
+
+
+class YoloWriter(AnnotationWriter):
+    """
+    YOLO txt labels, one file per image under labels/, with the class index followed by
+    the normalized box center and size, or by the normalized polygon vertices when
+    segmentation is set (YOLO-seg). Boxes and ellipses are converted to polygons in that case.
+
+    The coordinates are normalized with the image dimensions stored at ingest, so images
+    are only opened for the entries added before those were recorded. The label files are
+    small, the work is mostly file system calls, so they are written from a thread pool.
+    classes.txt, data.yaml and the images.txt list the training tools read are written by export.
+    The images are linked under images/, the training tools find the labels of an image by
+    replacing the images folder of its path with labels. Images whose size is neither stored
+    nor readable from the file are skipped, export counts them in missing_images.
+    """
+    extension = ".txt"
+    threads = True
+    KINDS = ("box", "ellipse", "polygon")
+
+    def __init__(self, output_folder: str, class_names: typing.List[str], segmentation: bool = False,
+                 ellipse_vertices: int = 32):
+        super(YoloWriter, self).__init__(output_folder)
+        self.class_names = list(class_names)
+        self.class_ids = {name: index for index, name in enumerate(self.class_names)}
+        self.segmentation = segmentation
+        self.ellipse_vertices = ellipse_vertices
+        self.labels_folder = os.path.join(output_folder, "labels")
+        self.images_folder = os.path.join(output_folder, "images")
+        self.missing_images = 0
+
+    def output_path(self, image_path: str):
+        file_name, _ = os.path.splitext(os.path.basename(image_path))
+        return os.path.join(self.labels_folder, file_name + self.extension)
+
+    def linked_path(self, image_path: str):
+        return os.path.join(self.images_folder, os.path.basename(image_path))
+
+    def _link_image(self, image_path):
+        target = self.linked_path(image_path)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.symlink(os.path.abspath(image_path), target)
+        except OSError:
+            # symbolic links need extra privileges on windows
+            try:
+                os.link(image_path, target)
+            except OSError:
+                shutil.copy2(image_path, target)
+
+    @staticmethod
+    def _format(class_ids, values):
+        return "".join("{} {}\n".format(class_id, " ".join("{:.6f}".format(v) for v in row))
+                       for class_id, row in zip(class_ids, values))
+
+    def _boxes(self, geometries, sizes):
+        points, starts = geometry.concatenate(geometries)
+        boxes = geometry.bounding_boxes(points, starts)
+        centers = boxes[:, :2] + boxes[:, 2:] / 2
+        return np.clip(np.hstack((centers, boxes[:, 2:])) / np.hstack((sizes, sizes)), 0, 1).tolist()
+
+    def _polygons(self, kinds, geometries, sizes):
+        points, starts = geometry.concatenate(geometries)
+        boxes = geometry.bounding_boxes(points, starts)
+        polygons = [None] * len(kinds)
+        for kind, shapes in (("box", geometry.box_polygons),
+                             ("ellipse", lambda b: geometry.ellipse_polygons(b, self.ellipse_vertices))):
+            indices = np.flatnonzero(kinds == kind)
+            if len(indices):
+                vertices = shapes(boxes[indices]).reshape(len(indices), -1, 2) / sizes[indices, None, :]
+                for index, polygon in zip(indices, np.clip(vertices, 0, 1).reshape(len(indices), -1).tolist()):
+                    polygons[index] = polygon
+        # every vertex divided by the size of its own image
+        counts = np.diff(np.append(starts, len(points)))
+        normalized = np.clip(points / np.repeat(sizes, counts, axis=0), 0, 1)
+        for index in np.flatnonzero(kinds == "polygon"):
+            polygons[index] = normalized[starts[index]:starts[index] + counts[index]].ravel().tolist()
+        return polygons
+
+    def _rows(self, annotations):
+        return [annot for annot in annotations
+                if annot["annot_kind"] in self.KINDS and annot["label_name"] in self.class_ids
+                and annot["annot_geometry"] is not None
+                and len(annot["annot_geometry"]) >= (3 if annot["annot_kind"] == "polygon" else 2)]
+
+    def write_image(self, image_path: str, annotations: typing.List[dict]) -> bool:
+        return self.write_batch([(image_path, annotations)]) > 0
+
+    def write_batch(self, batch: typing.Sequence[typing.Tuple[str, list]]) -> int:
+        images, rows, sizes = [], [], []
+        for image_path, annotations in batch:
+            if os.path.isfile(image_path):
+                self._link_image(image_path)
+            image_rows = self._rows(annotations)
+            if image_rows:
+                try:
+                    width, height, _ = row_image_size(image_path, annotations[0])
+                except OSError:
+                    # the file is gone and its size was never stored, the labels can not be normalized
+                    continue
+                images.append((image_path, len(image_rows)))
+                rows.extend(image_rows)
+                sizes.extend([(width, height)] * len(image_rows))
+        if not rows:
+            return 0
+        sizes = np.array(sizes, dtype=np.float64)
+        class_ids = [self.class_ids[row["label_name"]] for row in rows]
+        geometries = [row["annot_geometry"] for row in rows]
+        if self.segmentation:
+            values = self._polygons(np.array([row["annot_kind"] for row in rows]), geometries, sizes)
+        else:
+            values = self._boxes(geometries, sizes)
+        first = 0
+        for image_path, count in images:
+            with open(self.output_path(image_path), "w") as f:
+                f.write(self._format(class_ids[first:first + count], values[first:first + count]))
+            first += count
+        return len(images)
+
+    def _write_dataset_files(self, image_paths):
+        with open(os.path.join(self.output_folder, "classes.txt"), "w") as f:
+            f.writelines(name + "\n" for name in self.class_names)
+        images_list = os.path.join(self.output_folder, "images.txt")
+        with open(images_list, "w") as f:
+            f.writelines(self.linked_path(path) + "\n" for path in image_paths if os.path.isfile(path))
+        with open(os.path.join(self.output_folder, "data.yaml"), "w") as f:
+            f.write("path: {}\n".format(os.path.abspath(self.output_folder)))
+            f.write("train: images.txt\n")
+            f.write("val: images.txt\n")
+            f.write("nc: {}\n".format(len(self.class_names)))
+            f.write("names:\n")
+            f.writelines("  {}: '{}'\n".format(index, name.replace("'", "''"))
+                         for index, name in enumerate(self.class_names))
+
+    def export(self, images: typing.Iterable[typing.Tuple[str, list]], workers: int = None, batch_size: int = 64,
+               progress_callback: typing.Callable[[int], None] = None) -> int:
+        os.makedirs(self.labels_folder, exist_ok=True)
+        os.makedirs(self.images_folder, exist_ok=True)
+        image_paths = []
+        labeled = 0
+
+        def collect(groups):
+            nonlocal labeled
+            for image_path, annotations in groups:
+                image_paths.append(image_path)
+                if self._rows(annotations):
+                    labeled += 1
+                yield image_path, annotations
+
+        written = super(YoloWriter, self).export(collect(images), workers, batch_size, progress_callback)
+        # every image with labels is written unless its size could not be read
+        self.missing_images = labeled - written
+        self._write_dataset_files(image_paths)
+        return written
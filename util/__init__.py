@@ -5,3 +5,5 @@ from .misc_utilities import MiscUtilities
 from .video_utilities import VideoUtilities
 from .color_utilities import ColorUtilities, ColorFormat
 from .img_util import ImageUtilities
+from .thumbnail_cache import ThumbnailCache
+from .ingest_pipeline import IngestPipeline, IngestResult
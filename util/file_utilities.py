@@ -1,4 +1,5 @@
 import configparser
+import hashlib
 import mimetypes
 import os
 import shutil
@@ -60,6 +61,17 @@ class FileUtilities:
 
         return new_folder
 
+    @staticmethod
+    def hash_file(file_path, block_size=1024 * 1024):
+        """
+        sha1 of the file content, read in blocks
+        """
+        digest = hashlib.sha1()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
     @staticmethod
     def infer_media_type(file):
         try:
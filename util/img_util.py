@@ -1,9 +1,81 @@
 import kornia
 import inspect
 import cv2
+import imutils
 import numpy as np
+from PIL import Image
 
 class ImageUtilities:
+    REDUCED_COLOR_FLAGS = [
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2)
+    ]
+
+    MODE_CHANNELS = {"1": 1, "L": 1, "P": 1, "I": 1, "F": 1, "I;16": 1, "LA": 2, "RGB": 3, "YCbCr": 3, "LAB": 3,
+                     "HSV": 3, "RGBA": 4, "CMYK": 4}
+
+    @classmethod
+    def probe(cls, file_path):
+        """
+        Reads (height, width, channels) from the image header without decoding the pixels.
+        The EXIF orientation is taken into account, so height and width match cv2.imread.
+        """
+        with Image.open(file_path) as img:
+            w, h = img.size
+            channels = cls.MODE_CHANNELS.get(img.mode, 3)
+            try:
+                orientation = img.getexif().get(0x0112, 1)
+            except Exception:
+                orientation = 1
+        if orientation in (5, 6, 7, 8):
+            w, h = h, w
+        return h, w, channels
+
+    @classmethod
+    def image_size(cls, file_path):
+        """
+        Reads the (height, width) of an image from its header without decoding the pixels.
+        """
+        h, w, _ = cls.probe(file_path)
+        return h, w
+
+    @classmethod
+    def imread_reduced(cls, file_path, target_size):
+        """
+        Decodes an image at the smallest DCT scale (1/2, 1/4 or 1/8) whose longest side is
+        still at least target_size pixels. JPEG files are never decoded at full resolution
+        when a reduced scale is enough. Returns a tuple (image, height, width) with the
+        dimensions of the original image, image is None if the file can not be decoded.
+        """
+        try:
+            h, w = cls.image_size(file_path)
+        except Exception:
+            image = cv2.imread(file_path)
+            if image is None:
+                return None, 0, 0
+            h, w = image.shape[:2]
+            return image, h, w
+        flag = cv2.IMREAD_COLOR
+        for factor, reduced_flag in cls.REDUCED_COLOR_FLAGS:
+            if max(h, w) // factor >= target_size:
+                flag = reduced_flag
+                break
+        return cv2.imread(file_path, flag), h, w
+
+    @staticmethod
+    def resize_to_fit(image: np.ndarray, size):
+        """
+        Resizes the image so its longest side is equal to size, preserving the aspect ratio.
+        Images that already fit are returned untouched.
+        """
+        h, w = image.shape[:2]
+        if max(h, w) <= size:
+            return image
+        if w > h:
+            return imutils.resize(image, width=size, inter=cv2.INTER_AREA)
+        return imutils.resize(image, height=size, inter=cv2.INTER_AREA)
+
     @staticmethod
     def color_functions(backend="kornia"):
         if backend == "kornia":
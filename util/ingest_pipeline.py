@@ -0,0 +1,150 @@
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class IngestResult:
+    def __init__(self):
+        self.discovered = 0
+        self.processed = 0
+        self.added = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.cancelled = False
+
+    def to_list(self):
+        return [self.processed, self.discovered, self.added, self.duplicates, self.failed]
+
+
+class IngestPipeline:
+    """
+    Adds files and folders to a dataset in stages:
+
+    1. discovery: the dropped paths are walked with os.scandir, folders recursively, and
+       the files are streamed to the next stage as they are found
+    2. metadata: a thread pool stats, probes and hashes the files (DatasetDao.read_file_metadata)
+    3. deduplication: files whose path or content hash is already in the dataset, or was
+       seen earlier in the same run, are rejected
+    4. insertion: the remaining entries are inserted in batches
+
+    The pipeline can be cancelled from any thread, entries inserted before the
+    cancellation are kept.
+    """
+
+    def __init__(self, dataset_dao, dataset_id, media_type="image", workers=8, batch_size=500):
+        self._dao = dataset_dao
+        self._dataset_id = dataset_id
+        self._media_type = media_type
+        self._workers = workers
+        self._batch_size = batch_size
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def _accept(self, file_path):
+        mime_type, _ = mimetypes.guess_type(file_path)
+        return mime_type is not None and mime_type.startswith(self._media_type)
+
+    def discover(self, paths):
+        """
+        Yields the files to ingest, walking folders without building the full listing
+        """
+        stack = []
+        for path in paths:
+            if os.path.isdir(path):
+                stack.append(path)
+            elif os.path.isfile(path) and self._accept(path):
+                yield os.path.abspath(path)
+        while stack and not self.cancelled:
+            folder = stack.pop()
+            try:
+                with os.scandir(folder) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and self._accept(entry.name):
+                            yield os.path.abspath(entry.path)
+            except OSError:
+                continue
+
+    def _read(self, file_path):
+        if self.cancelled:
+            return file_path, None
+        try:
+            return file_path, self._dao.read_file_metadata(file_path)
+        except OSError:
+            return file_path, None
+
+    def _flush(self, batch, seen_hashes, result):
+        paths = [file_path for file_path, _ in batch]
+        hashes = [metadata["file_hash"] for _, metadata in batch]
+        existing_paths = self._dao.fetch_existing_paths(self._dataset_id, paths)
+        existing_hashes = self._dao.fetch_existing_hashes(self._dataset_id, hashes)
+        rows = []
+        for file_path, metadata in batch:
+            file_hash = metadata["file_hash"]
+            if file_path in existing_paths or file_hash in existing_hashes or file_hash in seen_hashes:
+                result.duplicates += 1
+                continue
+            seen_hashes.add(file_hash)
+            row = dict(metadata)
+            row["file_path"] = file_path
+            row["dataset"] = self._dataset_id
+            rows.append(row)
+        if rows:
+            self._dao.insert_entries(rows)
+            result.added += len(rows)
+
+    def run(self, paths, progress_callback=None) -> IngestResult:
+        """
+        Ingests the paths, progress_callback receives IngestResult.to_list() every hundred files
+        """
+        result = IngestResult()
+        seen_hashes = set()
+        batch = []
+        reported = [0]
+
+        def report():
+            reported[0] = result.processed
+            if progress_callback:
+                progress_callback(result.to_list())
+
+        def collect(futures):
+            for future in futures:
+                file_path, metadata = future.result()
+                result.processed += 1
+                if metadata is None:
+                    if not self.cancelled:
+                        result.failed += 1
+                else:
+                    batch.append((file_path, metadata))
+            if len(batch) >= self._batch_size:
+                self._flush(batch, seen_hashes, result)
+                batch.clear()
+                report()
+            elif result.processed - reported[0] >= 100:
+                report()
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            in_flight = set()
+            for file_path in self.discover(paths):
+                if self.cancelled:
+                    break
+                result.discovered += 1
+                if len(in_flight) >= self._workers * 4:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight.add(executor.submit(self._read, file_path))
+            done, _ = wait(in_flight)
+            collect(done)
+        if batch and not self.cancelled:
+            self._flush(batch, seen_hashes, result)
+        result.cancelled = self.cancelled
+        report()
+        return result
@@ -0,0 +1,167 @@
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from .file_utilities import FileUtilities
+from .img_util import ImageUtilities
+
+
+class ThumbnailCache:
+    """
+    Two level thumbnail store used by the gallery.
+
+    Thumbnails are kept in a size bounded in-memory LRU and persisted on disk under
+    the user data folder. Entries are keyed by the file path, its modification time
+    and its size, so a file that changes on disk gets a new thumbnail automatically.
+    Each file on disk holds the original image height and width followed by the
+    encoded thumbnail bytes.
+    """
+    _HEADER = struct.Struct("<II")
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, folder=None, thumbnail_size=150, max_memory_bytes=64 * 1024 * 1024, encoding=".jpg",
+                 quality=85):
+        if folder is None:
+            folder = os.path.join(FileUtilities.get_usr_folder(), "thumbnails")
+        os.makedirs(folder, exist_ok=True)
+        self._folder = folder
+        self._thumbnail_size = thumbnail_size
+        self._max_memory_bytes = max_memory_bytes
+        self._encoding = encoding
+        self._quality = quality
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @property
+    def folder(self):
+        return self._folder
+
+    @property
+    def thumbnail_size(self):
+        return self._thumbnail_size
+
+    def key(self, file_path):
+        stat = os.stat(file_path)
+        raw = "{}|{}|{}|{}".format(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, self._thumbnail_size)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self._folder, key[:2], key + ".thumb")
+
+    def get(self, file_path):
+        """
+        Returns a tuple (thumbnail, height, width) where thumbnail is an RGB array and
+        height/width are the dimensions of the original image, or None when the
+        thumbnail has not been generated yet.
+        """
+        key = self.key(file_path)
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            self._memory_put(key, entry)
+        return entry
+
+    def get_or_create(self, file_path):
+        """
+        Returns the cached thumbnail of the image, decoding and storing it on a miss.
+        Returns None if the file can not be decoded.
+        """
+        key = self.key(file_path)
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+        entry = self._disk_get(key)
+        if entry is None:
+            entry = self._create(file_path)
+            if entry is None:
+                return None
+            self._disk_put(key, entry)
+        self._memory_put(key, entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+        FileUtilities.clear_folder(self._folder)
+
+    def _create(self, file_path):
+        image, h, w = ImageUtilities.imread_reduced(file_path, self._thumbnail_size)
+        if image is None:
+            return None
+        thumbnail = ImageUtilities.resize_to_fit(image, self._thumbnail_size)
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)
+        return thumbnail, h, w
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, entry):
+        nbytes = entry[0].nbytes
+        if nbytes > self._max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = entry
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self._max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted[0].nbytes
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) <= self._HEADER.size:
+            return None
+        h, w = self._HEADER.unpack_from(data)
+        buffer = np.frombuffer(data, dtype=np.uint8, offset=self._HEADER.size)
+        thumbnail = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if thumbnail is None:
+            return None
+        thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)
+        return thumbnail, h, w
+
+    def _disk_put(self, key, entry):
+        thumbnail, h, w = entry
+        params = []
+        if self._encoding == ".jpg":
+            params = [cv2.IMWRITE_JPEG_QUALITY, self._quality]
+        elif self._encoding == ".webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, self._quality]
+        success, encoded = cv2.imencode(self._encoding, cv2.cvtColor(thumbnail, cv2.COLOR_RGB2BGR), params)
+        if not success:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so a concurrent reader never sees a partial thumbnail
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            f.write(self._HEADER.pack(h, w))
+            f.write(encoded.tobytes())
+        os.replace(tmp_path, path)
@@ -5,7 +5,7 @@ from PyQt5.QtCore import QObject,pyqtSignal,pyqtSlot,QSize
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QWidget,QPushButton,QLabel,QApplication
 from abc  import abstractmethod
-from util import GUIUtilities
+from util import GUIUtilities,ImageUtilities
 from ..image_button import ImageButton
 from .gallery_action import GalleryAction
 from .label_hovered import LabelHovered
@@ -216,6 +216,8 @@ class ImageCard(GalleryCard):
         self._image_widget.setPixmap(pixmap)
 
 class   VideoCard(GalleryCard):
+    THUMBNAIL_SIZE=150
+
     def __init__(self, parent=None):
         super(VideoCard, self).__init__(parent)
         self._duration = None
@@ -237,9 +239,9 @@ class   VideoCard(GalleryCard):
     @source.setter
     def source(self,value):
         self._video_source=value
-        qimage=GUIUtilities.array_to_qimage(self._video_source)
+        thumbnail=ImageUtilities.resize_to_fit(self._video_source,self.THUMBNAIL_SIZE)
+        qimage=GUIUtilities.array_to_qimage(thumbnail,copy=True)
         pixmap = QPixmap.fromImage(qimage)
-        pixmap=pixmap.scaledToHeight(120,mode=QtCore.Qt.SmoothTransformation)
         # pixmap=pixmap.scaled(QSize(150,150),aspectRatioMode=QtCore.Qt.KeepAspectRatio,transformMode=QtCore.Qt.SmoothTransformation)
         # image_widget.setScaledContents(True)
         self._video_widget.setPixmap(pixmap)
@@ -1,26 +1,27 @@
+import math
 import mimetypes
 import os
 from enum import Enum,auto
 
-import cv2
 import dask
-import imutils
-import numpy as np
 from PyQt5 import QtGui,QtCore
 from PyQt5.QtCore import QObject,QSize,pyqtSignal,QThreadPool
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QWidget,QGridLayout,QLabel,QLayoutItem,QVBoxLayout
 from hurry.filesize import size,alternative
-from util import GUIUtilities,MiscUtilities,Worker
+from dao import DatasetDao
+from util import GUIUtilities,Worker,ThumbnailCache
 from view.widgets.image_button import ImageButton
 from view.widgets.loading_dialog import QLoadingDialog
 from .base_gallery import Ui_Gallery
 from .card import GalleryCard,ImageCard
+from .gallery_view import GalleryListView
 
 
 class GalleryViewMode(Enum):
     GRID_MODE=auto()
     LIST_MODE=auto()
+    VIRTUAL_MODE=auto()
 
 
 class GalleryLayout(QGridLayout,QObject):
@@ -110,7 +111,8 @@ class GalleryLayout(QGridLayout,QObject):
 
 
 class Gallery(QWidget,Ui_Gallery,QObject):
-    doubleClicked=pyqtSignal(GalleryCard,QWidget)
+    # the GalleryCard in grid mode, the DatasetEntryVO in virtual mode
+    doubleClicked=pyqtSignal(object,QWidget)
     filesDropped=pyqtSignal(list)
     cardActionClicked=pyqtSignal(str,object)
 
@@ -120,16 +122,20 @@ class Gallery(QWidget,Ui_Gallery,QObject):
         self.setup_toolbar()
         self.setup_paginator()
         self._items: []=[]
-        self._pages=[]
+        self._total_items=0
         self._page_size=50
         self._curr_page=0
+        self._page_request=(None,False,None)
+        self._ds_dao=DatasetDao()
         self._thread_pool=QThreadPool()
+        self._thumbnail_cache=ThumbnailCache.default()
         self.setAcceptDrops(True)
         self.center_widget=None
         self.center_layout=None
         self._content_type="Images"
         self._tag=None
         self._actions=[]
+        self._view_mode=GalleryViewMode.GRID_MODE
         self._loading_dialog=QLoadingDialog(parent=self)
 
     def setup_toolbar(self):
@@ -141,6 +147,11 @@ class Gallery(QWidget,Ui_Gallery,QObject):
         self.btn_uncheck_all.setFixedWidth(40)
         self.btn_check_all.clicked.connect(self.btn_check_all_on_click_slot)
         self.btn_uncheck_all.clicked.connect(self.btn_uncheck_all_on_click_slot)
+        view_mode_icon=GUIUtilities.get_icon("data.png")
+        self.btn_view_mode=ImageButton(icon=view_mode_icon,size=QSize(20,20))
+        self.btn_view_mode.setFixedWidth(40)
+        self.btn_view_mode.setToolTip("Switch between paged and continuous scrolling")
+        self.btn_view_mode.clicked.connect(self.btn_view_mode_on_click_slot)
 
     @property
     def actions(self):
@@ -151,6 +162,14 @@ class Gallery(QWidget,Ui_Gallery,QObject):
         self._actions=value
 
 
+    @property
+    def view_mode(self):
+        return self._view_mode
+
+    @view_mode.setter
+    def view_mode(self,value):
+        self._view_mode=value
+
     @property
     def content_type(self):
         return self._content_type
@@ -162,14 +181,17 @@ class Gallery(QWidget,Ui_Gallery,QObject):
     def enable_paginator(self,val):
         self.btn_check_all.setEnabled(val)
         self.btn_uncheck_all.setEnabled(val)
-        self.btn_next_page.setEnabled(val)
-        self.btn_prev_page.setEnabled(val)
-        self.btn_last_page.setEnabled(val)
-        self.btn_first_page.setEnabled(val)
+        self.btn_view_mode.setEnabled(val)
+        paged=val and self._view_mode != GalleryViewMode.VIRTUAL_MODE
+        self.btn_next_page.setEnabled(paged)
+        self.btn_prev_page.setEnabled(paged)
+        self.btn_last_page.setEnabled(paged)
+        self.btn_first_page.setEnabled(paged)
 
     def setup_paginator(self):
         self.grid_actions_layout.addWidget(self.btn_check_all)
         self.grid_actions_layout.addWidget(self.btn_uncheck_all)
+        self.grid_actions_layout.addWidget(self.btn_view_mode)
         self.btn_next_page.clicked.connect(self.btn_next_page_on_click)
         self.btn_prev_page.clicked.connect(self.btn_prev_page_on_click)
         self.btn_last_page.clicked.connect(self.btn_last_page_on_click)
@@ -200,6 +222,17 @@ class Gallery(QWidget,Ui_Gallery,QObject):
     def items(self,value):
         self._items=value
 
+    @property
+    def total_items(self):
+        return self._total_items
+
+    @total_items.setter
+    def total_items(self,value):
+        self._total_items=value
+        if self._curr_page >= self.total_pages:
+            self._curr_page=0
+            self._page_request=(None,False,None)
+
     @property
     def page_size(self):
         return self._page_size
@@ -207,49 +240,64 @@ class Gallery(QWidget,Ui_Gallery,QObject):
     @page_size.setter
     def page_size(self,value):
         self._page_size=value
+        self._curr_page=0
+        self._page_request=(None,False,None)
         self.update_pager()
 
     @property
     def current_page(self):
         return self._curr_page+1
 
-    @current_page.setter
-    def current_page(self,val):
-        self._curr_page=val
-        self._curr_page=self._curr_page%self.total_pages
-        self.lbl_current_page.setText(str(self.current_page))
-        self.bind()
-
     @property
     def total_pages(self):
-        return len(self._pages)
+        return math.ceil(self._total_items/self._page_size)
+
+    def go_to_page(self,page,cursor=None,backward=False,limit=None):
+        """
+        Moves to the given page using keyset pagination: the page is fetched relative to the
+        id of the first/last entry of the current page, so no OFFSET scan is ever needed.
+        """
+        self._curr_page=page
+        self._page_request=(cursor,backward,limit)
+        self.bind()
+
+    def fetch_page(self):
+        cursor,backward,limit=self._page_request
+        limit=limit if limit else self._page_size
+        if backward:
+            return self._ds_dao.fetch_entries_page_before(self.tag,cursor,limit)
+        return self._ds_dao.fetch_entries_page(self.tag,cursor,limit)
 
     def update_pager(self):
-        self._pages=list(MiscUtilities.chunk(self._items,self._page_size))
-        self.lbl_total_pages.setText("{}".format(len(self._pages)))
+        self.lbl_total_pages.setText("{}".format(self.total_pages))
         self.lbl_current_page.setText(str(self.current_page))
 
     def btn_next_page_on_click(self):
-        if len(self._pages) == 0:
+        if self.total_pages == 0:
             return
-        self._curr_page+=1
-        self.current_page=self._curr_page
+        if self._curr_page+1 >= self.total_pages or not self._items:
+            self.btn_first_page_on_click()
+        else:
+            self.go_to_page(self._curr_page+1,cursor=self._items[-1].id)
 
     def btn_last_page_on_click(self):
-        if len(self._pages) == 0:
+        if self.total_pages == 0:
             return
-        self.current_page=len(self._pages)-1
+        last_page=self.total_pages-1
+        self.go_to_page(last_page,backward=True,limit=self._total_items-last_page*self._page_size)
 
     def btn_first_page_on_click(self):
-        if len(self._pages) == 0:
+        if self.total_pages == 0:
             return
-        self.current_page=0
+        self.go_to_page(0)
 
     def btn_prev_page_on_click(self):
-        if len(self._pages) == 0:
+        if self.total_pages == 0:
             return
-        self._curr_page-=1
-        self.current_page=self._curr_page
+        if self._curr_page == 0 or not self._items:
+            self.btn_last_page_on_click()
+        else:
+            self.go_to_page(self._curr_page-1,cursor=self._items[0].id,backward=True)
 
     def dragEnterEvent(self,event: QtGui.QDragEnterEvent) -> None:
         data=event.mimeData()
@@ -272,8 +320,13 @@ class Gallery(QWidget,Ui_Gallery,QObject):
         valid_files=[]
         files=[u.toLocalFile() for u in event.mimeData().urls()]
         for f in files:
-            if os.path.isfile(f):
+            if os.path.isdir(f):
+                # folders are walked recursively by the ingest pipeline
+                valid_files.append(f)
+            elif os.path.isfile(f):
                 mime_type,encoding=mimetypes.guess_type(f)  # magic.from_file(f,mime=True)
+                if mime_type is None:
+                    continue
                 if mime_type.find("video") != -1 and self.content_type == "Videos":
                     valid_files.append(f)
                 elif mime_type.find("image") != -1 and self.content_type == "Images":
@@ -284,33 +337,31 @@ class Gallery(QWidget,Ui_Gallery,QObject):
     def load_images(self):
 
         def do_work():
-            page=self._curr_page
-            items=self._pages[page]
+            items=self.fetch_page()
 
             def create_thumbnail(item):
                 file_path=item.file_path
                 if os.path.isfile(file_path):
-                    image=cv2.imread(file_path)
-                    h,w,_=np.shape(image)
-                    if w > h:
-                        thumbnail_array=imutils.resize(image,width=150)
-                    else:
-                        thumbnail_array=imutils.resize(image,height=150)
-                    thumbnail_array=cv2.cvtColor(thumbnail_array,cv2.COLOR_BGR2RGB)
-                    thumbnail=GUIUtilities.array_to_qimage(thumbnail_array)
-                    thumbnail=QPixmap.fromImage(thumbnail)
-                    del thumbnail_array
-                    del image
-                    return item,h,w,thumbnail,os.path.getsize(file_path), False
+                    cached=self._thumbnail_cache.get_or_create(file_path)
+                    if cached:
+                        thumbnail_array,h,w=cached
+                        thumbnail=GUIUtilities.array_to_qimage(thumbnail_array)
+                        thumbnail=QPixmap.fromImage(thumbnail)
+                        if item.width and item.height:
+                            h,w=item.height,item.width
+                        file_size=item.file_size if item.file_size else os.path.getsize(file_path)
+                        return item,h,w,thumbnail,file_size,False
                 thumbnail = GUIUtilities.get_image("placeholder.png")
                 thumbnail = thumbnail.scaledToHeight(100)
                 h, w = thumbnail.height(), thumbnail.width()
                 return item, h, w, thumbnail, 0, True
             delayed_tasks=[dask.delayed(create_thumbnail)(item) for item in items]
             images=dask.compute(*delayed_tasks)
-            return images
+            return items,images
 
-        def done_work(images):
+        def done_work(result):
+            items,images=result
+            self._items=items
             for img in images:
                 if img:
                     item,h,w,thumbnail,file_size, is_broken=img
@@ -339,9 +390,22 @@ class Gallery(QWidget,Ui_Gallery,QObject):
         self.enable_paginator(False)
         self._loading_dialog.show()
 
+    def bind_virtual_view(self):
+        self.center_widget=GalleryListView()
+        self.center_widget.actions=self.actions
+        self.center_widget.itemActionClicked.connect(lambda name,item: self.cardActionClicked.emit(name,item))
+        self.center_widget.itemDoubleClicked.connect(lambda item: self.doubleClicked.emit(item,self))
+        self.center_widget.data_source=lambda after_id,limit: self._ds_dao.fetch_entries_page(self.tag,after_id,limit)
+        self.center_widget.total_items=self._total_items
+        self.center_layout=None
+        self.scrollArea.setWidget(self.center_widget)
+        self.enable_paginator(True)
+
     def bind(self):
         self.update_pager()
-        if len(self._pages) > 0:
+        if self._total_items > 0 and self._view_mode == GalleryViewMode.VIRTUAL_MODE:
+            self.bind_virtual_view()
+        elif self._total_items > 0:
             self.center_widget=QWidget()
             self.center_layout=GalleryLayout()
             self.center_widget.setLayout(self.center_layout)
@@ -363,9 +427,21 @@ class Gallery(QWidget,Ui_Gallery,QObject):
     def gallery_card_double_click(self,card: GalleryCard):
         self.doubleClicked.emit(card,self)
 
+    def btn_view_mode_on_click_slot(self):
+        if self._view_mode == GalleryViewMode.VIRTUAL_MODE:
+            self._view_mode=GalleryViewMode.GRID_MODE
+        else:
+            self._view_mode=GalleryViewMode.VIRTUAL_MODE
+        self._curr_page=0
+        self._page_request=(None,False,None)
+        self.bind()
+
     def btn_check_all_on_click_slot(self):
         if self.items is None:
             return
+        if isinstance(self.center_widget,GalleryListView):
+            self.center_widget.selectAll()
+            return
         layout=self.scrollArea.widget().layout()
         for i in reversed(range(layout.count())):
             child=layout.itemAt(i)
@@ -373,9 +449,25 @@ class Gallery(QWidget,Ui_Gallery,QObject):
             if isinstance(child.widget(),GalleryCard):
                 widget.is_selected=True
 
+    def selected_items(self):
+        if isinstance(self.center_widget,GalleryListView):
+            return self.center_widget.selected_items()
+        if self.center_layout is None:
+            return []
+        layout=self.scrollArea.widget().layout()
+        items=[]
+        for i in range(layout.count()):
+            widget=layout.itemAt(i).widget()
+            if isinstance(widget,GalleryCard) and widget.is_selected:
+                items.append(widget.tag)
+        return items
+
     def btn_uncheck_all_on_click_slot(self):
         if self.items is None:
             return
+        if isinstance(self.center_widget,GalleryListView):
+            self.center_widget.clearSelection()
+            return
         layout=self.scrollArea.widget().layout()
         for i in reversed(range(layout.count())):
             child=layout.itemAt(i)
@@ -0,0 +1,267 @@
+import os
+from collections import OrderedDict
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import QAbstractListModel,QModelIndex,QSize,QRect,QThreadPool,QObject,pyqtSignal
+from PyQt5.QtGui import QPixmap,QPainter,QContextMenuEvent,QPalette
+from PyQt5.QtWidgets import QListView,QStyledItemDelegate,QStyleOptionViewItem,QStyle,QAbstractItemView,QMenu
+from hurry.filesize import size,alternative
+
+from util import GUIUtilities,Worker,ThumbnailCache
+
+
+class GalleryListModel(QAbstractListModel):
+    """
+    List model backing the virtualized gallery. Rows are fetched from the data source in
+    keyset paginated batches as the view scrolls (fetchMore) and thumbnails are decoded
+    lazily, only for the rows the delegate actually paints.
+    """
+    EntryRole=QtCore.Qt.UserRole+1
+    ThumbnailSizeRole=QtCore.Qt.UserRole+2
+
+    def __init__(self,parent=None):
+        super(GalleryListModel,self).__init__(parent)
+        self._items=[]
+        self._total_items=0
+        self._data_source=None
+        self._batch_size=200
+        self._thumbnails=OrderedDict()
+        self._max_thumbnails=1000
+        self._pending=set()
+        self._thread_pool=QThreadPool()
+        self._thumbnail_cache=ThumbnailCache.default()
+        self._placeholder=GUIUtilities.get_image("placeholder.png").scaledToHeight(100)
+
+    @property
+    def items(self):
+        return self._items
+
+    @property
+    def data_source(self):
+        return self._data_source
+
+    @data_source.setter
+    def data_source(self,value):
+        """
+        Callable (after_id, limit) -> list of entries, used to fetch the rows on demand
+        """
+        self._data_source=value
+
+    @property
+    def total_items(self):
+        return self._total_items
+
+    @total_items.setter
+    def total_items(self,value):
+        self.beginResetModel()
+        self._items=[]
+        self._total_items=value
+        self._thumbnails.clear()
+        self._pending.clear()
+        self.endResetModel()
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self,value):
+        self._batch_size=value
+
+    def rowCount(self,parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._items)
+
+    def canFetchMore(self,parent=QModelIndex()):
+        if parent.isValid() or self._data_source is None:
+            return False
+        return len(self._items) < self._total_items
+
+    def fetchMore(self,parent=QModelIndex()):
+        if parent.isValid() or self._data_source is None:
+            return
+        after_id=self._items[-1].id if self._items else None
+        batch=self._data_source(after_id,self._batch_size)
+        if not batch:
+            # the dataset shrank since it was counted
+            self._total_items=len(self._items)
+            return
+        first=len(self._items)
+        self.beginInsertRows(QModelIndex(),first,first+len(batch)-1)
+        self._items.extend(batch)
+        self.endInsertRows()
+
+    def data(self,index: QModelIndex,role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or not (0 <= index.row() < len(self._items)):
+            return None
+        item=self._items[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return os.path.basename(item.file_path)
+        elif role == QtCore.Qt.ToolTipRole:
+            return item.file_path
+        elif role == QtCore.Qt.DecorationRole:
+            thumbnail=self._thumbnail(index.row(),item)
+            return thumbnail[0] if thumbnail else self._placeholder
+        elif role == self.ThumbnailSizeRole:
+            if item.width and item.height:
+                # stored at ingest, no need to wait for the thumbnail
+                return item.height,item.width,item.file_size or 0
+            thumbnail=self._thumbnail(index.row(),item)
+            return thumbnail[1:] if thumbnail else None
+        elif role == self.EntryRole:
+            return item
+        return None
+
+    def _thumbnail(self,row,item):
+        key=item.file_path
+        if key in self._thumbnails:
+            self._thumbnails.move_to_end(key)
+            return self._thumbnails[key]
+        self._request_thumbnail(row,item)
+        return None
+
+    def _request_thumbnail(self,row,item):
+        key=item.file_path
+        if key in self._pending:
+            return
+        self._pending.add(key)
+
+        def do_work():
+            if not os.path.isfile(key):
+                return None
+            thumbnail=self._thumbnail_cache.get_or_create(key)
+            if thumbnail is None:
+                return None
+            return thumbnail,item.file_size if item.file_size else os.path.getsize(key)
+
+        def done_work(result):
+            self._pending.discard(key)
+            if result is None:
+                self._store_thumbnail(key,(self._placeholder,0,0,0))
+            else:
+                (array,h,w),file_size=result
+                pixmap=QPixmap.fromImage(GUIUtilities.array_to_qimage(array,copy=True))
+                self._store_thumbnail(key,(pixmap,h,w,file_size))
+            if row < len(self._items) and self._items[row].file_path == key:
+                index=self.index(row)
+                self.dataChanged.emit(index,index,[QtCore.Qt.DecorationRole])
+
+        worker=Worker(do_work)
+        worker.signals.result.connect(done_work)
+        self._thread_pool.start(worker)
+
+    def _store_thumbnail(self,key,value):
+        self._thumbnails[key]=value
+        while len(self._thumbnails) > self._max_thumbnails:
+            self._thumbnails.popitem(last=False)
+
+
+class GalleryItemDelegate(QStyledItemDelegate):
+    def __init__(self,parent=None):
+        super(GalleryItemDelegate,self).__init__(parent)
+        self._cell_size=QSize(170,210)
+        self._thumbnail_size=150
+
+    def sizeHint(self,option: QStyleOptionViewItem,index: QModelIndex) -> QSize:
+        return self._cell_size
+
+    def paint(self,painter: QPainter,option: QStyleOptionViewItem,index: QModelIndex) -> None:
+        painter.save()
+        rect: QRect=option.rect.adjusted(4,4,-4,-4)
+        palette=option.palette
+        if option.state & QStyle.State_Selected:
+            painter.setBrush(palette.color(QPalette.Highlight))
+        else:
+            painter.setBrush(palette.color(QPalette.AlternateBase))
+        painter.setPen(QtCore.Qt.NoPen)
+        painter.setRenderHint(QPainter.Antialiasing,True)
+        painter.drawRoundedRect(rect,8,8)
+
+        pixmap: QPixmap=index.data(QtCore.Qt.DecorationRole)
+        image_rect=QRect(rect.x(),rect.y()+5,rect.width(),self._thumbnail_size)
+        if pixmap and not pixmap.isNull():
+            target=QSize(pixmap.width(),pixmap.height())
+            target.scale(image_rect.width()-10,image_rect.height(),QtCore.Qt.KeepAspectRatio)
+            x=image_rect.x()+(image_rect.width()-target.width())//2
+            y=image_rect.y()+(image_rect.height()-target.height())//2
+            painter.drawPixmap(QRect(x,y,target.width(),target.height()),pixmap)
+
+        text=index.data(QtCore.Qt.DisplayRole)
+        thumbnail_size=index.data(GalleryListModel.ThumbnailSizeRole)
+        if thumbnail_size:
+            h,w,file_size=thumbnail_size
+            image_size_str=size(file_size,system=alternative) if file_size > 0 else "0 MB"
+            text="{}\n({}px / {}px) {}".format(text,w,h,image_size_str)
+        painter.setPen(palette.color(QPalette.Text))
+        text_rect=QRect(rect.x()+4,image_rect.bottom()+2,rect.width()-8,rect.bottom()-image_rect.bottom()-2)
+        painter.drawText(text_rect,QtCore.Qt.AlignHCenter | QtCore.Qt.AlignTop | QtCore.Qt.TextWrapAnywhere,text)
+        painter.restore()
+
+
+class GalleryListView(QListView,QObject):
+    itemActionClicked=pyqtSignal(str,object)
+    itemDoubleClicked=pyqtSignal(object)
+
+    def __init__(self,parent=None):
+        super(GalleryListView,self).__init__(parent)
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setLayoutMode(QListView.Batched)
+        self.setBatchSize(100)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setCursor(QtCore.Qt.PointingHandCursor)
+        self.setItemDelegate(GalleryItemDelegate(self))
+        self.setModel(GalleryListModel(self))
+        self.doubleClicked.connect(self._double_clicked_slot)
+        self._actions=[]
+
+    @property
+    def actions(self):
+        return self._actions
+
+    @actions.setter
+    def actions(self,value):
+        self._actions=value
+
+    @property
+    def items(self):
+        return self.model().items
+
+    @property
+    def data_source(self):
+        return self.model().data_source
+
+    @data_source.setter
+    def data_source(self,value):
+        self.model().data_source=value
+
+    @property
+    def total_items(self):
+        return self.model().total_items
+
+    @total_items.setter
+    def total_items(self,value):
+        self.model().total_items=value
+
+    def selected_items(self):
+        return [index.data(GalleryListModel.EntryRole) for index in self.selectedIndexes()]
+
+    def _double_clicked_slot(self,index: QModelIndex):
+        if index.isValid():
+            self.itemDoubleClicked.emit(index.data(GalleryListModel.EntryRole))
+
+    def contextMenuEvent(self,evt: QContextMenuEvent) -> None:
+        index: QModelIndex=self.indexAt(evt.pos())
+        if not index.isValid() or not self._actions:
+            return
+        menu=QMenu()
+        for action in self._actions:
+            menu_action=menu.addAction(action.icon,action.tooltip if action.tooltip else action.name)
+            menu_action.setData(action.name)
+        selected=menu.exec_(self.mapToGlobal(evt.pos()))
+        if selected:
+            self.itemActionClicked.emit(selected.data(),index.data(GalleryListModel.EntryRole))
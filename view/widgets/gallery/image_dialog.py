@@ -1,7 +1,10 @@
+import cv2
 from PyQt5 import QtCore
 from PyQt5.QtGui import QMouseEvent,QPainter,QWheelEvent,QPixmap
 from PyQt5.QtWidgets import QVBoxLayout,QFrame,QDialog,QWidget,QGraphicsView,QGraphicsScene,QGraphicsPixmapItem
 
+from util import GUIUtilities,ImageUtilities
+
 
 class ImageDialogViewer(QGraphicsView):
     def __init__(self, parent=None):
@@ -43,6 +46,8 @@ class ImageDialogViewer(QGraphicsView):
 
 
 class ImageDialog(QDialog):
+    PREVIEW_SIZE=1024
+
     def __init__(self,image_path,  parent=None):
         super(ImageDialog,self).__init__(parent)
         position=self.cursor().pos()
@@ -68,10 +73,17 @@ class ImageDialog(QDialog):
                             | QtCore.Qt.FramelessWindowHint
                             | QtCore.Qt.X11BypassWindowManagerHint)
         self.qgraphics_view = ImageDialogViewer()
-        self.qgraphics_view.pixmap = QPixmap(image_path)
+        self.qgraphics_view.pixmap = self.load_preview(image_path)
         self.widget.layout().addWidget(self.qgraphics_view)
         self.layout().addWidget(self.widget)
 
+    def load_preview(self,image_path):
+        image,_,_=ImageUtilities.imread_reduced(image_path,self.PREVIEW_SIZE)
+        if image is None:
+            return QPixmap(image_path)
+        image=cv2.cvtColor(image,cv2.COLOR_BGR2RGB)
+        return QPixmap.fromImage(GUIUtilities.array_to_qimage(image,copy=True))
+
     def setMouseTracking(self, flag):
         def set_mouse_tracking(parent):
             for child in parent.findChildren(QtCore.QObject):
@@ -1,6 +1,7 @@
 import math
 import os
 from collections import OrderedDict
+from concurrent.futures import Future,CancelledError
 
 import cv2
 import dask
@@ -11,15 +12,15 @@ import torch
 
 from PIL import Image
 from PyQt5 import QtCore,QtGui
-from PyQt5.QtCore import QSize,QThreadPool,QPointF,QPoint,QRectF,QItemSelection,QModelIndex
+from PyQt5.QtCore import QSize,QThreadPool,QPointF,QPoint,QRectF,QItemSelection,QModelIndex,pyqtSignal
 from PyQt5.QtGui import QPixmap,QCursor,QWheelEvent
 from PyQt5.QtWidgets import QWidget,QGraphicsItem,QAbstractItemView,QDialog,QAction, \
     QLabel,QGraphicsScene,QMenu,QGraphicsDropShadowEffect,QFrame,QListWidgetItem,QBoxLayout,QVBoxLayout,QFormLayout, \
     QSpinBox
 
 from constants import COCO_INSTANCE_CATEGORY_NAMES
-from core import HubClientFactory,Framework
-from dao import DatasetDao,AnnotaDao
+from core import HubClientFactory,Framework,InferenceClient
+from dao import DatasetDao,AnnotaDao,AnnotaWriter
 from dao.hub_dao import HubDao
 from dao.label_dao import LabelDao
 from decor import gui_exception,work_exception
@@ -37,7 +38,6 @@ from vo import LabelVO,DatasetEntryVO,AnnotaVO,HubVO
 from .base_image_viewer import Ui_Image_Viewer_Widget
 from .items import EditableBox,EditablePolygon,EditableItem,EditableEllipse
 from ..image_button import ImageButton
-import more_itertools
 import json
 
 
@@ -53,6 +53,9 @@ class SeparatorWidget(QFrame):
         ''')
 
 class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
+    annotations_written=pyqtSignal(int,object,object,object)
+    pending_writes_changed=pyqtSignal(int)
+
     def __init__(self,parent=None):
         super(ImageViewerWidget,self).__init__(parent)
         self.setupUi(self)
@@ -82,6 +85,11 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
         self._class_label.setGraphicsEffect(shadow)
         self.center_layout.addWidget(self._class_label,0,0,QtCore.Qt.AlignTop | QtCore.Qt.AlignLeft)
 
+        self._pending_writes_label=QLabel()
+        self._pending_writes_label.setVisible(False)
+        self._pending_writes_label.setMargin(5)
+        self.center_layout.addWidget(self._pending_writes_label,0,0,QtCore.Qt.AlignBottom | QtCore.Qt.AlignRight)
+
         self.actions_layout.setAlignment(QtCore.Qt.AlignTop | QtCore.Qt.AlignHCenter)
         self.actions_layout.setContentsMargins(0,5,0,0)
         self.images_list_widget.setSelectionMode(QAbstractItemView.ExtendedSelection )
@@ -144,9 +152,23 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
         self._hub_dao=HubDao()
         self._labels_dao=LabelDao()
         self._ann_dao=AnnotaDao()
+        self._writer=AnnotaWriter.default()
+        self.annotations_written.connect(self._annotations_written_slot)
+        self.pending_writes_changed.connect(self._pending_writes_changed_slot)
+        pending_listener=self.pending_writes_changed.emit
+        self._writer.add_listener(pending_listener)
+        writer=self._writer
+        self.destroyed.connect(lambda: writer.remove_listener(pending_listener))
         self._thread_pool=QThreadPool()
         self._loading_dialog=QLoadingDialog()
+        self._loading_dialog.rejected.connect(self.cancel_inference)
         self._tag=None
+        # prediction running in the inference server, Escape cancels it
+        self._inference_future=None
+        # ids of the persisted annotations of the current image, used to detect deletions
+        self._annotation_ids=set()
+        # keys of the new items queued for insertion whose ids are not known yet
+        self._submitted_keys=set()
         self._curr_channel=0
         self._channels=[]
         self._toolbox = []
@@ -221,7 +243,7 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
                     if err:
                         raise err
                     GUIUtilities.show_info_message("Annotations saved successfully","Information")
-                self.save_annotations(done_work)
+                self.save_annotations(done_work,wait_for_write=True)
             elif action_tag == "clean":
                 self.image_viewer.remove_annotations()
 
@@ -292,6 +314,9 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
                 else:
                     self.images_list_widget.setCurrentRow(last_index)
             self.save_annotations(done_work)
+        elif event.key() == QtCore.Qt.Key_Escape:
+            self.cancel_inference()
+            self._loading_dialog.hide()
         elif event.key() == QtCore.Qt.Key_D:
             @gui_exception
             def done_work(result):
@@ -424,7 +449,7 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
             current_node=action.data()  # model name
             parent_node=current_node.parent  # repo
             repo,model=parent_node.get_data(0),current_node.get_data(0)
-            self.predict_annotations_using_pytorch_vision_model(repo, model)
+            self.predict_annotations_using_pytorch_thub_model(repo, model)
 
     def image_list_context_menu(self,pos: QPoint):
         menu=QMenu()
@@ -470,8 +495,12 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
         return self._ann_dao.fetch_all(self.tag.id)
 
     def load_image(self):
+        entry_id=self.tag.id
+
         @work_exception
         def do_work():
+            # read our own writes: the entry may still have changes in the write-behind queue
+            self._writer.wait(entry_id)
             return dask.compute(*[
                 self.load_image_label(),
                 self.load_image_annotations()
@@ -495,8 +524,7 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
                     for entry in annotations:
                         try:
                             vo: AnnotaVO=entry
-                            points=map(float,vo.points.split(","))
-                            points=list(more_itertools.chunked(points,2))
+                            points=vo.geometry
                             if vo.kind == "box" or vo.kind == "ellipse":
                                 x=points[0][0]-offset.x()
                                 y=points[0][1]-offset.y()
@@ -510,171 +538,129 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
                                 item.setRect(roi)
                                 item.label=vo.label
                                 self.image_viewer.scene().addItem(item)
+                                item.mark_clean(vo.id,item.state(offset))
+                                self._annotation_ids.add(vo.id)
                             elif vo.kind == "polygon":
                                 item=EditablePolygon()
                                 item.label=vo.label
                                 self.image_viewer.scene().addItem(item)
-                                for p in points:
-                                    item.addPoint(QPoint(p[0]-offset.x(),p[1]-offset.y()))
+                                for x,y in (points-(offset.x(),offset.y())).tolist():
+                                    item.addPoint(QPoint(x,y))
+                                item.mark_clean(vo.id,item.state(offset))
+                                self._annotation_ids.add(vo.id)
                         except Exception as ex:
                             GUIUtilities.show_error_message("Error loading the annotations: {}".format(ex),"Error")
 
         self.image_viewer.remove_annotations()
+        self._annotation_ids=set()
+        self._submitted_keys=set()
         worker=Worker(do_work)
         worker.signals.result.connect(done_work)
         self._thread_pool.start(worker)
 
     @gui_exception
-    def save_annotations(self, done_work_callback):
+    def save_annotations(self, done_work_callback, wait_for_write=False):
+        """
+        Queues the changed annotations of the current image in the write-behind writer.
+        done_work_callback is invoked right away, or once the changes are committed
+        when wait_for_write is set.
+        """
         scene: QGraphicsScene=self.image_viewer.scene()
-        annotations=[]
+        image_rect: QRectF=self.image_viewer.pixmap.sceneBoundingRect()
+        image_offset=QPointF(image_rect.width()/2,image_rect.height()/2)
+        entry_id=self.tag.id
+        inserted,updated=OrderedDict(),[]
+        current_ids,current_keys=set(),set()
         for item in scene.items():
-            image_rect: QRectF=self.image_viewer.pixmap.sceneBoundingRect()
-            image_offset=QPointF(image_rect.width()/2,image_rect.height()/2)
             if isinstance(item,EditableItem):
+                if item.is_new:
+                    current_keys.add(item.key)
+                else:
+                    current_ids.add(item.annotation_id)
+                state=item.state(image_offset)
+                if not item.is_dirty(state):
+                    continue
                 a=AnnotaVO()
+                a.id=item.annotation_id
                 a.label=item.label.id if item.label else None
-                a.entry=self.tag.id
+                a.entry=entry_id
                 a.kind=item.shape_type
-                a.points=item.coordinates(image_offset)
-                annotations.append(a)
-        @work_exception
-        def do_work():
-            self._ann_dao.save(self.tag.id,annotations)
-            return None, None
-        worker = Worker(do_work)
-        worker.signals.result.connect(done_work_callback)
-        self._thread_pool.start(worker)
+                a.points=state[2]
+                if item.is_new:
+                    inserted[item.key]=a
+                else:
+                    updated.append(a)
+                # the queued state is what the database will hold once the writer commits
+                item.mark_clean(item.annotation_id,state)
+        deleted=list(self._annotation_ids-current_ids)
+        dropped=list(self._submitted_keys-current_keys)
+        if not inserted and not updated and not deleted and not dropped:
+            # nothing changed since the image was loaded or last saved
+            done_work_callback((None,None))
+            return
+        self._annotation_ids.difference_update(deleted)
+        self._submitted_keys.difference_update(dropped)
+        self._submitted_keys.update(inserted.keys())
+        request=(deleted,done_work_callback if wait_for_write else None)
+
+        def written(written_entry_id,ids,error):
+            # runs on the writer thread, the signal delivers it to the GUI thread
+            self.annotations_written.emit(written_entry_id,ids,error,request)
+
+        self._writer.submit(entry_id,inserted,updated,deleted,dropped,callback=written)
+        if not wait_for_write:
+            done_work_callback((None,None))
 
-    @staticmethod
-    def invoke_tf_hub_model(image_path, repo,model_name):
-        from PIL import Image
-        from torchvision import transforms
-        import torch
-        import inspect
-        gpu_id=0
-        device=torch.device("cuda:"+str(gpu_id) if torch.cuda.is_available() else "cpu")
-        model=torch.hub.load(repo,model_name,pretrained=True)
-        model.eval()
-        input_image=Image.open(image_path)
-        preprocess=transforms.Compose([
-            transforms.Resize(480),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485,0.456,0.406],std=[0.229,0.224,0.225]),
-        ])
-        input_tensor=preprocess(input_image)
-        input_batch=input_tensor.unsqueeze(0)  # create a mini-batch as expected by the model
-        # # move the param and model to GPU for speed if available
-        if torch.cuda.is_available():
-            input_batch=input_batch.to(device)
-            model.to(device)
-        with torch.no_grad():
-            output=model(input_batch)
-        if isinstance(output, OrderedDict):
-            output = output["out"][0]
-            predictions_tensor =output.argmax(0)
-            # move predictions to the cpu and convert into a numpy array
-            predictions_arr: np.ndarray=predictions_tensor.byte().cpu().numpy()
-            classes_ids = np.unique(predictions_arr).tolist()
-            classes_idx = list(filter(lambda x: x != 0, classes_ids)) ## ignore
-            predictions_arr=Image.fromarray(predictions_arr).resize(input_image.size)
-            predictions_arr=np.asarray(predictions_arr)
-            # 0 value
-            predicted_mask={c: [] for c in classes_idx}
-
-            for idx in classes_idx:
-                class_mask=np.zeros(predictions_arr.shape,dtype=np.uint8)
-                class_mask[np.where(predictions_arr == idx)]=255
-                contour_list=cv2.findContours(class_mask.copy(),cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE)
-                contour_list=imutils.grab_contours(contour_list)
-                for contour in contour_list:
-                    points=np.vstack(contour).squeeze().tolist()
-                    predicted_mask[idx].append(points)
-                return "mask", predicted_mask
-        else:
-            class_map=json.load(open("./data/imagenet_class_index.json"))
-            max, argmax = output.data.squeeze().max(0)
-            class_id = argmax.item()
-            predicted_label = class_map[str(class_id)]
-            return  "label",predicted_label
-
-        return None
-
-    @staticmethod
-    def invoke_dextr_pascal_model(image_path,  points):
-        import torch
-        from collections import OrderedDict
-        from PIL import Image
-        import numpy as np
-        from torch.nn.functional import upsample
-        from contrib.dextr import deeplab_resnet  as resnet
-        from contrib.dextr import helpers
-        modelName='dextr_pascal-sbd'
-        pad=50
-        thres=0.8
-        gpu_id=0
-        device=torch.device("cuda:"+str(gpu_id) if torch.cuda.is_available() else "cpu")
-        #  Create the network and load the weights
-        model = resnet.resnet101(1,nInputChannels=4,classifier='psp')
-        model_path=os.path.abspath("./models/{}.pth".format(modelName))
-        state_dict_checkpoint=torch.load(model_path,map_location=lambda storage,loc: storage)
-        if 'module.' in list(state_dict_checkpoint.keys())[0]:
-            new_state_dict=OrderedDict()
-            # remove `module.` from multi-gpu training
-            for k,v in state_dict_checkpoint.items():
-                name=k[7:]
-                new_state_dict[name]=v
-        else:
-            new_state_dict=state_dict_checkpoint
-        model.load_state_dict(new_state_dict)
-        model.eval()
-        model.to(device)
-        #  Read image and click the points
-        image=np.array(Image.open(image_path))
-        extreme_points_ori=np.asarray(points).astype(np.int)
-        with torch.no_grad():
-            #  Crop image to the bounding box from the extreme points and resize
-            bbox=helpers.get_bbox(image,points=extreme_points_ori,pad=pad,zero_pad=True)
-            crop_image=helpers.crop_from_bbox(image,bbox,zero_pad=True)
-            resize_image=helpers.fixed_resize(crop_image,(512,512)).astype(np.float32)
-
-            #  Generate extreme point heat map normalized to image values
-            extreme_points=extreme_points_ori-[np.min(extreme_points_ori[:,0]),np.min(extreme_points_ori[:,1])]+[pad,
-                                                                                                                 pad]
-            extreme_points=(512*extreme_points*[1/crop_image.shape[1],1/crop_image.shape[0]]).astype(np.int)
-            extreme_heatmap=helpers.make_gt(resize_image,extreme_points,sigma=10)
-            extreme_heatmap=helpers.cstm_normalize(extreme_heatmap,255)
-
-            #  Concatenate inputs and convert to tensor
-            input_dextr=np.concatenate((resize_image,extreme_heatmap[:,:,np.newaxis]),axis=2)
-            inputs=torch.from_numpy(input_dextr.transpose((2,0,1))[np.newaxis,...])
-
-            # Run a forward pass
-            inputs=inputs.to(device)
-            outputs=model.forward(inputs)
-            outputs=upsample(outputs,size=(512,512),mode='bilinear',align_corners=True)
-            outputs=outputs.to(torch.device('cpu'))
-
-            pred=np.transpose(outputs.data.numpy()[0,...],(1,2,0))
-            pred=1/(1+np.exp(-pred))
-            pred=np.squeeze(pred)
-            result=helpers.crop2fullmask(pred,bbox,im_size=image.shape[:2],zero_pad=True,relax=pad) > thres
-            binary=np.zeros_like(result,dtype=np.uint8)
-            binary[result]=255
-            contour_list=cv2.findContours(binary.copy(),cv2.RETR_LIST,cv2.CHAIN_APPROX_SIMPLE)
-            contour_list=imutils.grab_contours(contour_list)
-            contours=[]
-            for contour in contour_list:
-                c_points=np.vstack(contour).squeeze().tolist()
-                contours.append(c_points)
-        return contours
+    @gui_exception
+    def _annotations_written_slot(self,entry_id,ids,error,request):
+        deleted,done_work_callback=request
+        if self.tag and self.tag.id == entry_id:
+            items=[item for item in self.image_viewer.scene().items() if isinstance(item,EditableItem)]
+            if error:
+                # flag everything as changed so the next save sends it again
+                self._annotation_ids.update(deleted)
+                for item in items:
+                    item.mark_clean(item.annotation_id,None)
+            else:
+                for item in items:
+                    if item.is_new and item.key in ids:
+                        item.annotation_id=ids[item.key]
+                self._annotation_ids.update(ids.values())
+                self._submitted_keys.difference_update(ids.keys())
+        if done_work_callback:
+            done_work_callback((None,error))
+        elif error:
+            raise error
+
+    def _pending_writes_changed_slot(self,pending):
+        self._pending_writes_label.setText("Saving {} image(s)...".format(pending))
+        self._pending_writes_label.setVisible(pending > 0)
+
+    def _run_inference(self, future: Future):
+        """
+        Waits for a prediction of the inference server, returns None if it was cancelled
+        """
+        self._inference_future=future
+        try:
+            return future.result()
+        except CancelledError:
+            return None
+        finally:
+            self._inference_future=None
+
+    def cancel_inference(self):
+        future=self._inference_future
+        if future:
+            future.cancel()
 
     @gui_exception
     def predict_annotations_using_pytorch_thub_model(self, repo, model_name):
+        image_path=self.tag.file_path
+
         @work_exception
         def do_work():
-            pred_result = self.invoke_tf_hub_model(self.tag.file_path,  repo,model_name)
-            return pred_result, None
+            image=cv2.cvtColor(cv2.imread(image_path,cv2.IMREAD_COLOR),cv2.COLOR_BGR2RGB)
+            return self._run_inference(InferenceClient.default().predict_hub_model(image,repo,model_name)),None
 
         @gui_exception
         def done_work(result):
@@ -710,11 +696,13 @@ class ImageViewerWidget(QWidget,Ui_Image_Viewer_Widget):
 
     @gui_exception
     def predict_annotations_using_extr_points(self, points):
-        pass
+        image_path=self.tag.file_path
+
         @work_exception
         def do_work():
-            contours=self.invoke_dextr_pascal_model( self.tag.file_path,points)
-            return contours,None
+            image=cv2.cvtColor(cv2.imread(image_path,cv2.IMREAD_COLOR),cv2.COLOR_BGR2RGB)
+            result=self._run_inference(InferenceClient.default().predict_dextr(image,points))
+            return (result[1] if result else None),None
 
         @gui_exception
         def done_work(result):
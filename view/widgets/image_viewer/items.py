@@ -1,4 +1,5 @@
 import abc
+import itertools
 import math
 
 from PyQt5 import QtGui,QtWidgets,QtCore
@@ -20,6 +21,8 @@ class EditableItemSignals(QObject):
 
 
 class EditableItem(QAbstractGraphicsShapeItem):
+    _keys=itertools.count()
+
     def __init__(self, *args, **kwargs):
         super(EditableItem, self).__init__(*args, **kwargs)
         self.setZValue(10)
@@ -34,6 +37,10 @@ class EditableItem(QAbstractGraphicsShapeItem):
         self._label = LabelVO()
         self._tag=None
         self._shape_type = None
+        self._annotation_id = None
+        self._saved_state = None
+        # identifies the item while its annotation id is not known yet
+        self._key = next(EditableItem._keys)
 
         app=QApplication.instance()
         color=app.palette().color(QPalette.Highlight)
@@ -87,6 +94,36 @@ class EditableItem(QAbstractGraphicsShapeItem):
     def tag(self, value):
         self._tag = value
 
+    @property
+    def annotation_id(self):
+        return self._annotation_id
+
+    @annotation_id.setter
+    def annotation_id(self, value):
+        self._annotation_id = value
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def is_new(self):
+        return self._annotation_id is None
+
+    def state(self,offset=QPointF(0,0)):
+        """
+        Snapshot of what gets persisted for this item: (label id, shape type, coordinates)
+        """
+        label_id=self._label.id if self._label else None
+        return label_id,self._shape_type,self.coordinates(offset)
+
+    def mark_clean(self,annotation_id,state):
+        self._annotation_id=annotation_id
+        self._saved_state=state
+
+    def is_dirty(self,state):
+        return state != self._saved_state
+
     @property
     def label(self):
         return self._label
@@ -1,25 +1,19 @@
-import itertools
-import json
 import os
-import random
-from xml.etree import ElementTree
 
-import cv2
-import dask
 from PyQt5 import QtCore
 from PyQt5.QtCore import QThreadPool,QSize,QObject,pyqtSignal
 from PyQt5.QtGui import QCursor
-from PyQt5.QtWidgets import QScrollArea,QWidget,QMessageBox,QDialog,QTabWidget,QFileDialog,QMenu
+from PyQt5.QtWidgets import QScrollArea,QWidget,QMessageBox,QDialog,QTabWidget,QFileDialog,QMenu,QProgressDialog
 from hurry.filesize import size,alternative
-from mako.template import Template
-import xml.etree.ElementTree as ET
 
 from dao import AnnotaDao,LabelDao
 from dao.dataset_dao import DatasetDao
 from decor import gui_exception,work_exception
+from formats import CocoWriter,JsonWriter,PascalVOCWriter,PascalVOCImporter,TFRecordWriter,WebDatasetWriter,\
+    YoloWriter
 from util import GUIUtilities,Worker,FileUtilities,ColorUtilities,ColorFormat
 from view.forms import DatasetForm
-from vo import DatasetVO,AnnotaVO,LabelVO
+from vo import DatasetVO
 from .image_button import ImageButton
 from .loading_dialog import QLoadingDialog
 from .response_grid import GridCard
@@ -102,8 +96,19 @@ class DatasetGridWidget(QWidget,QObject):
 class DatasetTabWidget(QScrollArea):
     JSON="JSON"
     PASCAL_VOC="Pascal VOC"
+    COCO="COCO"
+    COCO_RLE="COCO (RLE masks)"
     TENSORFLOW_OBJECT_DETECTION="TensorFlow Object Detection"
     YOLO="YOLO"
+    YOLO_SEGMENTATION="YOLO (segmentation)"
+    WEBDATASET="WebDataset (tar shards)"
+    WEBDATASET_CLASSIFICATION="WebDataset (classification)"
+    # export pool size, None uses one worker per CPU. The file per image writers and the
+    # Pascal VOC reader run in threads, a spawned process imports the whole application
+    # again (benchmarks/bench_parallel_io.py). The TFRecord shard writers are processes
+    EXPORT_WORKERS=None
+    PARALLEL_EXPORT_THRESHOLD=500
+    PARALLEL_IMPORT_THRESHOLD=200
 
     def __init__(self,parent=None):
         super(DatasetTabWidget,self).__init__(parent)
@@ -193,118 +198,19 @@ class DatasetTabWidget(QScrollArea):
         index=tab_widget_manager.addTab(tab_widget,vo.name)
         tab_widget_manager.setCurrentIndex(index)
 
-    def annotations2json(self,images,selected_folder):
-        def export_template(img_path,img_annotations):
-            str_template='''
-            {
-              "path": "${path}",
-              "regions": [
-                % for i, region in enumerate(annotations):
-                    {
-                        "kind": "${region["annot_kind"]}",
-                        "points": "${region["annot_points"]}",
-                        "label": "${region["label_name"]}",
-                        "color": "${region["label_color"]}"
-                    } 
-                    % if i < len(annotations) - 1:
-                    ,
-                    % endif
-                % endfor
-              ]
-            }
-            '''
-            json_str=Template(str_template).render(path=img_path,annotations=list(img_annotations))
-            filename=os.path.split(img_path)[1]
-            file_name,_=os.path.splitext(filename)
-            output_file=os.path.join(selected_folder,"{}.json".format(file_name))
-            with open(output_file,'w') as f:
-                json.dump(json.loads(json_str),f,indent=3)
-
-        delayed_tasks=[]
-        for img_path,img_annotations in images:
-            delayed_tasks.append(dask.delayed(export_template)(img_path,img_annotations))
-        dask.compute(*delayed_tasks)
-
-    def annotations2pascal(self,images,selected_folder):
-        def export_template(img_path,img_annotations):
-            str_template='''
-            <annotation>
-                <folder>${folder}</folder>
-                <filename>${filename}</filename>
-                <path>${path}</path>
-                <source>
-                    <database>Unknown</database>
-                </source>
-                <size>
-                    <width>${width}</width>
-                    <height>${height}</height>
-                    <depth>${depth}</depth>
-                </size>
-                <segmented>0</segmented>
-                % for i, region in enumerate(annotations):
-                    <object>
-                        <name>${region["name"]}</name>
-                        <pose>Unspecified</pose>
-                        <truncated>0</truncated>
-                        <difficult>0</difficult>
-                        <bndbox>
-                            <xmin>${region["xmin"]}</xmin>
-                            <ymin>${region["ymin"]}</ymin>
-                            <xmax>${region["xmax"]}</xmax>
-                            <ymax>${region["ymax"]}</ymax>
-                        </bndbox>
-                    </object>
-                % endfor
-            </annotation>
-            '''
-            filename=os.path.split(img_path)[1]
-            folder=os.path.split(os.path.dirname(img_path))[1]
-            h,w,c=cv2.imread(img_path).shape
-
-            xml_str=Template(str_template).render(
-                path=img_path,
-                folder=folder,
-                filename=filename,
-                width=w,
-                height=h,
-                depth=c,
-                annotations=img_annotations)
-
-            file_name,_=os.path.splitext(filename)
-            output_file=os.path.join(selected_folder,"{}.xml".format(file_name))
-            with open(output_file,'w') as f:
-                f.write(xml_str)
-
-        delayed_tasks=[]
-        for img_path,img_annotations in images:
-            boxes=[]
-            for annot in img_annotations:
-                if annot["label_name"] is None or annot["label_name"] == "None":
-                    continue
-                if annot["annot_kind"] == "box":
-                    points=list(map(int,annot["annot_points"].split(",")))
-                    box=dict()
-                    box["name"]=annot["label_name"]
-                    box["xmin"]=points[0]
-                    box["ymin"]=points[1]
-                    box["xmax"]=points[2]
-                    box["ymax"]=points[3]
-                    boxes.append(box)
-            if len(boxes) > 0:
-                delayed_tasks.append(dask.delayed(export_template)(img_path,boxes))
-        dask.compute(*delayed_tasks)
-
-    def annotations2Yolo(self,images,selected_folder):
-        pass
-
     @gui_exception
     def download_annot_action_slot(self,vo: DatasetVO):
         menu=QMenu()
         menu.setCursor(QtCore.Qt.PointingHandCursor)
         menu.addAction(self.JSON)
         menu.addAction(self.PASCAL_VOC)
-        # menu.addAction(self.TENSORFLOW_OBJECT_DETECTION)
-        # menu.addAction(self.YOLO)
+        menu.addAction(self.COCO)
+        menu.addAction(self.COCO_RLE)
+        menu.addAction(self.YOLO)
+        menu.addAction(self.YOLO_SEGMENTATION)
+        menu.addAction(self.TENSORFLOW_OBJECT_DETECTION)
+        menu.addAction(self.WEBDATASET)
+        menu.addAction(self.WEBDATASET_CLASSIFICATION)
         action=menu.exec_(QCursor.pos())
         if action:
 
@@ -312,25 +218,70 @@ class DatasetTabWidget(QScrollArea):
             if selected_folder:
                 action_text=action.text()
 
+                if action_text == self.JSON:
+                    writer=JsonWriter(selected_folder)
+                elif action_text == self.PASCAL_VOC:
+                    writer=PascalVOCWriter(selected_folder)
+                elif action_text in (self.COCO,self.COCO_RLE):
+                    writer=CocoWriter(os.path.join(selected_folder,"annotations.json"),
+                                      masks=action_text == self.COCO_RLE)
+                elif action_text in (self.YOLO,self.YOLO_SEGMENTATION):
+                    labels=sorted(self._labels_dao.fetch_all(vo.id),key=lambda label: label.id)
+                    writer=YoloWriter(selected_folder,list(dict.fromkeys(label.name for label in labels)),
+                                      segmentation=action_text == self.YOLO_SEGMENTATION)
+                elif action_text == self.TENSORFLOW_OBJECT_DETECTION:
+                    labels=sorted(self._labels_dao.fetch_all(vo.id),key=lambda label: label.id)
+                    writer=TFRecordWriter(selected_folder,list(dict.fromkeys(label.name for label in labels)))
+                elif action_text == self.WEBDATASET:
+                    labels=sorted(self._labels_dao.fetch_all(vo.id),key=lambda label: label.id)
+                    writer=WebDatasetWriter(selected_folder,list(dict.fromkeys(label.name for label in labels)))
+                elif action_text == self.WEBDATASET_CLASSIFICATION:
+                    # sorted names, the class indexes match the ones of PytorchCVDataset
+                    writer=WebDatasetWriter(selected_folder,sorted({label.name for label in self._labels_dao.fetch_all(vo.id)}))
+                else:
+                    return
+                progress_dialog=QProgressDialog("Exporting annotations...",None,0,100,self)
+                progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+                progress_dialog.setMinimumDuration(500)
+
                 @work_exception
-                def do_work():
-                    results=self._annot_dao.fetch_all_by_dataset(vo.id)
-                    return results,None
+                def do_work(progress_callback):
+                    if action_text == self.WEBDATASET_CLASSIFICATION:
+                        # the labels of the images, not their annotations
+                        entries=self._ds_dao.fetch_entries_for_classification(vo.id)
+                        writer.export_classification(entries,
+                                                     progress_callback=lambda processed: progress_callback.emit(
+                                                         [processed,len(entries)]))
+                        return 0,None
+                    total=self._annot_dao.count_annotated_entries(vo.id)
+                    images=self._annot_dao.iter_by_dataset(vo.id)
+                    progress=lambda processed: progress_callback.emit([processed,total])
+                    if isinstance(writer,(CocoWriter,WebDatasetWriter)):
+                        # written sequentially from the cursor
+                        writer.export(images,progress_callback=progress)
+                        return writer.missing_images if isinstance(writer,WebDatasetWriter) else 0,None
+                    # starting the process pool only pays off on larger datasets
+                    workers=self.EXPORT_WORKERS if total >= self.PARALLEL_EXPORT_THRESHOLD else 0
+                    writer.export(images,workers=workers,progress_callback=progress)
+                    return writer.missing_images if isinstance(writer,(YoloWriter,TFRecordWriter)) else 0,None
+
+                def progress_work(progress):
+                    processed,total=progress
+                    progress_dialog.setValue(int(processed*100/total) if total else 100)
 
                 @gui_exception
                 def done_work(result):
-                    data,error=result
+                    progress_dialog.close()
+                    missing_images,error=result
                     if error:
                         raise error
-                    images=itertools.groupby(data,lambda x: x["image"])
-                    if action_text == self.JSON:
-                        self.annotations2json(images,selected_folder)
-                    elif action_text == self.PASCAL_VOC:
-                        self.annotations2pascal(images,selected_folder)
-
-                    GUIUtilities.show_info_message("Annotations exported successfully","Done")
+                    message="Annotations exported successfully"
+                    if missing_images:
+                        message+="\n{} images were skipped, their files could not be read".format(missing_images)
+                    GUIUtilities.show_info_message(message,"Done")
 
-                worker=Worker(do_work)
+                worker=Worker(do_work,progress_callback=None)
+                worker.signals.progress.connect(progress_work)
                 worker.signals.result.connect(done_work)
                 self.thread_pool.start(worker)
 
@@ -343,57 +294,45 @@ class DatasetTabWidget(QScrollArea):
         if action:
             action_text=action.text()
             if action_text == self.PASCAL_VOC:
-                colors = ColorUtilities.rainbow_gradient(1000)["hex"]
                 files=GUIUtilities.select_files(".xml","Select the annotations files")
                 if len(files) > 0:
+                    importer=PascalVOCImporter(dataset_vo.id,self._ds_dao,self._labels_dao,self._annot_dao,
+                                               colors=ColorUtilities.rainbow_gradient(1000)["hex"],
+                                               workers=None if len(files) >= self.PARALLEL_IMPORT_THRESHOLD else 0)
+                    progress_dialog=QProgressDialog("Reading the annotation files...",None,0,100,self)
+                    progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+                    progress_dialog.setMinimumDuration(500)
+
                     @work_exception
-                    def do_work():
-                        annotations = []
-                        for xml_file in files:
-                            tree=ET.parse(xml_file)
-                            root=tree.getroot()
-                            objects=root.findall('object')
-                            image_path=root.find('path').text
-                            image_vo=self._ds_dao.find_by_path(dataset_vo.id,image_path)
-                            if image_vo:
-                                for roi in objects:
-                                    label_name = roi.find('name').text
-                                    label_name = label_name.title()
-                                    label_vo = self._labels_dao.find_by_name(dataset_vo.id,label_name)
-                                    if label_vo is None:
-                                        label_vo = LabelVO()
-                                        label_vo.name = label_name
-                                        label_vo.dataset = dataset_vo.id
-                                        label_vo.color = colors[random.randint(0, len(colors))]
-                                        label_vo = self._labels_dao.save(label_vo)
-                                    box = roi.find("bndbox")
-                                    if box:
-                                        x1 = int(box.find('xmin').text)
-                                        y1 = int(box.find('ymin').text)
-                                        x2 = int(box.find('xmax').text)
-                                        y2 = int(box.find('ymax').text)
-                                        box=AnnotaVO()
-                                        box.label= label_vo.id
-                                        box.entry=image_vo.id
-                                        box.kind="box"
-                                        box.points=",".join(map(str,[x1,y1,x2,y2]))
-                                        annotations.append(box)
-                        if len(annotations) > 0:
-                            print(annotations)
-                            self._annot_dao.save(dataset_vo.id, annotations)
-                        return annotations, None
+                    def do_work(progress_callback):
+                        return importer.run(files,progress_callback=progress_callback.emit),None
+
+                    def progress_work(progress):
+                        stage,processed,total,files_per_second=progress
+                        if stage == PascalVOCImporter.PARSE:
+                            progress_dialog.setLabelText(
+                                "Reading the annotation files... ({:.0f} files/s)".format(files_per_second))
+                        else:
+                            progress_dialog.setLabelText("Saving the annotations...")
+                        progress_dialog.setValue(int(processed*100/total) if total else 100)
 
                     @gui_exception
-                    def done_work(result):
-                        data,error=result
+                    def done_work(args):
+                        progress_dialog.close()
+                        result,error=args
                         if error:
                             raise error
-                        if len(data) > 0:
-                            GUIUtilities.show_info_message("Annotations imported successfully",
-                                                           "Import annotations status")
+                        if result.annotations > 0:
+                            GUIUtilities.show_info_message(
+                                "{} annotations imported for {} images in {:.1f}s ({:.0f} files/s)\n"
+                                "{} new labels, {} images not found in the dataset, {} files could not be read"
+                                .format(result.annotations,result.entries,result.elapsed,result.files_per_second,
+                                        result.new_labels,result.missing_images,result.failed),
+                                "Import annotations status")
                         else:
                             GUIUtilities.show_info_message("No annotations found", "Import annotations status")
 
-                    worker=Worker(do_work)
+                    worker=Worker(do_work,progress_callback=None)
+                    worker.signals.progress.connect(progress_work)
                     worker.signals.result.connect(done_work)
                     self.thread_pool.start(worker)
@@ -1,13 +1,16 @@
-import os
 
-from PyQt5.QtCore import QThreadPool,pyqtSlot
-from PyQt5.QtWidgets import QTabWidget,QWidget,QVBoxLayout
+from PyQt5 import QtCore
+from PyQt5.QtCore import QThreadPool,QSize,pyqtSlot
+from PyQt5.QtWidgets import QTabWidget,QWidget,QVBoxLayout,QProgressDialog,QInputDialog
 
-from dao import DatasetDao
-from decor import gui_exception
-from util import Worker,GUIUtilities as gui,GUIUtilities
+from core import AutoLabelJob
+from dao import DatasetDao,LabelDao,AnnotaDao
+from dao.hub_dao import HubDao
+from decor import gui_exception,work_exception
+from util import Worker,GUIUtilities as gui,GUIUtilities,IngestPipeline,ColorUtilities
 from view.widgets.gallery.card import GalleryCard
 from view.widgets.gallery import GalleryAction
+from view.widgets.image_button import ImageButton
 from view.widgets.image_viewer.image_viewer import ImageViewerWidget
 from vo import DatasetEntryVO,DatasetVO
 from .gallery import Gallery
@@ -24,9 +27,16 @@ class MediaTabWidget(QWidget):
         self.media_grid.doubleClicked.connect(self.gallery_card_double_click_slot)
         delete_action=GalleryAction(gui.get_icon("delete.png"),name="delete",tooltip="delete image")
         edit_action=GalleryAction(gui.get_icon("annotations.png"),name="edit",tooltip="edit annotations")
+        auto_label_action=GalleryAction(gui.get_icon("robotic-hand.png"),name="auto_label",tooltip="auto-label")
         # view_action=GalleryAction(gui.get_icon("search.png"),name="view")
-        self.media_grid.actions=[delete_action,edit_action]
+        self.media_grid.actions=[delete_action,edit_action,auto_label_action]
         self.media_grid.cardActionClicked.connect(self.card_action_clicked_slot)
+        # labeling the whole dataset is its own toolbar action, the card action only labels the cards
+        self.btn_auto_label_all=ImageButton(icon=gui.get_icon("robotic-hand.png"),size=QSize(20,20))
+        self.btn_auto_label_all.setFixedWidth(40)
+        self.btn_auto_label_all.setToolTip("Auto-label the whole dataset")
+        self.btn_auto_label_all.clicked.connect(lambda: self.auto_label(None))
+        self.media_grid.grid_actions_layout.addWidget(self.btn_auto_label_all)
         self.setLayout(QVBoxLayout())
         self.layout().setContentsMargins(0,0,0,0)
         self.layout().addWidget(self.media_grid)
@@ -40,13 +50,12 @@ class MediaTabWidget(QWidget):
         ds_id=self._ds.id
 
         def do_work():
-            entries=self._ds_dao.fetch_entries(ds_id)
-            return entries
+            return self._ds_dao.count_entries(ds_id)
 
         def done_work(result):
-            self.media_grid.items=result
-            self.media_grid.bind()
             self.media_grid.tag=ds_id
+            self.media_grid.total_items=result
+            self.media_grid.bind()
             self._loading_dialog.close()
 
         worker=Worker(do_work)
@@ -54,27 +63,49 @@ class MediaTabWidget(QWidget):
         self._thread_pool.start(worker)
         self._loading_dialog.exec_()
 
-    def gallery_card_double_click_slot(self,card: GalleryCard,gallery: Gallery):
+    def gallery_card_double_click_slot(self,card,gallery: Gallery):
         #self.open_file(card.tag)
         pass
 
     @gui_exception
     def gallery_files_dropped_slot(self,files: []):
-        entries_list=[]
-        for file_path in files:
-            vo=DatasetEntryVO()
-            vo.file_path=file_path
-            vo.file_size=os.path.getsize(file_path)
-            vo.dataset=self._ds.id
-            entries_list.append(vo)
-
-        def do_work():
-            self._ds_dao.add_entries(entries_list)
-
-        def done_work():
+        if not files:
+            return
+        media_type="video" if self.media_grid.content_type == "Videos" else "image"
+        pipeline=IngestPipeline(self._ds_dao,self._ds.id,media_type=media_type)
+        progress_dialog=QProgressDialog("Adding files...","Cancel",0,0,self)
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        # the total grows while the folders are walked, reaching it does not mean the import is done
+        progress_dialog.setAutoReset(False)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.canceled.connect(pipeline.cancel)
+
+        @work_exception
+        def do_work(progress_callback):
+            return pipeline.run(files,progress_callback=progress_callback.emit),None
+
+        def progress_work(progress):
+            processed,discovered,added,duplicates,failed=progress
+            progress_dialog.setMaximum(discovered)
+            progress_dialog.setValue(processed)
+            progress_dialog.setLabelText("Adding files... {} of {} ({} duplicates skipped)".format(
+                added,discovered,duplicates))
+
+        @gui_exception
+        def done_work(args):
+            progress_dialog.close()
+            result,error=args
+            if error:
+                raise error
             self.load()
+            if result.duplicates or result.failed:
+                GUIUtilities.show_info_message(
+                    "{} files added, {} duplicates skipped, {} files could not be read".format(
+                        result.added,result.duplicates,result.failed),"Add files")
 
-        worker=Worker(do_work)
+        worker=Worker(do_work,progress_callback=None)
+        worker.signals.progress.connect(progress_work)
         worker.signals.result.connect(done_work)
         self._thread_pool.start(worker)
 
@@ -96,3 +127,56 @@ class MediaTabWidget(QWidget):
             self.load()
         elif action_name == "edit":
             self.open_file(item)
+        elif action_name == "auto_label":
+            # the selection when the clicked card is part of it, the clicked card otherwise
+            selected=[vo.id for vo in self.media_grid.selected_items()]
+            self.auto_label(selected if len(selected) > 1 and item.id in selected else [item.id])
+
+    @gui_exception
+    def auto_label(self,entry_ids=None):
+        """
+        Runs a hub model over the selected entries, or the whole dataset when entry_ids is None
+        """
+        models=["{} : {}".format(hub.path,model.name) for hub in HubDao().fetch_all() for model in hub.models]
+        if not models:
+            GUIUtilities.show_info_message("add a models repository first","Auto-label")
+            return
+        target="the {} selected images".format(len(entry_ids)) if entry_ids else "the whole dataset"
+        choice,ok=QInputDialog.getItem(self,"Auto-label","Model used to label {}:".format(target),models,0,False)
+        if not ok:
+            return
+        repo,model_name=choice.rsplit(" : ",1)
+        job=AutoLabelJob(self._ds.id,repo,model_name,self._ds_dao,LabelDao(),AnnotaDao(),entry_ids=entry_ids,
+                         colors=ColorUtilities.rainbow_gradient(1000)["hex"])
+        progress_dialog=QProgressDialog("Loading the model...","Cancel",0,0,self)
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(500)
+        progress_dialog.canceled.connect(job.cancel)
+
+        @work_exception
+        def do_work(progress_callback):
+            return job.run(progress_callback=progress_callback.emit),None
+
+        def progress_work(progress):
+            processed,total,annotations,speed=progress
+            progress_dialog.setMaximum(total)
+            progress_dialog.setValue(processed)
+            progress_dialog.setLabelText("Labeling images... {} of {}, {} annotations ({:.1f} images/s)".format(
+                processed,total,annotations,speed))
+
+        @gui_exception
+        def done_work(args):
+            progress_dialog.close()
+            result,error=args
+            if error:
+                raise error
+            message="{} images processed, {} annotations, {} images labeled, {} already annotated, {} unreadable".format(
+                result.processed,result.annotations,result.labeled,result.skipped,result.failed)
+            if not result.completed:
+                message+="\nthe job was cancelled, run it again to resume where it stopped"
+            GUIUtilities.show_info_message(message,"Auto-label")
+
+        worker=Worker(do_work,progress_callback=None)
+        worker.signals.progress.connect(progress_work)
+        worker.signals.result.connect(done_work)
+        self._thread_pool.start(worker)
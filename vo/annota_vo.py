@@ -1,17 +1,58 @@
+import numpy as np
+
+
 class AnnotaVO:
     def __init__(self):
+        self._id = None
         self._entry = None
         self._label = None
         self._points = None
+        self._geometry = None
         self._kind = None
 
+    @property
+    def id(self):
+        return self._id
+
+    @id.setter
+    def id(self, value):
+        self._id = value
+
     @property
     def points(self):
+        """
+        Comma separated x,y coordinates, derived from the geometry when the annotation
+        was loaded from its packed representation
+        """
+        if self._points is None and self._geometry is not None:
+            self._points = ",".join(map(str, self._geometry.ravel().tolist()))
         return self._points
 
     @points.setter
     def points(self, value):
         self._points = value
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        """
+        Coordinates as an (N, 2) numpy array of x,y rows
+        """
+        if self._geometry is None and self._points:
+            self._geometry = self.parse_points(self._points)
+        return self._geometry
+
+    @geometry.setter
+    def geometry(self, value):
+        self._geometry = None if value is None else np.asarray(value).reshape(-1, 2)
+        self._points = None
+
+    @staticmethod
+    def parse_points(text: str):
+        values = np.array(text.split(","), dtype=np.float64)
+        if np.array_equal(values, np.floor(values)):
+            values = values.astype(np.int32)
+        return values.reshape(-1, 2)
 
     @property
     def entry(self):
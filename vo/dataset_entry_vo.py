@@ -1,10 +1,19 @@
+import os
+
+
 class DatasetEntryVO:
     def __init__(self):
         self._id = None
         self._file_path =""
-        self._file_size = ""
+        self._file_name = None
+        self._file_size = 0
         self._dataset = ""
         self._label = None
+        self._width = None
+        self._height = None
+        self._channels = None
+        self._mtime = None
+        self._file_hash = None
 
     @property
     def id(self):
@@ -22,6 +31,16 @@ class DatasetEntryVO:
     def file_path(self,value):
         self._file_path = value
 
+    @property
+    def file_name(self):
+        if self._file_name is None and self._file_path:
+            return os.path.basename(self._file_path)
+        return self._file_name
+
+    @file_name.setter
+    def file_name(self, value):
+        self._file_name = value
+
     @property
     def file_size(self):
         return self._file_size
@@ -38,8 +57,49 @@ class DatasetEntryVO:
     def dataset(self, value):
         self._dataset = value
 
+    @property
+    def width(self):
+        return self._width
+
+    @width.setter
+    def width(self, value):
+        self._width = value
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, value):
+        self._height = value
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @channels.setter
+    def channels(self, value):
+        self._channels = value
+
+    @property
+    def mtime(self):
+        return self._mtime
+
+    @mtime.setter
+    def mtime(self, value):
+        self._mtime = value
+
+    @property
+    def file_hash(self):
+        return self._file_hash
+
+    @file_hash.setter
+    def file_hash(self, value):
+        self._file_hash = value
+
     def to_array(self):
-        return [self.file_path,self.file_size,self.dataset, None]
+        return [self.file_path,self.file_size,self.dataset,None,
+                self.width,self.height,self.channels,self.mtime,self.file_hash,self.file_name]
 
     @property
     def label(self):